@@ -1,20 +1,108 @@
 from db import CellDataLoader
+from outputs import patch_output, write_output
+import argparse
+import os
 import pandas as pd
 
+# Query computing the cell population frequencies per sample, inserted straight into 'cell_summary'
+SUMMARY_QUERY = """
+    INSERT INTO cell_summary (sample, total_count, cell_type_id, count, percentage)
+    SELECT
+        c.sample,
+        SUM(c.count) OVER (PARTITION BY c.sample) AS total_count,
+        c.cell_type_id,
+        c.count,
+        ROUND(100.0 * c.count / SUM(c.count) OVER (PARTITION BY c.sample), 2) AS percentage
+    FROM cell_counts AS c
+    ORDER BY c.sample, c.cell_type_id
+"""
+
+# Query recomputing the cell population frequencies of the samples changed by the last load
+CHANGED_SUMMARY_QUERY = """
+    INSERT INTO cell_summary (sample, total_count, cell_type_id, count, percentage)
+    SELECT
+        c.sample,
+        SUM(c.count) OVER (PARTITION BY c.sample) AS total_count,
+        c.cell_type_id,
+        c.count,
+        ROUND(100.0 * c.count / SUM(c.count) OVER (PARTITION BY c.sample), 2) AS percentage
+    FROM cell_counts AS c
+    WHERE c.sample IN (SELECT sample FROM changed_samples)
+    ORDER BY c.sample, c.cell_type_id
+"""
+
+# Query reading 'cell_summary' for the output file, with the cell type ids decoded into population names
+SUMMARY_OUTPUT_QUERY = """
+    SELECT
+        cs.sample,
+        cs.total_count,
+        ct.cell_type AS population,
+        cs.count,
+        cs.percentage
+    FROM cell_summary AS cs
+    JOIN cell_types AS ct ON ct.cell_type_id = cs.cell_type_id
+    ORDER BY cs.sample, ct.cell_type
+"""
+
+# Query reading the 'cell_summary' rows of the samples changed by the last load for the output file
+CHANGED_OUTPUT_QUERY = """
+    SELECT
+        cs.sample,
+        cs.total_count,
+        ct.cell_type AS population,
+        cs.count,
+        cs.percentage
+    FROM cell_summary AS cs
+    JOIN cell_types AS ct ON ct.cell_type_id = cs.cell_type_id
+    WHERE cs.sample IN (SELECT sample FROM changed_samples)
+    ORDER BY cs.sample, ct.cell_type
+"""
+
 class CellPopulationSummary:
     """
     Compute the relative frequencies of immune cell populations for each sample.
     """
 
-    def __init__(self, db_path="code/cell_data.db"):
-        self.loader = CellDataLoader(db_path)
+    def __init__(self, db_path="code/cell_data.db", profile="read_write", loader=None):
+        # Use the given loader (e.g. the pipeline's shared connection) or open a new connection
+        self.loader = loader or CellDataLoader(db_path, profile)
+
+    def build_summary(self, incremental=False):
+        """
+        Compute the relative frequencies of immune cell populations for each sample into the 'cell_summary'
+        table, without writing the output files.
+
+        By default the table is rebuilt from all of 'cell_counts' with a single INSERT ... SELECT. In
+        incremental mode only the rows of the samples listed in 'changed_samples' by the last load are deleted
+        and recomputed.
+        """
+
+        if incremental:
+            # Replace the rows of the changed samples, keeping the existing index up to date
+            self.loader.create_indexes("cell_summary")
+            self.loader.cursor.execute("DELETE FROM cell_summary WHERE sample IN (SELECT sample FROM changed_samples)")
+            self.loader.cursor.execute(CHANGED_SUMMARY_QUERY)
+        else:
+            # Recreate the table and fill it in one statement, indexing it once it is fully written
+            self.loader.create_cell_summary_table()
+            self.loader.cursor.execute(SUMMARY_QUERY)
+            self.loader.create_indexes("cell_summary")
 
-    def compute_summary(self):
+        # Give the table a new version and commit the change
+        self.loader.mark_changed("cell_summary")
+        self.loader.conn.commit()
+
+    def write_summary(self, incremental=False, output_path="output/cell_summary.csv"):
         """
-        Compute the relative frequencies of immune cell populations for each sample.
+        Save the 'cell_summary' table, with the population names decoded, to the output files.
+
+        In incremental mode only the rows of the samples listed in 'changed_samples' are read from the
+        database and spliced into the existing output (see outputs.patch_output), which is left untouched
+        when no sample changed. The output files are still rewritten in full, but not parsed and re-sorted.
 
         Output:
-            A CSV file 'cell_summary.csv' containing the following columns:
+            A CSV file 'cell_summary.csv' and an Arrow IPC file 'cell_summary.arrow',
+            both containing the following columns:
             - subject: ID of the subject
             - total_count: total number of cells in the sample
             - population: immune cell type
@@ -22,40 +110,43 @@ class CellPopulationSummary:
             - percentage: relative frequency of the cell type within the sample (%)
         """
 
-        # Write the query to compute the cell population frequencies per sample
-        query = """
-                    SELECT
-                        c.sample,
-                        SUM(c.count) OVER (PARTITION BY c.sample) AS total_count,
-                        c.cell_type AS population,
-                        c.count,
-                        ROUND(100.0 * c.count / SUM(c.count) OVER (PARTITION BY c.sample), 2) AS percentage
-                    FROM cell_counts AS c
-                    ORDER BY c.sample, c.cell_type
-                """
+        if incremental and os.path.exists(output_path):
+            # Read only the rows of the changed samples
+            changed_df = pd.read_sql_query(CHANGED_OUTPUT_QUERY, self.loader.conn)
+            if changed_df.empty:
+                return
 
-        # Execute the query
-        self.loader.cursor.execute(query)
+            # Splice the changed samples' rows into the existing output, which is sorted by sample
+            patch_output(changed_df, output_path, "sample")
+            return
 
-        # Fetch the rows from the database
-        rows = self.loader.cursor.fetchall()
+        # Read the table with the population names decoded for the output
+        cell_summary_df = pd.read_sql_query(SUMMARY_OUTPUT_QUERY, self.loader.conn)
 
-        # Create a DataFrame based on the information in the database
-        cell_summary_df = pd.DataFrame(rows, columns=['sample', 'total_count', 'population', 'count', 'percentage'])
+        # Save the DataFrame information in a CSV file and an Arrow IPC file
+        write_output(cell_summary_df, output_path)
 
-        # Store the DataFrame information in a database
-        cell_summary_df.to_sql('cell_summary', self.loader.conn, if_exists='replace', index=False)
+    def compute_summary(self, incremental=False):
+        """
+        Compute the relative frequencies of immune cell populations for each sample (see build_summary)
+        and save them to the output files (see write_summary).
+        """
 
-        # Save the DataFrame information in a CSV file
-        csv_filename = "output/cell_summary.csv"
-        cell_summary_df.to_csv(csv_filename, index=False)
+        self.build_summary(incremental)
+        self.write_summary(incremental)
 
 def main():
+    # Parse the options from the command line
+    parser = argparse.ArgumentParser(description="Compute the cell population frequencies per sample.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="recompute only the samples changed by the last incremental load")
+    args = parser.parse_args()
+
     # Create an instance of CellPopulationSummary
     summarizer = CellPopulationSummary()
 
     # Compute the cell population frequencies per sample
-    summarizer.compute_summary()
+    summarizer.compute_summary(incremental=args.incremental)
 
 if __name__ == "__main__":
     main()
@@ -1,22 +1,54 @@
+from cohorts import RESPONSE_COHORT, CohortQueryEngine
 from db import CellDataLoader
+from outputs import write_output
 import pandas as pd
 
+# Query reading 'cell_response' for the output file, with the responses and populations decoded
+RESPONSE_OUTPUT_QUERY = """
+    SELECT
+        cr.subject,
+        r.response,
+        ct.cell_type AS population,
+        cr.total_population_count,
+        cr.total_count,
+        cr.percentage
+    FROM cell_response AS cr
+    JOIN responses AS r ON r.response_id = cr.response_id
+    JOIN cell_types AS ct ON ct.cell_type_id = cr.cell_type_id
+    ORDER BY cr.subject, ct.cell_type
+"""
+
 class CellResponseAnalysis:
     """
     Compute the relative cell population frequencies of PBMC samples from melanoma patients
     treated with miraclib, stratified by response (yes/no).
     """
 
-    def __init__(self, db_path="code/cell_data.db"):
-        self.loader = CellDataLoader(db_path)
+    def __init__(self, db_path="code/cell_data.db", profile="read_write", loader=None):
+        # Use the given loader (e.g. the pipeline's shared connection) or open a new connection
+        self.loader = loader or CellDataLoader(db_path, profile)
+        self.engine = CohortQueryEngine(self.loader)
 
-    def compute_response(self):
+    def build_response(self, cohort=RESPONSE_COHORT):
+        """
+        Compute the relative cell population frequencies of the subjects of a cohort (by default PBMC samples
+        from melanoma patients treated with miraclib), stratified by response (yes/no), into the
+        'cell_response' table, which CellResponseStatistics reads, without writing the output files.
         """
-        Compute the relative cell population frequencies of PBMC samples from melanoma patients
-        treated with miraclib, stratified by response (yes/no).
+
+        # Recreate the 'cell_response' table and fill it with the cohort's frequencies in one statement
+        self.engine.fill_cell_response(cohort)
+
+        # Commit the change
+        self.loader.conn.commit()
+
+    def write_response(self, output_path="output/cell_response.csv"):
+        """
+        Save the 'cell_response' table, with the responses and populations decoded, to the output files.
 
         Output:
-            A CSV file 'cell_response.csv' containing the following columns:
+            A CSV file at 'output_path' ('cell_response.csv' by default) and an Arrow IPC file next to it
+            ('cell_response.arrow'), both containing the following columns:
             - subject: ID of the subject
             - response: the subject's response to miraclib treatment ('yes' or 'no')
             - population: immune cell type for which the frequency is calculated
@@ -25,37 +57,20 @@ class CellResponseAnalysis:
             - percentage: relative frequency of the cell type for the subject (%)
         """
 
-        # Write the query to compute the cell population frequencies for melanoma patients
-        query = """
-                    SELECT
-                        su.subject,
-                        sa.response,
-                        c.population,
-                        SUM(c.count) AS total_population_count,
-                        SUM(c.total_count) AS total_count,
-                        ROUND(100.0 * SUM(c.count) / SUM(c.total_count), 2) AS percentage
-                    FROM subjects AS su
-                    JOIN samples AS sa ON sa.subject = su.subject
-                    JOIN cell_summary AS c ON c.sample = sa.sample
-                    WHERE sa.condition = "melanoma" AND sa.treatment = "miraclib" AND sa.sample_type = "PBMC"
-                          AND (sa.response = "yes" OR sa.response = "no")
-                    GROUP BY su.subject, c.population, sa.response
-                    ORDER BY su.subject, c.population;
-                """
-
-        # Execute the query
-        self.loader.cursor.execute(query)
+        # Read the table with the responses and populations decoded for the output
+        cell_response_df = pd.read_sql_query(RESPONSE_OUTPUT_QUERY, self.loader.conn)
 
-        # Fetch the rows from the database
-        rows = self.loader.cursor.fetchall()
+        # Save the DataFrame information in a CSV file and an Arrow IPC file
+        write_output(cell_response_df, output_path)
 
-        # Create a DataFrame based on the information in the database
-        cell_response_df = pd.DataFrame(rows, columns=['subject', 'response', 'population',
-                                                       'total_population_count', 'total_count', 'percentage'])
+    def compute_response(self, cohort=RESPONSE_COHORT, output_path="output/cell_response.csv"):
+        """
+        Compute the frequencies of a cohort (see build_response) and save them to the output files
+        (see write_response).
+        """
 
-        # Save the DataFrame information in a CSV file
-        csv_filename = "output/cell_response.csv"
-        cell_response_df.to_csv(csv_filename, index=False)
+        self.build_response(cohort)
+        self.write_response(output_path)
 
 def main():
     # Create an instance of CellResponseAnalysis
@@ -0,0 +1,144 @@
+from db import CellDataLoader
+from outputs import write_output
+from stats_engine import benjamini_hochberg, compare_groups
+import pandas as pd
+import statsmodels.formula.api as smf
+
+# Query reading the per-subject cell population frequencies written by CellResponseAnalysis
+STATS_INPUT_QUERY = """
+    SELECT
+        cr.subject,
+        r.response,
+        cr.cell_type_id,
+        cr.percentage
+    FROM cell_response AS cr
+    JOIN responses AS r ON r.response_id = cr.response_id
+    ORDER BY cr.cell_type_id, cr.subject
+"""
+
+# Query reading 'cell_response_stats' for the output file, with the populations decoded
+STATS_OUTPUT_QUERY = """
+    SELECT
+        ct.cell_type AS population,
+        s.method,
+        s.statistic,
+        s.p_value,
+        s.effect_size,
+        s.p_adjusted,
+        s.responders,
+        s.non_responders
+    FROM cell_response_stats AS s
+    JOIN cell_types AS ct ON ct.cell_type_id = s.cell_type_id
+    ORDER BY ct.cell_type
+"""
+
+def fit_mixed_model(cell_df):
+    """
+    Fit a Linear Mixed-Effects Model of one cell population's frequency on the response, which accounts
+    for repeated measures within subjects that have mixed responses.
+
+    Returns:
+        A tuple (statistic, p_value) for the 'yes' response coefficient, either of which may be None.
+    """
+
+    result = smf.mixedlm("percentage ~ response", cell_df, groups=cell_df["subject"]).fit()
+    return result.tvalues.get('response[T.yes]', None), result.pvalues.get('response[T.yes]', None)
+
+class CellResponseStatistics:
+    """
+    Compare the relative frequency of every immune cell population between responders and non-responders
+    once, so the dashboard only reads the results.
+    """
+
+    def __init__(self, db_path="code/cell_data.db", profile="read_write", loader=None):
+        # Use the given loader (e.g. the pipeline's shared connection) or open a new connection
+        self.loader = loader or CellDataLoader(db_path, profile)
+
+    def build_statistics(self):
+        """
+        Test every cell population in the 'cell_response' table and store the results in the
+        'cell_response_stats' table, without writing the output files.
+
+        All populations are tested in one vectorized pass of the Wilcoxon rank-sum test (see stats_engine.py),
+        and the p-values are adjusted for the false discovery rate across populations.
+        """
+
+        # Read the per-subject frequencies
+        cell_response_df = pd.read_sql_query(STATS_INPUT_QUERY, self.loader.conn)
+
+        # Run the rank-sum test on every cell population at once
+        results = compare_groups(cell_response_df, feature='cell_type_id')
+        results["method"] = "ranksums"
+
+        # The rank-sum test assumes independent samples, so the populations of subjects with mixed responses
+        # are tested with a mixed-effects model instead
+        response_counts = cell_response_df.groupby(['cell_type_id', 'subject'])['response'].nunique()
+        mixed = (response_counts > 1).groupby(level='cell_type_id').any()
+        for cell_type_id in mixed[mixed].index:
+            cell_df = cell_response_df[cell_response_df['cell_type_id'] == cell_type_id]
+            statistic, p_value = fit_mixed_model(cell_df)
+            results.loc[cell_type_id, ["method", "statistic", "p_value"]] = ["mixedlm", statistic, p_value]
+
+        # Adjust the p-values for the number of populations tested
+        results["p_adjusted"] = benjamini_hochberg(results["p_value"].to_numpy(dtype=float))
+
+        # Store the missing statistics as NULL
+        results = results.astype(object).where(results.notna(), None)
+        rows = [(int(cell_type_id), row.method, row.statistic, row.p_value, row.effect_size, row.p_adjusted,
+                 int(row.n_first), int(row.n_second)) for cell_type_id, row in results.iterrows()]
+
+        # Recreate the 'cell_response_stats' table and store the results
+        self.loader.create_cell_response_stats_table()
+        self.loader.cursor.executemany(
+            """
+            INSERT INTO cell_response_stats (cell_type_id, method, statistic, p_value, effect_size, p_adjusted,
+                                             responders, non_responders)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows
+        )
+
+        # Give the table a new version and commit the change
+        self.loader.mark_changed("cell_response_stats")
+        self.loader.conn.commit()
+
+    def write_statistics(self):
+        """
+        Save the 'cell_response_stats' table, with the populations decoded, to the output files.
+
+        Output:
+            A CSV file 'cell_response_stats.csv' and an Arrow IPC file 'cell_response_stats.arrow',
+            both containing the following columns:
+            - population: immune cell type
+            - method: 'ranksums' (Wilcoxon rank-sum test) or 'mixedlm' (Linear Mixed-Effects Model)
+            - statistic: z score of the test
+            - p_value: p-value of the difference between responders and non-responders
+            - effect_size: rank-biserial correlation of responders vs. non-responders
+            - p_adjusted: Benjamini-Hochberg adjusted p-value across all populations
+            - responders / non_responders: number of subject rows in each group
+        """
+
+        # Read the table with the populations decoded for the output
+        cell_response_stats_df = pd.read_sql_query(STATS_OUTPUT_QUERY, self.loader.conn)
+
+        # Save the DataFrame information in a CSV file and an Arrow IPC file
+        write_output(cell_response_stats_df, "output/cell_response_stats.csv")
+
+    def compute_statistics(self):
+        """
+        Test every cell population (see build_statistics) and save the results to the output files
+        (see write_statistics).
+        """
+
+        self.build_statistics()
+        self.write_statistics()
+
+def main():
+    # Create an instance of CellResponseStatistics
+    statistician = CellResponseStatistics()
+
+    # Compare every cell population between responders and non-responders
+    statistician.compute_statistics()
+
+if __name__ == "__main__":
+    main()
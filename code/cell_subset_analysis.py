@@ -1,144 +1,213 @@
+from cohorts import BASELINE_COHORT, Cohort, CohortQueryEngine
 from db import CellDataLoader
+from outputs import write_output
 import pandas as pd
 
+# Age bands of the age summary in increasing order, as (label, first age of the next band); the last band is open
+AGE_BANDS = [("<50", 50), ("50-59", 60), ("60-69", 70), ("70-79", 80), ("80+", None)]
+
+# Queries reading the baseline samples copied into the temporary 'baseline_samples' table by
+# CellSubsetAnalysis.baseline_samples, so each summary groups the filtered samples instead of re-joining
+# and re-filtering 'subjects' and 'samples'
+
+# Query counting the baseline samples in each project
+PROJECT_QUERY = """
+    SELECT
+        p.project,
+        COUNT(*)
+    FROM baseline_samples AS b
+    JOIN projects AS p ON p.project_id = b.project_id
+    GROUP BY b.project_id
+"""
+
+# Responses counted by the response summary, compiled by the cohort engine into a condition on the
+# temporary table's response_id column with bound parameters
+RESPONSE_FILTER = Cohort("responders", response=("yes", "no"))
+RESPONSE_CONDITIONS, RESPONSE_PARAMS = RESPONSE_FILTER.conditions("r", {"response": "b.response_id"})
+
+# Query counting the baseline subjects in each counted response
+RESPONSE_SUMMARY_QUERY = """
+    SELECT
+        r.response,
+        COUNT(*)
+    FROM baseline_samples AS b
+    JOIN responses AS r ON r.response_id = b.response_id
+    WHERE {conditions}
+    GROUP BY b.response_id
+""".format(conditions=" AND ".join(RESPONSE_CONDITIONS))
+
+# Query counting the baseline subjects in each gender
+GENDER_QUERY = """
+    SELECT
+        b.sex,
+        COUNT(*)
+    FROM baseline_samples AS b
+    GROUP BY b.sex
+"""
+
+# Query counting the baseline subjects in each age band, numbered in the order of AGE_BANDS (subjects of
+# unknown age get the number after the last band)
+AGE_QUERY = """
+    SELECT
+        CASE
+            WHEN b.age IS NULL THEN {unknown}
+            {bands}
+            ELSE {last}
+        END AS band,
+        COUNT(*)
+    FROM baseline_samples AS b
+    GROUP BY band
+    ORDER BY band
+""".format(
+    unknown=len(AGE_BANDS),
+    bands="\n            ".join(f"WHEN b.age < {end} THEN {number}"
+                                 for number, (_, end) in enumerate(AGE_BANDS[:-1])),
+    last=len(AGE_BANDS) - 1
+)
+
 class CellSubsetAnalysis:
     """
-    Analyze and summarize subsets of melanoma PBMC baseline samples treated with Miraclib.
+    Analyze and summarize subsets of a cohort's baseline samples, by default melanoma PBMC baseline samples
+    treated with Miraclib (see cohorts.BASELINE_COHORT).
+
+    The cohort's samples are filtered once into a temporary table, from which every summary is grouped.
 
     This class provides methods to:
         1. Count the number of samples per project.
         2. Count the number of subjects who are responders or non-responders.
         3. Count the number of subjects by sex (male/female).
+        4. Count the number of subjects by age band.
     """
 
-    def __init__(self, db_path="code/cell_data.db"):
-        self.loader = CellDataLoader(db_path)
+    def __init__(self, db_path="code/cell_data.db", profile="read_write", loader=None, cohort=BASELINE_COHORT):
+        # Use the given loader (e.g. the pipeline's shared connection) or open a new connection
+        self.loader = loader or CellDataLoader(db_path, profile)
+        self.engine = CohortQueryEngine(self.loader)
+        self.cohort = cohort
+        self.materialized = False
+
+    def baseline_samples(self):
+        """
+        Filter the cohort's samples into the temporary 'baseline_samples' table, once per instance.
+        """
+
+        if not self.materialized:
+            self.engine.materialize(self.cohort, "baseline_samples")
+            self.materialized = True
+
+    def count_by(self, query, params=()):
+        """
+        Run a summary query, with its bound parameters, on the baseline samples.
+
+        Returns:
+            A list of (group, count) rows.
+        """
+
+        self.baseline_samples()
+        self.loader.cursor.execute(query, params)
+        return self.loader.cursor.fetchall()
+
+    def compute_all(self):
+        """
+        Compute every summary from one pass over the cohort's samples, then drop the temporary table.
+        """
+
+        self.samples_per_project()
+        self.subjects_by_response()
+        self.subjects_by_sex()
+        self.subjects_by_age()
+
+        self.loader.cursor.execute("DROP TABLE IF EXISTS temp.baseline_samples")
+        self.materialized = False
 
     def samples_per_project(self):
         """
         Compute number of samples per project.
 
         Output:
-            A CSV file 'cell_samples_per_project.csv' containing the following columns:
+            A CSV file 'cell_project_summary.csv' and an Arrow IPC file 'cell_project_summary.arrow',
+            both containing the following columns:
             - project: project name
             - sample_count: number of samples in each project
         """
 
-        # Write the query to compute the number of samples in each project for melanoma patients
-        query = """
-                    SELECT
-                        p.project,
-                        COUNT(sa.sample)
-                    FROM subjects AS su
-                    JOIN samples AS sa ON sa.subject = su.subject
-                    JOIN projects AS p ON p.project_id = sa.project_id
-                    WHERE sa.condition = "melanoma"
-                      AND sa.treatment = "miraclib"
-                      AND sa.sample_type = "PBMC"
-                      AND sa.time_from_treatment_start = 0
-                    GROUP BY sa.project_id
-                """
-
-        # Execute the query
-        self.loader.cursor.execute(query)
-
-        # Fetch the rows from the database
-        rows = self.loader.cursor.fetchall()
+        # Count the baseline samples in each project
+        rows = self.count_by(PROJECT_QUERY)
 
         # Create a DataFrame based on the information in the database
         cell_samples_per_project_df = pd.DataFrame(rows, columns=['project', 'sample_count'])
 
-        # Save the DataFrame information in a CSV file
-        csv_filename = "output/cell_project_summary.csv"
-        cell_samples_per_project_df.to_csv(csv_filename, index=False)
+        # Save the DataFrame information in a CSV file and an Arrow IPC file
+        write_output(cell_samples_per_project_df, "output/cell_project_summary.csv")
 
     def subjects_by_response(self):
         """
         Compute number of subjects in each response.
 
         Output:
-            A CSV file 'cell_subjects_by_response.csv' containing the following columns:
+            A CSV file 'cell_response_summary.csv' and an Arrow IPC file 'cell_response_summary.arrow',
+            both containing the following columns:
             - response: ways a subject could respond after miraclib treatment
             - subject_count: number of subjects in each response
         """
 
-        # Write a query to find how many melanoma patients were responders/non-responders
-        query = """
-                    SELECT
-                        sa.response,
-                        COUNT(sa.subject)
-                    FROM subjects AS su
-                    JOIN samples AS sa ON sa.subject = su.subject
-                    WHERE sa.condition = "melanoma"
-                      AND sa.treatment = "miraclib"
-                      AND sa.sample_type = "PBMC"
-                      AND sa.time_from_treatment_start = 0
-                      AND sa.response IN ("yes", "no")
-                     GROUP BY sa.response
-                """
-
-        # Execute the query
-        self.loader.cursor.execute(query)
-
-        # Fetch the rows from the database
-        rows = self.loader.cursor.fetchall()
+        # Count the baseline subjects with a yes/no response
+        rows = self.count_by(RESPONSE_SUMMARY_QUERY, RESPONSE_PARAMS)
 
         # Create a DataFrame based on the information in the database
         cell_subjects_by_response_df = pd.DataFrame(rows, columns=['response', 'subject_count'])
 
-        # Save the DataFrame information in a CSV file
-        csv_filename = "output/cell_response_summary.csv"
-        cell_subjects_by_response_df .to_csv(csv_filename, index=False)
+        # Save the DataFrame information in a CSV file and an Arrow IPC file
+        write_output(cell_subjects_by_response_df, "output/cell_response_summary.csv")
 
     def subjects_by_sex(self):
         """
         Compute number of subjects in each gender.
 
         Output:
-            A CSV file 'cell_subjects_by_gender.csv' containing the following columns:
+            A CSV file 'cell_gender_summary.csv' and an Arrow IPC file 'cell_gender_summary.arrow',
+            both containing the following columns:
             - gender: the gender of the subject
             - subject_count: number of subjects in each gender
         """
 
-        # Write a query to find how many melanoma patients were male/female
-        query = """
-                    SELECT
-                        su.sex,
-                        COUNT(sa.subject)
-                    FROM subjects AS su
-                    JOIN samples AS sa ON sa.subject = su.subject
-                    WHERE sa.condition = "melanoma"
-                      AND sa.treatment = "miraclib"
-                      AND sa.sample_type = "PBMC"
-                      AND sa.time_from_treatment_start = 0
-                     GROUP BY su.sex
-                """
-
-        # Execute the query
-        self.loader.cursor.execute(query)
-
-        # Fetch the rows from the database
-        rows = self.loader.cursor.fetchall()
+        # Count the baseline subjects of each sex
+        rows = self.count_by(GENDER_QUERY)
 
         # Create a DataFrame based on the information in the database
         cell_subjects_by_gender_df = pd.DataFrame(rows, columns=['gender', 'subject_count'])
 
-        # Save the DataFrame information in a CSV file
-        csv_filename = "output/cell_gender_summary.csv"
-        cell_subjects_by_gender_df.to_csv(csv_filename, index=False)
+        # Save the DataFrame information in a CSV file and an Arrow IPC file
+        write_output(cell_subjects_by_gender_df, "output/cell_gender_summary.csv")
+
+    def subjects_by_age(self):
+        """
+        Compute number of subjects in each age band (see AGE_BANDS).
+
+        Output:
+            A CSV file 'cell_age_summary.csv' and an Arrow IPC file 'cell_age_summary.arrow',
+            both containing the following columns:
+            - age_band: the age band of the subject ('unknown' if the age is missing)
+            - subject_count: number of subjects in each age band
+        """
+
+        # Count the baseline subjects in each age band and label the bands
+        labels = [label for label, _ in AGE_BANDS] + ["unknown"]
+        rows = [(labels[band], count) for band, count in self.count_by(AGE_QUERY)]
+
+        # Create a DataFrame based on the information in the database
+        cell_subjects_by_age_df = pd.DataFrame(rows, columns=['age_band', 'subject_count'])
+
+        # Save the DataFrame information in a CSV file and an Arrow IPC file
+        write_output(cell_subjects_by_age_df, "output/cell_age_summary.csv")
 
 def main():
     # Create an instance of CellSubsetAnalysis
     analyzer = CellSubsetAnalysis()
 
-    # Compute the number of relevant samples in each project
-    analyzer.samples_per_project()
-
-    # Compute the number of subjects in the yes/no response
-    analyzer.subjects_by_response()
-
-    # Compute the number of subjects in M/F
-    analyzer.subjects_by_sex()
+    # Compute the number of relevant samples in each project, the number of subjects in the yes/no response,
+    # in M/F and in each age band, all from one pass over the samples
+    analyzer.compute_all()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,257 @@
+from db import DIMENSIONS
+import pandas as pd
+
+# Columns a cohort can be filtered on, as column -> SQL expression of the column in the 'samples' (sa) and
+# 'subjects' (su) tables. Dictionary-encoded columns are compared through their lookup table (see DIMENSIONS).
+COHORT_COLUMNS = {
+    "project": "sa.project_id",
+    "condition": "sa.condition_id",
+    "treatment": "sa.treatment_id",
+    "sample_type": "sa.sample_type_id",
+    "time_from_treatment_start": "sa.time_from_treatment_start",
+    "response": "sa.response_id",
+    "sex": "su.sex"
+}
+
+# Columns the cohorts can be broken down by, as column -> (expression selected as the group, joined lookup
+# table, expression grouped by). Groups come out in the order of the grouped expression.
+GROUP_COLUMNS = {
+    "project": ("p.project", "JOIN projects AS p ON p.project_id = sa.project_id", "sa.project_id"),
+    "response": ("r.response", "JOIN responses AS r ON r.response_id = sa.response_id", "sa.response_id"),
+    "sex": ("su.sex", "", "su.sex")
+}
+
+# Query counting the samples of a batch of cohorts in each group in one pass over 'samples'. The per-cohort
+# counts and the combined filter of the batch are filled in by CohortQueryEngine.count_query.
+COUNT_QUERY = """
+    SELECT
+        {group} AS grp,
+        {counts}
+    FROM subjects AS su
+    JOIN samples AS sa ON sa.subject = su.subject
+    {join}
+    WHERE {conditions}
+    GROUP BY {group_by}
+"""
+
+# Query computing the cell population frequencies of the subjects of a cohort by response, inserted straight
+# into 'cell_response'. The cohort filter is filled in by CohortQueryEngine.response_query.
+RESPONSE_QUERY = """
+    INSERT INTO cell_response (subject, response_id, cell_type_id, total_population_count, total_count, percentage)
+    SELECT
+        su.subject,
+        sa.response_id,
+        c.cell_type_id,
+        SUM(c.count) AS total_population_count,
+        SUM(c.total_count) AS total_count,
+        ROUND(100.0 * SUM(c.count) / SUM(c.total_count), 2) AS percentage
+    FROM subjects AS su
+    JOIN samples AS sa ON sa.subject = su.subject
+    JOIN cell_summary AS c ON c.sample = sa.sample
+    WHERE {conditions}
+    GROUP BY su.subject, c.cell_type_id, sa.response_id
+"""
+
+# Query copying the samples of a cohort with the columns of the subset summaries into a temporary table, so the
+# summaries group the filtered samples without scanning 'samples' again. The cohort filter is filled in by
+# CohortQueryEngine.materialize_query.
+MATERIALIZE_QUERY = """
+    CREATE TEMP TABLE {table} AS
+    SELECT
+        sa.sample,
+        sa.subject,
+        sa.project_id,
+        sa.response_id,
+        su.sex,
+        su.age
+    FROM subjects AS su
+    JOIN samples AS sa ON sa.subject = su.subject
+    WHERE {conditions}
+"""
+
+class Cohort:
+    """
+    Specification of a cohort of samples by the values of its clinical columns (see COHORT_COLUMNS).
+
+    Every filter is either a single value or a list of accepted values; columns that are not given (or None)
+    are not filtered. A cohort only describes the samples; CohortQueryEngine compiles it into SQL.
+    """
+
+    def __init__(self, name, **filters):
+        unknown = set(filters) - set(COHORT_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown cohort columns {sorted(unknown)}. Choose from {list(COHORT_COLUMNS)}.")
+
+        self.name = name
+
+        # Store every filter as a tuple of accepted values, in the order of COHORT_COLUMNS
+        self.filters = {column: tuple(filters[column]) if isinstance(filters[column], (list, tuple, set))
+                        else (filters[column],)
+                        for column in COHORT_COLUMNS if filters.get(column) is not None}
+
+    def where(self, name=None, **filters):
+        """
+        Return a copy of the cohort with some filters added or replaced, or removed when set to None.
+        """
+
+        return Cohort(name or self.name, **{**self.filters, **filters})
+
+    def shape(self):
+        """
+        Return the filtered columns and their number of values, which determine the compiled SQL.
+        """
+
+        return tuple((column, len(values)) for column, values in self.filters.items())
+
+    def conditions(self, prefix, columns=COHORT_COLUMNS):
+        """
+        Compile the filters into SQL conditions with named parameters.
+
+        Args:
+            prefix: prefix of the parameter names, keeping the parameters of several cohorts apart.
+            columns: SQL expression of each column, by default in the 'samples' and 'subjects' tables.
+
+        Returns:
+            A tuple (conditions, params) of a list of SQL conditions and the dictionary of their parameters.
+        """
+
+        conditions, params = [], {}
+        for column, values in self.filters.items():
+            names = [f"{prefix}_{column}_{i}" for i in range(len(values))]
+            params.update(zip(names, values))
+
+            # A single value is compared with '=' and several values with 'IN'
+            single = len(names) == 1
+            accepted = f"= :{names[0]}" if single else "IN (" + ", ".join(f":{name}" for name in names) + ")"
+
+            # Compare dictionary-encoded columns through their lookup table, so the indexed id column is searched
+            if column in DIMENSIONS:
+                table, id_col = DIMENSIONS[column]
+                lookup = f"(SELECT {id_col} FROM {table} WHERE {column} {accepted})"
+                conditions.append(f"{columns[column]} {'=' if single else 'IN'} {lookup}")
+            else:
+                conditions.append(f"{columns[column]} {accepted}")
+
+        return conditions, params
+
+# Cohort of the response analysis: PBMC samples of melanoma patients treated with miraclib with a known response
+RESPONSE_COHORT = Cohort("melanoma_miraclib_pbmc", condition="melanoma", treatment="miraclib", sample_type="PBMC",
+                         response=("yes", "no"))
+
+# Cohort of the subset analysis: the same samples taken at baseline, whatever the response
+BASELINE_COHORT = Cohort("melanoma_miraclib_pbmc_baseline", condition="melanoma", treatment="miraclib",
+                         sample_type="PBMC", time_from_treatment_start=0)
+
+class CohortQueryEngine:
+    """
+    Compile cohort specifications into parameterized SQL and run them on a database connection.
+
+    The SQL of a query depends only on the shape of its cohorts (which columns are filtered and by how many
+    values), never on the values, which are bound as parameters. Compiled SQL is kept per shape, and sqlite3
+    keeps the prepared statement of every recently run SQL text, so cohorts of the same shape reuse one
+    compiled statement.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.statements = {}
+
+    def compile(self, key, build):
+        """
+        Return the SQL compiled for a key, building it with 'build' the first time.
+        """
+
+        if key not in self.statements:
+            self.statements[key] = build()
+        return self.statements[key]
+
+    def response_query(self, cohort):
+        """
+        Compile the query filling 'cell_response' with the frequencies of a cohort.
+
+        Returns:
+            A tuple (query, params).
+        """
+
+        conditions, params = cohort.conditions("c0")
+        query = self.compile(("response", cohort.shape()),
+                             lambda: RESPONSE_QUERY.format(conditions=" AND ".join(conditions) or "1"))
+        return query, params
+
+    def materialize_query(self, cohort, table):
+        """
+        Compile the query copying the samples of a cohort into a temporary table.
+
+        Returns:
+            A tuple (query, params).
+        """
+
+        conditions, params = cohort.conditions("c0")
+        query = self.compile(("materialize", table, cohort.shape()),
+                             lambda: MATERIALIZE_QUERY.format(table=table,
+                                                              conditions=" AND ".join(conditions) or "1"))
+        return query, params
+
+    def materialize(self, cohort, table="cohort_samples"):
+        """
+        Copy the samples of a cohort into a temporary table in one pass over 'samples', replacing any earlier
+        copy. The table has the columns sample, subject, project_id, response_id, sex and age, and lives until
+        it is dropped or the connection is closed.
+        """
+
+        query, params = self.materialize_query(cohort, table)
+        self.loader.cursor.execute(f"DROP TABLE IF EXISTS temp.{table}")
+        self.loader.cursor.execute(query, params)
+
+    def count_query(self, group, cohorts):
+        """
+        Compile the query counting the samples of a batch of cohorts in each group of a column.
+
+        Returns:
+            A tuple (query, params).
+        """
+
+        if group not in GROUP_COLUMNS:
+            raise ValueError(f"Unknown group column '{group}'. Choose one of {list(GROUP_COLUMNS)}.")
+        if len({cohort.name for cohort in cohorts}) != len(cohorts):
+            raise ValueError("Every cohort of a batch needs a different name.")
+
+        compiled = [cohort.conditions(f"c{i}") for i, cohort in enumerate(cohorts)]
+        params = {name: value for _, cohort_params in compiled for name, value in cohort_params.items()}
+
+        def build():
+            select, join, group_by = GROUP_COLUMNS[group]
+            matches = ["(" + (" AND ".join(conditions) or "1") + ")" for conditions, _ in compiled]
+
+            # Count each cohort's samples in the group, reading only the samples of at least one cohort
+            counts = ",\n        ".join(f"SUM(CASE WHEN {match} THEN 1 ELSE 0 END) AS c{i}"
+                                         for i, match in enumerate(matches))
+            return COUNT_QUERY.format(group=select, counts=counts, join=join,
+                                      conditions=" OR ".join(matches), group_by=group_by)
+
+        query = self.compile(("count", group, tuple(cohort.shape() for cohort in cohorts)), build)
+        return query, params
+
+    def count_by(self, group, cohorts):
+        """
+        Count the samples of a batch of cohorts in each group of a column in one pass over 'samples'.
+
+        Returns:
+            A DataFrame with the group column followed by one count column per cohort, named after the
+            cohort, with a row for every group that has samples in at least one cohort.
+        """
+
+        query, params = self.count_query(group, cohorts)
+        self.loader.cursor.execute(query, params)
+        rows = self.loader.cursor.fetchall()
+        return pd.DataFrame(rows, columns=[group] + [cohort.name for cohort in cohorts])
+
+    def fill_cell_response(self, cohort):
+        """
+        Recreate the 'cell_response' table and fill it with the frequencies of a cohort, without committing.
+        """
+
+        query, params = self.response_query(cohort)
+        self.loader.create_cell_response_table()
+        self.loader.cursor.execute(query, params)
+        self.loader.mark_changed("cell_response")
@@ -0,0 +1,208 @@
+from db import CellDataLoader, DIMENSIONS
+import pandas as pd
+
+# Dimensions of the cube, as dimension -> column of the 'cell_cube' table. Cohorts (see cohorts.Cohort) filter
+# the clinical dimensions and 'population' selects the cell types.
+CUBE_COLUMNS = {
+    "project": "cc.project_id",
+    "condition": "cc.condition_id",
+    "treatment": "cc.treatment_id",
+    "sample_type": "cc.sample_type_id",
+    "time_from_treatment_start": "cc.time_from_treatment_start",
+    "response": "cc.response_id",
+    "sex": "cc.sex",
+    "population": "cc.cell_type_id"
+}
+
+# Query aggregating the per-sample cell counts over every combination of the dimensions, inserted straight into
+# 'cell_cube'. The first part has one row per cell type of each combination; the second part aggregates all
+# cell types of the combination (cell_type_id NULL), so roll-ups over the populations count every sample once.
+CUBE_QUERY = """
+    INSERT INTO cell_cube (project_id, condition_id, treatment_id, sample_type_id, time_from_treatment_start,
+                           response_id, sex, cell_type_id, samples, count, total_count)
+    SELECT
+        sa.project_id,
+        sa.condition_id,
+        sa.treatment_id,
+        sa.sample_type_id,
+        sa.time_from_treatment_start,
+        sa.response_id,
+        su.sex,
+        c.cell_type_id,
+        COUNT(*) AS samples,
+        SUM(c.count) AS count,
+        SUM(c.total_count) AS total_count
+    FROM subjects AS su
+    JOIN samples AS sa ON sa.subject = su.subject
+    JOIN cell_summary AS c ON c.sample = sa.sample
+    GROUP BY sa.project_id, sa.condition_id, sa.treatment_id, sa.sample_type_id, sa.time_from_treatment_start,
+             sa.response_id, su.sex, c.cell_type_id
+    UNION ALL
+    SELECT
+        sa.project_id,
+        sa.condition_id,
+        sa.treatment_id,
+        sa.sample_type_id,
+        sa.time_from_treatment_start,
+        sa.response_id,
+        su.sex,
+        NULL,
+        COUNT(*) AS samples,
+        SUM(t.total_count) AS count,
+        SUM(t.total_count) AS total_count
+    FROM subjects AS su
+    JOIN samples AS sa ON sa.subject = su.subject
+    JOIN (SELECT sample, MAX(total_count) AS total_count FROM cell_summary GROUP BY sample) AS t
+      ON t.sample = sa.sample
+    GROUP BY sa.project_id, sa.condition_id, sa.treatment_id, sa.sample_type_id, sa.time_from_treatment_start,
+             sa.response_id, su.sex
+"""
+
+# Query answering a slice or roll-up of the cube. The grouped dimensions and the filters are filled in by
+# CellCube.query_sql, along with the rows the measures are summed from: 'totals' selects the rows counting the
+# samples and all of their cells, and 'selected' the rows counting the cells of the selected cell types.
+SLICE_QUERY = """
+    SELECT
+        {groups}
+        SUM(CASE WHEN {totals} THEN cc.samples ELSE 0 END) AS samples,
+        SUM(CASE WHEN {selected} THEN cc.count ELSE 0 END) AS count,
+        SUM(CASE WHEN {totals} THEN cc.total_count ELSE 0 END) AS total_count,
+        ROUND(100.0 * SUM(CASE WHEN {selected} THEN cc.count ELSE 0 END) /
+              SUM(CASE WHEN {totals} THEN cc.total_count ELSE 0 END), 2) AS percentage
+    FROM cell_cube AS cc
+    WHERE {conditions}
+    {group_by}
+"""
+
+class CellCube:
+    """
+    Materialize the cell counts aggregated over the clinical dimensions and the cell type, and answer slices
+    and roll-ups of any cohort from the aggregate instead of the raw tables.
+
+    The cube has one row per combination of project, condition, treatment, sample type, time from treatment
+    start, response, sex and cell type that occurs in the data, so its size depends on the number of
+    combinations rather than the number of samples. Its measures (samples, count and total_count) are sums,
+    which roll up exactly over any dimension.
+    """
+
+    def __init__(self, db_path="code/cell_data.db", profile="read_write", loader=None):
+        # Use the given loader (e.g. the pipeline's shared connection) or open a new connection
+        self.loader = loader or CellDataLoader(db_path, profile)
+
+    def build(self):
+        """
+        Recreate the 'cell_cube' table from the 'samples', 'subjects' and 'cell_summary' tables.
+        """
+
+        # Recreate the 'cell_cube' table and fill it in one statement
+        self.loader.create_cell_cube_table()
+        self.loader.cursor.execute(CUBE_QUERY)
+
+        # Give the table a new version and commit the change
+        self.loader.mark_changed("cell_cube")
+        self.loader.conn.commit()
+
+    @staticmethod
+    def query_sql(group_by=(), cohort=None, populations=None):
+        """
+        Compile the query of a slice or roll-up; see 'query' for the arguments.
+
+        Returns:
+            A tuple (query, params).
+        """
+
+        unknown = set(group_by) - set(CUBE_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown cube dimensions {sorted(unknown)}. Choose from {list(CUBE_COLUMNS)}.")
+
+        # Filter the clinical dimensions by the cohort
+        conditions, params = cohort.conditions("c0", columns=CUBE_COLUMNS) if cohort is not None else ([], {})
+
+        # Select the cell types of the populations
+        in_populations = None
+        if populations is not None:
+            names = [f"population_{i}" for i in range(len(populations))]
+            params.update(zip(names, populations))
+            in_populations = (f"cc.cell_type_id IN (SELECT cell_type_id FROM cell_types WHERE cell_type IN "
+                              f"({', '.join(':' + name for name in names)}))")
+
+        if "population" in group_by:
+            # Every measure of a population comes from its own per-cell-type rows
+            totals = selected = "cc.cell_type_id IS NOT NULL"
+            conditions.append(totals)
+            if in_populations:
+                conditions.append(in_populations)
+        elif in_populations:
+            # The selected cell types are counted from their per-cell-type rows, while the samples and the
+            # cells of all types come from the rows aggregating all cell types, so they are counted once
+            totals, selected = "cc.cell_type_id IS NULL", in_populations
+            conditions.append(f"({totals} OR {selected})")
+        else:
+            # Every measure comes from the rows aggregating all cell types
+            totals = selected = "cc.cell_type_id IS NULL"
+            conditions.append(totals)
+
+        # Select the grouped dimensions, decoding the dictionary-encoded ones through their lookup table
+        groups = []
+        for dimension in group_by:
+            column = "cell_type" if dimension == "population" else dimension
+            if column in DIMENSIONS:
+                table, id_col = DIMENSIONS[column]
+                groups.append(f"(SELECT {column} FROM {table} WHERE {id_col} = {CUBE_COLUMNS[dimension]}) "
+                              f"AS {dimension},")
+            else:
+                groups.append(f"{CUBE_COLUMNS[dimension]} AS {dimension},")
+
+        group_by_sql = ""
+        if group_by:
+            group_by_sql = (f"GROUP BY {', '.join(CUBE_COLUMNS[d] for d in group_by)}\n"
+                            f"    ORDER BY {', '.join(group_by)}")
+
+        query = SLICE_QUERY.format(groups="\n        ".join(groups), totals=totals, selected=selected,
+                                   conditions=" AND ".join(conditions), group_by=group_by_sql)
+        return query, params
+
+    def query(self, group_by=(), cohort=None, populations=None):
+        """
+        Answer a slice or roll-up of the cube.
+
+        Args:
+            group_by: dimensions to break the result down by (see CUBE_COLUMNS); the other dimensions are
+                rolled up.
+            cohort: a cohorts.Cohort filtering the clinical dimensions, or None for all samples.
+            populations: names of the cell types to count, or None for all cell types combined (unless
+                'population' is grouped).
+
+        Returns:
+            A DataFrame with the grouped dimensions followed by:
+            - samples: number of samples
+            - count: number of cells of the selected cell types
+            - total_count: number of cells of all cell types
+            - percentage: relative frequency of the selected cell types (%)
+        """
+
+        query, params = self.query_sql(group_by, cohort, populations)
+        return pd.read_sql_query(query, self.loader.conn, params=params)
+
+    def compare(self, cohorts, group_by=("population",), populations=None):
+        """
+        Answer the same slice or roll-up for several cohorts, e.g. to compare the population frequencies of
+        responders and non-responders.
+
+        Returns:
+            A DataFrame with a 'cohort' column holding each cohort's name, followed by the columns of 'query'.
+        """
+
+        results = [self.query(group_by, cohort, populations).assign(cohort=cohort.name) for cohort in cohorts]
+        compared_df = pd.concat(results, ignore_index=True)
+        return compared_df[["cohort"] + [col for col in compared_df.columns if col != "cohort"]]
+
+def main():
+    # Create an instance of CellCube
+    cube = CellCube()
+
+    # Aggregate the cell counts over the clinical dimensions
+    cube.build()
+
+if __name__ == "__main__":
+    main()
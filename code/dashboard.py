@@ -1,16 +1,94 @@
 import streamlit as st
 import pandas as pd
 import math
-import statsmodels.formula.api as smf
-from scipy.stats import ranksums
 import plotly.express as px
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score
-from xgboost import XGBClassifier
+import pyarrow.compute as pc
 import os
 from google import genai
-from google.genai import errors
-import time
+from outputs import read_output, read_output_table, output_version
+from explanations import ExplanationCache, ExplanationEngine, TokenBucket, build_prompt, classify_level
+from response_model import ResponseModelTrainer, feature_contributions
+from summary_queries import CellSummaryQueries
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def load_output(csv_path, version):
+    """
+    Load an output file once per process and share the DataFrame across reruns and sessions.
+
+    The version (see outputs.output_version) is part of the cache key, so a file rewritten by the
+    pipeline is loaded again on the next rerun while unchanged files are served from memory. The
+    cached DataFrames are shared and must not be modified in place.
+    """
+
+    return read_output(csv_path)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def load_output_table(csv_path, version):
+    """
+    Load an output file once per version as a memory-mapped Arrow table (see outputs.read_output_table),
+    for panels that only convert the rows they show to pandas.
+    """
+
+    return read_output_table(csv_path)
+
+@st.cache_resource(show_spinner="Indexing the cell population table...", max_entries=2)
+def load_filter_index(db_path, version):
+    """
+    Build the filter index of the 'cell_summary' table (see summary_queries.SummaryFilterIndex) once per
+    version of the table in the database and share it across reruns and sessions.
+    """
+
+    queries = CellSummaryQueries(db_path)
+    try:
+        return queries.filter_index()
+    finally:
+        queries.close()
+
+@st.cache_resource(show_spinner="Loading the response model...", max_entries=4)
+def load_response_model(response_file_path, version):
+    """
+    Load the response model artifact once per version of the cell response output, training and saving
+    a new one only if the saved model was trained on different data.
+    """
+
+    return ResponseModelTrainer(response_file_path).load_or_train()
+
+@st.cache_resource(show_spinner=False)
+def get_gemini_client(api_key):
+    """
+    Create the Gemini client once per API key and share it across reruns and sessions.
+    """
+
+    return genai.Client(api_key=api_key)
+
+@st.cache_resource(show_spinner=False)
+def get_rate_limiter():
+    """
+    Create the token bucket shared by every session, so all requests of the process stay within the
+    configured Gemini rate limit.
+    """
+
+    return TokenBucket.from_env()
+
+@st.cache_resource(show_spinner=False)
+def get_explanation_cache():
+    """
+    Open the disk-backed explanation cache once per process.
+    """
+
+    return ExplanationCache()
+
+def gemini_api_key():
+    """
+    Return the Gemini API key from the GEMINI_API_KEY environment variable or the Streamlit secrets,
+    or None if it is not configured.
+    """
+
+    try:
+        return os.environ.get("GEMINI_API_KEY") or st.secrets.get("GEMINI_API_KEY")
+    except Exception:
+        # Reading st.secrets raises when no secrets file exists
+        return None
 
 class CellDataDisplay:
     """
@@ -22,17 +100,33 @@ class CellDataDisplay:
         - Subset summaries by project, response, and gender
     """
 
-    def __init__(self, summary_file_path="output/cell_summary.csv", response_file_path="output/cell_response.csv",
+    def __init__(self, db_path="code/cell_data.db", response_file_path="output/cell_response.csv",
                  samples_per_project_file_path="output/cell_project_summary.csv",
                  subjects_per_response_file_path="output/cell_response_summary.csv",
-                 subjects_per_gender_file_path="output/cell_gender_summary.csv"):
-
-        # Read all CSV files
-        self.cell_summary_df = pd.read_csv(summary_file_path)
-        self.cell_response_df = pd.read_csv(response_file_path)
-        self.cell_project_summary_df = pd.read_csv(samples_per_project_file_path)
-        self.cell_response_summary_df = pd.read_csv(subjects_per_response_file_path)
-        self.cell_gender_summary_df = pd.read_csv(subjects_per_gender_file_path)
+                 subjects_per_gender_file_path="output/cell_gender_summary.csv",
+                 response_stats_file_path="output/cell_response_stats.csv"):
+
+        self.db_path = db_path
+        self.response_file_path = response_file_path
+
+        # The cell population summary is queried one page at a time from the database. The cached filter index
+        # is versioned by the database file the path points to (which a rebuild switches) and the version of
+        # its 'cell_summary' table (which every rewrite of the table changes).
+        queries = CellSummaryQueries(db_path)
+        try:
+            self.summary_version = (os.path.realpath(db_path), queries.version())
+        finally:
+            queries.close()
+
+        # Obtain the other output files from the cache, reading only the ones that changed since they were cached
+        self.cell_response_table = load_output_table(response_file_path, output_version(response_file_path))
+        self.cell_project_summary_df = load_output(samples_per_project_file_path,
+                                                   output_version(samples_per_project_file_path))
+        self.cell_response_summary_df = load_output(subjects_per_response_file_path,
+                                                    output_version(subjects_per_response_file_path))
+        self.cell_gender_summary_df = load_output(subjects_per_gender_file_path,
+                                                  output_version(subjects_per_gender_file_path))
+        self.cell_response_stats_df = load_output(response_stats_file_path, output_version(response_stats_file_path))
 
     def show_cell_population_summary(self):
         """
@@ -45,11 +139,12 @@ class CellDataDisplay:
                 - count: number of cells of that type in the sample
                 - percentage: relative frequency of the cell type within the sample (%)
 
-            Users can filter the table using dropdowns for:
-                - Sample
-                - Cell population
+            Users can filter the table using:
+                - Sample (a drop down menu of the samples matching a typed prefix)
+                - Cell population (a drop down menu)
 
-            The table supports pagination to navigate large datasets.
+            The table supports pagination to navigate large datasets. Each page is read from the database
+            with keyset pagination (see summary_queries.py), so the full table is never loaded.
         """
 
         # Set the dashboard title, subheader for Part II and markdown text to describe the visualization
@@ -58,19 +153,32 @@ class CellDataDisplay:
         st.markdown("""
                     <span style='font-size:20px'>
                     Explore the relative frequencies of immune cell populations across all samples.
-                    Use the dropdown menus to filter by sample and/or cell type.
+                    Type the start of a sample ID to search for it, and use the dropdown menus to filter by sample and/or cell type.
                     Use the "Previous Page" and "Next Page" buttons below to navigate through the table pages.
                     </span>
                     """, unsafe_allow_html=True)
 
 
-        # Obtain the samples and population types that can be selected on the dashboard using the drop down menus
-        samples = ["All"] + sorted(self.cell_summary_df["sample"].unique().tolist())
-        populations = ["All"] + sorted(self.cell_summary_df["population"].unique().tolist())
+        # Obtain the filter index of the current data version, which finds the samples and lists the population
+        # types that can be selected on the dashboard
+        filter_index = load_filter_index(self.db_path, self.summary_version)
+        populations = ["All"] + filter_index.populations
 
-        # Obtain the sample the user selected
+        # Obtain the start of the sample ID the user typed, and offer only the first matching samples so the
+        # drop down menu stays small however many samples there are
         st.markdown("<div style='margin-top:10px; font-size:16px'>Select Sample</div>", unsafe_allow_html=True)
+        prefix = st.text_input("Search Sample", placeholder="Type the start of a sample ID, e.g. sample0136",
+                               label_visibility="collapsed").strip()
+        matches, total_matches = filter_index.search(prefix, limit=20)
+        samples = ["All"] + matches
+
+        # Obtain the sample the user selected
         selected_sample = st.selectbox("Select Sample", samples, label_visibility="collapsed")
+        if total_matches > len(matches):
+            st.caption(f"Showing the first {len(matches)} of {total_matches} matching samples; "
+                       f"type more of the sample ID to narrow the list.")
+        elif not matches:
+            st.caption("No sample ID starts with this text.")
 
         # Obtain the population the user selected
         st.markdown("<div style='margin-top:10px; font-size:16px'>Select Population</div>", unsafe_allow_html=True)
@@ -86,20 +194,18 @@ class CellDataDisplay:
             st.session_state.page_number = 0
             st.session_state.last_filters = (selected_sample, selected_population)
 
-        # Filter dataframe based on the sample and population the user selected
-        filtered_df = self.cell_summary_df.copy()
-        if selected_sample != "All":
-            filtered_df = filtered_df[filtered_df["sample"] == selected_sample]
-        if selected_population != "All":
-            filtered_df = filtered_df[filtered_df["population"] == selected_population]
+        # Translate the selections into the query filters
+        sample = None if selected_sample == "All" else selected_sample
+        population = None if selected_population == "All" else selected_population
 
-        # Select a number of rows from the DataFrame to display on each page
+        # Select a number of rows from the table to display on each page
         page_size = 10
         if "page_number" not in st.session_state:
             st.session_state.page_number = 0
 
         # Find the maximum number of pages that could be there in the table display
-        max_pages = math.ceil(len(filtered_df) / page_size) - 1
+        total_rows = filter_index.count(sample, population)
+        max_pages = max(math.ceil(total_rows / page_size) - 1, 0)
 
         # Set the page numbers for the previous, current and next page
         prev_page, curr_page, next_page = st.columns([1, 2, 1])
@@ -110,18 +216,21 @@ class CellDataDisplay:
             if st.button("Next Page") and st.session_state.page_number < max_pages:
                 st.session_state.page_number += 1
 
-        # Set the start and end page indices
-        start_idx = st.session_state.page_number * page_size
-        end_idx = start_idx + page_size
-
-        # Filter the DataFrame based on the start and end page index
-        page_df = filtered_df.iloc[start_idx:end_idx]
+        # Look up the (sample, population) key of the page's first row in the filter index, and read only
+        # the rows of the page from the database
+        start_key = filter_index.page_start(st.session_state.page_number, sample, population, page_size)
+        queries = CellSummaryQueries(self.db_path)
+        try:
+            page_df = queries.page(sample, population, start=start_key, limit=page_size)
+        finally:
+            queries.close()
 
         # Display the DataFrame
         st.dataframe(page_df, width='stretch')
 
         # Set the caption
-        st.caption(f"Showing {start_idx + 1}–{min(end_idx, len(filtered_df))} of {len(filtered_df)} rows "
+        start_idx = st.session_state.page_number * page_size
+        st.caption(f"Showing {min(start_idx + 1, total_rows)}–{start_idx + len(page_df)} of {total_rows} rows "
                    f"(Page {st.session_state.page_number + 1} of {max_pages + 1})")
 
     def analyze_response_statistics(self):
@@ -142,33 +251,21 @@ class CellDataDisplay:
                     """, unsafe_allow_html=True)
 
         # Obtain the unique cell types and store the cell that the user selected
-        cell_types = self.cell_response_df['population'].unique().tolist()
+        cell_types = self.cell_response_table.column('population').unique().to_pylist()
 
         # Obtain the cell type the user selected
         st.markdown("<div style='margin-top:10px; font-size:16px'>Select Cell Type</div>", unsafe_allow_html=True)
         selected_cell = st.selectbox("Select Cell Type", cell_types, label_visibility="collapsed")
 
-        # Filter the DataFrame based on cell population
-        cell_df = self.cell_response_df[self.cell_response_df['population'] == selected_cell]
-
-        # Split the filtered DataFrame based on response
-        yes_df = cell_df[cell_df['response'] == 'yes']['percentage']
-        no_df = cell_df[cell_df['response'] == 'no']['percentage']
+        # Filter the table based on cell population, converting only the selected rows to a DataFrame
+        cell_table = self.cell_response_table
+        cell_df = cell_table.filter(pc.equal(cell_table['population'], selected_cell)).to_pandas()
 
-        # Count the number of unique responses per subject identify subjects with mixed responses
-        response_counts = cell_df.groupby('subject')['response'].nunique()
-        subjects_with_mixed_responses = response_counts[response_counts > 1]
-
-        # Use the Wilcoxon rank-sum test if all subjects contain a single response type,
-        # since it assumes independent samples.
-        # If subjects have mixed responses, apply a Linear Mixed-Effects Model,
-        # which can account for repeated measures within subjects.
-        if len(subjects_with_mixed_responses) == 0:
-            stat, p_value = ranksums(yes_df, no_df)
-        else:
-            model = smf.mixedlm("percentage ~ response", cell_df, groups=cell_df["subject"])
-            result = model.fit()
-            p_value = result.pvalues.get('response[T.yes]', None)
+        # Look up the precomputed test of the selected cell population (see cell_response_stats.py)
+        stats_row = self.cell_response_stats_df[self.cell_response_stats_df['population'] == selected_cell]
+        p_value = None
+        if not stats_row.empty and pd.notna(stats_row['p_value'].iloc[0]):
+            p_value = stats_row['p_value'].iloc[0]
 
         # Find how significant the cell population differences are based on the p value
         if p_value is not None:
@@ -186,9 +283,18 @@ class CellDataDisplay:
             significance = "p-value could not be computed"
 
         # Display the statistical significance of the cell population difference above the boxplot
-        st.markdown(f"""<span style='font-size:19px; font-weight:bold'>{significance} (p-value = {p_value:.4f})
+        p_value_text = f" (p-value = {p_value:.4f})" if p_value is not None else ""
+        st.markdown(f"""<span style='font-size:19px; font-weight:bold'>{significance}{p_value_text}
                         </span>""", unsafe_allow_html=True)
 
+        # Describe the test that produced the p-value and the size of the difference
+        if not stats_row.empty:
+            method = {"ranksums": "Wilcoxon rank-sum test",
+                      "mixedlm": "Linear Mixed-Effects Model"}.get(stats_row['method'].iloc[0], stats_row['method'].iloc[0])
+            st.caption(f"{method}; effect size (rank-biserial correlation) = "
+                       f"{stats_row['effect_size'].iloc[0]:+.3f}; Benjamini-Hochberg adjusted p-value across "
+                       f"{len(self.cell_response_stats_df)} populations = {stats_row['p_adjusted'].iloc[0]:.4f}")
+
         # Set the interactive boxplot using Plotly
         fig = px.box(
             cell_df,
@@ -228,7 +334,7 @@ class CellDataDisplay:
             plot_bgcolor="rgba(0,0,0,0)",
             legend=dict(
                 title=dict(
-                    text=self.cell_response_df.columns[0],
+                    text=self.cell_response_table.column_names[0],
                     font=dict(size=20, color="black", family="Arial")
                 ),
                 font=dict(size=18, color="black", family="Arial")
@@ -253,83 +359,15 @@ class CellDataDisplay:
 
         st.write("")
 
-        # Transform the dataframe from a long format to a wide format for modeling.
-        # This groups the data by patient, turning unique cell types into feature columns.
-        features_df = self.cell_response_df.pivot(
-            index=['subject', 'response'],  # Keep these as tracking/label rows (one row per subject)
-            columns='population',           # Pivot unique cell types into individual column headers (features)
-            values='total_population_count' # Populate the matrix cells with their respective percentage values
-        ).reset_index()                     # Flatten the multi-index so 'subject' and 'response' become standard columns
-
-        # Remove the lingering 'population' name from the columns axis metadata
-        # to keep the DataFrame clean and easy to slice by column index later.
-        features_df.columns.name = None
-
-        # One-hot encode the categorical clinical response column (located at index 1).
-        # drop_first=True avoids multicollinearity; the new binary column is appended to the far right.
-        features_df = pd.get_dummies(features_df, columns=[features_df.columns[1]], drop_first=True)
-
-        # Cast the final one-hot encoded boolean column to integer (0/1) in place
-        # using assign to cleanly overwrite the column and prevent pandas dtype deprecation warnings.
-        features_df = features_df.assign(**{features_df.columns[-1]: features_df.iloc[:, -1].astype(int)})
-
-        # Separate features (X) from the target label (y).
-        # Starts at index 1 to drop the patient 'subject' IDs, and goes up to (but excludes) the last column.
-        # Targets strictly the newly engineered binary response column at the very end of the dataframe.
-        X = features_df.iloc[:, 1:-1]
-        y = features_df.iloc[:, -1]
-
-        # Partition data into a 70/30 train/test split.
-        # stratify=y preserves the exact class balance of responders across both subsets to prevent sampling bias.
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=42, stratify=y)
-
-        # Initialize XGBoost with conservative, regularized parameters tailored for noisy clinical datasets.
-        model = XGBClassifier(
-            n_estimators=300,      # Give the model plenty of iterations to learn subtle patterns
-            learning_rate=0.02,    # Use a small step size to prevent overshooting the global minimum
-            max_depth=1,           # Constrain trees to decision stumps to severely penalize feature interaction noise
-            reg_lambda=4.0,        # Apply heavy L2 regularization to smooth out volatile biomarker variances
-            subsample=0.8,         # Train on a random 80% subset of patient profiles per tree to boost variance generalization
-            random_state=42        # Enforce deterministic results for reproducible metrics
-        )
-
-        # Fit the model to the training cohort
-        model.fit(X_train, y_train)
-
-        # Generate baseline metrics on the training pool to monitor for overfitting ceilings
-        train_predictions = model.predict(X_train)
-        train_accuracy = accuracy_score(y_train, train_predictions)
-        # print(f"Training Accuracy: {train_accuracy:.4f}")
-
-        # Evaluate generalization performance against completely unseen test patient profiles
-        y_pred = model.predict(X_test)
-        test_accuracy = accuracy_score(y_test, y_pred)
-        # print(f"Test Accuracy: {test_accuracy:.4f}")
-
-        # Initialize dictionaries to hold the stratification bounds for each cell population
-        lower_thresholds = {}
-        higher_thresholds = {}
+        # Obtain the trained model, retraining only if the response data changed since it was saved
+        artifact = load_response_model(self.response_file_path, output_version(self.response_file_path))
+        model = artifact["model"]
+        lower_thresholds = artifact["lower_thresholds"]
+        higher_thresholds = artifact["higher_thresholds"]
 
-        # Slices out the middle columns (skipping 'subject' ID at index 0 and the target column at the end)
-        # This isolates only the numeric cell counts to prevent text-based math crashes
-        numeric_cell_cols = features_df.columns[1:-1]
-
-        for col_name in numeric_cell_cols:
-            # Calculate the 33rd percentile (lower third boundary) and convert the
-            # native NumPy float64 wrapper into a standard, clean Python float using .item()
-            lower_thresholds[col_name] = features_df[col_name].quantile(0.33).item()
-
-            # Calculate the 66th percentile (upper third boundary) and convert to a regular float
-            higher_thresholds[col_name] = features_df[col_name].quantile(0.66).item()
-
-        # Print the cleaned dictionaries to the terminal console logs for validation
-        print("\n--- Safely Calculated Thresholds ---")
-        print("33rd Percentile:", lower_thresholds)
-        print("66th Percentile:", higher_thresholds)
-
-        # Extract the 5 unique cell population feature columns from the dataframe
-        # This skips the 'subject' ID at index 0 and the target variable column at the very end
-        column_names = features_df.columns[1:-1]
+        # The cell population feature columns, in the order the model was trained on
+        column_names = artifact["feature_names"]
+        numeric_cell_cols = column_names
 
         # Initialize an empty dictionary to store the user-submitted numbers
         captured_numbers = {}
@@ -356,7 +394,7 @@ class CellDataDisplay:
         if submit_button:
             # Wrap the input dict in a single-row DataFrame so column names and
             # order exactly match what the trained model expects
-            input_df = pd.DataFrame([captured_numbers])
+            input_df = pd.DataFrame([captured_numbers], columns=column_names)
             # predict_proba returns [[prob_class_0, prob_class_1]]; index [0]
             # unwraps the outer list to give a flat [non-responder, responder] array
             probabilities = model.predict_proba(input_df)[0]
@@ -370,6 +408,11 @@ class CellDataDisplay:
                 # For non-responders, confidence is the probability of class 0
                 st.session_state.confidence_score = probabilities[0]
 
+        # Choose how the prediction is explained; switching does not require submitting the form again
+        explanation_mode = st.radio("Explanation mode",
+                                    ["Clinical justifications (Gemini)", "Model contributions (local)"],
+                                    horizontal=True)
+
         # Render results whenever they exist in session_state — this block runs on
         # every rerun so the output stays visible after subsequent interactions
         if "prediction_label" in st.session_state:
@@ -389,124 +432,99 @@ class CellDataDisplay:
 
             st.write("") # Extra spacer for clean UI formatting between cell types
 
-            # --- Initialize the Gemini Client ---
-            # The client automatically pulls your API key from the GEMINI_API_KEY environment variable.
-            # Place this initialization near the top of your script.
-            try:
-                client = genai.Client()
-            except Exception as e:
-                # Fixed: Added missing double quote and removed the extra parenthesis
-                st.error(f"Failed to initialize Gemini Client. Check your API key. Error: {e}")
+            # Explain the prediction locally from the model itself when selected, without any API calls
+            if explanation_mode == "Model contributions (local)":
+                self.show_feature_contributions(artifact, captured_numbers)
+                return
+
+            # Obtain the shared Gemini client, created once per API key
+            api_key = gemini_api_key()
+            client = None
+            if api_key:
+                try:
+                    client = get_gemini_client(api_key)
+                except Exception as e:
+                    # Capture and display any authentication or connection errors on the web interface
+                    st.error(f"Failed to initialize Gemini Client. Error: {e}")
+            else:
+                # Alert the user to fix their configuration if no API key was found
+                st.error("**Missing Gemini API Key!** Please export GEMINI_API_KEY in your terminal or add \
+                          it to your environment configurations.")
 
             st.markdown("##### Feature Breakdown & Clinical Justifications")
             st.write("") # Quick breathing room spacer
 
-            # Iterate through each isolated numeric cell column to stratify the patient's data
+            # Display the status sentence of every cell type, each followed by a placeholder that is
+            # filled in as soon as its justification arrives
+            placeholders = {}
+            prompts = {}
             for cell_type in numeric_cell_cols:
+                # Classify the patient's input relative to the cohort's 33rd and 66th percentiles
+                level = classify_level(captured_numbers[cell_type], lower_thresholds[cell_type],
+                                       higher_thresholds[cell_type])
 
-                # Retrieve the pre-calculated 33rd and 66th percentile boundaries for this specific cell
-                # population
-                lower_bound = lower_thresholds[cell_type]
-                higher_bound = higher_thresholds[cell_type]
-
-                # Grab the freshly captured patient input value for this cell type
-                cell_count = captured_numbers[cell_type]
-
-                # Initialize an empty string to hold our categorical evaluation tier
-                level = ""
-
-                # Classify the input relative to the core clinical cohort distribution
-                if cell_count < lower_bound:
-                    level = "low"
-                elif cell_count > higher_bound:
-                    level = "high"
-                else:
-                    # This catches all values falling cleanly between the lower and higher thresholds
-                    level = "medium"
-
-                # --- Display the Status Sentence on the Webpage ---
-                # This handles the immediate visual output requested above the justification
                 st.markdown(
                     f'<span style="font-size: 19px;">The patient\'s **{cell_type}** count is **{level}**.</span>',
                     unsafe_allow_html=True
                 )
+                placeholders[cell_type] = st.empty()
+                placeholders[cell_type].markdown(f"_Generating clinical insight for {cell_type}..._")
+                st.write("") # Add vertical whitespace padding before moving to the next cell type
 
-                # --- Construct the Hidden Prompt for Gemini ---
-                # We keep the text inside triple quotes with the leading 'f' for variable interpolation
-                prompt = f"""
-                Context: You are analyzing baseline PBMC counts for a melanoma patient treated with Miraclib.
-                The model has predicted this patient's status as: {st.session_state.prediction_label}.
-
-                Current Feature: The patient's {cell_type} count is evaluated as {level}.
-
-                Task: Provide a single-sentence clinical explanation or biological context justifying why
-                having a {level} level of {cell_type} aligns with or characterizes a patient who is a
-                {st.session_state.prediction_label} to this therapy. You MUST include the specific downstream
-                consequence that caused this to happen.
-
-                Constraint: Keep the response strictly to one clear sentence. Do not include conversational filler.
-                """
-
-                # --- Initialize the Gemini Client Safely ---
-                # Fixed: Look up the variable by its configuration NAME, not its value string
-                api_key = os.environ.get("GEMINI_API_KEY") or st.secrets.get("GEMINI_API_KEY")
-
-                # Initialize client as None to establish its variable scope upfront.
-                # This prevents downstream "referenced before assignment" runtime crashes if initialization
-                # fails.
-                client = None
-
-                # Verify that a valid API key string was successfully extracted or assigned
-                if api_key:
-                    try:
-                        # Instantiate the official Google GenAI Client explicitly passing the token string
-                        client = genai.Client(api_key=api_key)
-                    except Exception as e:
-                        # Capture and display any authentication or connection errors on the web interface
-                        st.error(f"Failed to initialize Gemini Client. Error: {e}")
-                else:
-                    # Fallback warning if the api_key variable is empty, alerting the user to fix their
-                    # configurations
-                    st.error("**Missing Gemini API Key!** Please export GEMINI_API_KEY in your terminal or add \
-                              it to your environment configurations.")
-
-                # Wrap the API call in a spinner so the webpage remains smooth while generating
-                with st.spinner(f"Generating clinical insight for {cell_type}..."):
-                    # Explicitly check if the client was successfully assigned above
-                    if client is not None:
-                        try:
-                            # Call the generation model using the official v1 SDK format
-                            response = client.models.generate_content(
-                                model='gemini-2.5-flash',
-                                contents=prompt,
-                            )
-                            # Extract the cleaned text result from the API response object
-                            justification_text = response.text.strip()
-
-                        # Handle specific exception scenarios arising during the API call lifecycle
-                        except errors.APIError as api_err:
-                            # Gracefully capture explicit upstream Google GenAI infrastructure or quota errors
-                            justification_text = f"Unable to generate insight due to an API error: {api_err.message}"
-                        except Exception as generic_err:
-                            # Catch-all backup for unexpected runtime failures
-                            justification_text = f"An unexpected error occurred: {str(generic_err)}"
-                    else:
-                        # Fallback assignment executed if the SDK client object was never instantiated
-                        # successfully
-                        justification_text = (
-                            "Clinical interpretation unavailable: Gemini SDK client is uninitialized."
-                        )
-
-                # Display the resulting justification sentence right below the feature line
-                st.markdown(
+                prompts[cell_type] = build_prompt(st.session_state.prediction_label, cell_type, level)
+
+            # Serve the cached justifications and generate the others concurrently behind the shared
+            # rate limiter (cached justifications are still shown when the client is unavailable)
+            engine = ExplanationEngine(client, rate_limiter=get_rate_limiter(), cache=get_explanation_cache())
+            justifications = engine.explain_all(prompts)
+
+            # Display each justification in its placeholder as it completes
+            for cell_type, justification_text in justifications:
+                placeholders[cell_type].markdown(
                     f'<span style="color: black; font-size: 18px;">💡 {justification_text}</span>',
                     unsafe_allow_html=True
                 )
 
-                st.write("") # Add vertical whitespace padding before moving to the next cell type
+    def show_feature_contributions(self, artifact, captured_numbers):
+        """
+        Display a ranked breakdown of how much each cell population count pushed the model's prediction
+        towards or away from a response, computed in-process from the XGBoost trees.
+        """
+
+        # Compute the per-feature contributions for the submitted patient
+        contributions_df, base_value = feature_contributions(artifact, captured_numbers)
+
+        st.markdown("##### Feature Breakdown & Model Contributions")
+        st.write("") # Quick breathing room spacer
+
+        # Describe each cell population in order of influence
+        for rank, row in enumerate(contributions_df.itertuples(index=False), start=1):
+            direction = "towards **Responder**" if row.contribution >= 0 else "towards **Non-Responder**"
+            st.markdown(
+                f'<span style="font-size: 19px;">{rank}. The patient\'s **{row.population}** count of '
+                f'{row.count:g} pushes the prediction {direction} ({row.contribution:+.3f} log-odds).</span>',
+                unsafe_allow_html=True
+            )
+
+        # Plot the contributions as horizontal bars, the most influential at the top
+        fig = px.bar(
+            contributions_df.iloc[::-1],
+            x="contribution",
+            y="population",
+            orientation="h",
+            color="contribution",
+            color_continuous_scale="RdBu",
+            color_continuous_midpoint=0,
+            title="Contribution to the Predicted Response (log-odds)"
+        )
+        fig.update_layout(
+            title=dict(font=dict(size=21, color="black", family="Arial"), x=0.5, xanchor='center'),
+            xaxis_title=dict(text="Contribution", font=dict(size=19, color="black", family="Arial")),
+            yaxis_title=dict(text="Population", font=dict(size=19, color="black", family="Arial"))
+        )
+        st.plotly_chart(fig, width='stretch')
 
-                # This prevents hitting Google's rate-limiting/burst-capacity thresholds.
-                time.sleep(2)
+        st.caption(f"Baseline log-odds before any cell population is considered: {base_value:+.3f}")
 
     def explore_baseline_subsets(self):
         """
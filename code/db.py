@@ -1,19 +1,101 @@
 import sqlite3
 
+# Lookup tables that dictionary-encode the categorical columns, as column -> (table, id column)
+DIMENSIONS = {
+    "project": ("projects", "project_id"),
+    "sample_type": ("sample_types", "sample_type_id"),
+    "treatment": ("treatments", "treatment_id"),
+    "condition": ("conditions", "condition_id"),
+    "response": ("responses", "response_id"),
+    "cell_type": ("cell_types", "cell_type_id")
+}
+
+# Tables written by every load of the CSV data
+LOADED_TABLES = ["subjects", "samples", "cell_counts", "changed_samples"] + [table for table, _ in DIMENSIONS.values()]
+
+# Tables derived from the loaded tables by the analysis stages
+DERIVED_TABLES = ["cell_summary", "cell_response", "cell_response_stats", "cell_cube"]
+
+# Secondary indexes for each table, built after a bulk load rather than maintained during it
+INDEXES = {
+    "samples": {
+        # Covers the cohort filters of the analysis queries along with the join and grouping columns
+        "idx_samples_cohort": "(condition_id, treatment_id, sample_type_id, time_from_treatment_start, "
+                              "response_id, subject, project_id, sample)"
+    },
+    "cell_counts": {
+        # Covers the per-sample scan of the population summary
+        "idx_cell_counts_sample_type_count": "(sample, cell_type_id, count)"
+    },
+    "cell_summary": {
+        # Covers the join of the response analysis, lookups by sample and population and the pages of the
+        # dashboard table in sample order
+        "idx_cell_summary_sample_cell_type": "(sample, cell_type_id, count, total_count, percentage)",
+        # Covers the pages and row counts of the dashboard table filtered by population
+        "idx_cell_summary_cell_type_sample": "(cell_type_id, sample, total_count, count, percentage)"
+    }
+}
+
+# PRAGMA settings applied by the connection factory for each named profile
+PROFILES = {
+    # SQLite defaults
+    "default": [],
+    # Ingest: rollback journal kept in memory, no fsync and a 256 MB page cache. A crash during the load can
+    # leave the database corrupt, so the load is simply rerun. A database already in WAL mode stays in WAL
+    # mode, so readers keep reading the last committed data while the load writes.
+    "bulk_load": ["journal_mode = MEMORY", "synchronous = OFF", "cache_size = -262144", "temp_store = MEMORY"],
+    # Analysis stages that read the base tables and write derived tables while readers are active
+    "read_write": ["journal_mode = WAL", "synchronous = NORMAL", "cache_size = -65536", "mmap_size = 268435456"],
+    # Dashboard and tests: WAL so reads never block on a writer, memory-mapped pages and no writes
+    "read_mostly": ["journal_mode = WAL", "cache_size = -65536", "mmap_size = 268435456", "query_only = ON"]
+}
+
+def apply_profile(conn, profile):
+    """
+    Apply one of the named PRAGMA profiles in PROFILES to an open connection, e.g. when a shared
+    connection moves on to a different pipeline stage.
+    """
+
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown connection profile '{profile}'. Choose one of {sorted(PROFILES)}.")
+
+    wal = conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    for pragma in PROFILES[profile]:
+        # Leaving WAL mode needs exclusive access and would block the readers, so WAL is kept once enabled
+        if wal and pragma.startswith("journal_mode"):
+            continue
+        conn.execute(f"PRAGMA {pragma}")
+
+def connect(db_path="code/cell_data.db", profile="default"):
+    """
+    Open a connection to the database tuned with one of the named PRAGMA profiles in PROFILES.
+    """
+
+    conn = sqlite3.connect(db_path)
+    apply_profile(conn, profile)
+    return conn
+
 class CellDataLoader:
     """
     Create the main database tables for the project.
 
     This class creates the following tables:
         - projects
+        - sample_types, treatments, conditions, responses and cell_types
         - subjects
         - samples
         - cell_counts
+        - changed_samples
+        - cell_summary
+        - cell_response
+        - cell_response_stats
+        - cell_cube
+        - table_versions (the version of every other table, see mark_changed)
     """
 
-    def __init__(self, db_path="code/cell_data.db"):
-        # Initalize the database connection and the cursor
-        self.conn = sqlite3.connect(db_path)
+    def __init__(self, db_path="code/cell_data.db", profile="default"):
+        # Initalize the database connection, tuned for the stage, and the cursor
+        self.conn = connect(db_path, profile)
         self.cursor = self.conn.cursor()
 
     def create_projects_table(self):
@@ -32,6 +114,28 @@ class CellDataLoader:
         )
         """)
 
+    def create_dimension_tables(self):
+        """
+        Create the lookup tables that map each sample type, treatment, condition, response and cell type
+        to a small integer id, so the 'samples' and 'cell_counts' tables store integers instead of repeated text.
+        """
+
+        for column, (table, id_col) in DIMENSIONS.items():
+            # The 'projects' table is created by create_projects_table
+            if table == "projects":
+                continue
+
+            # Drops the table if it already exists
+            self.cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+            # Create the lookup table in the database
+            self.cursor.execute(f"""
+            CREATE TABLE {table} (
+                {id_col} INTEGER PRIMARY KEY AUTOINCREMENT,
+                {column} TEXT NOT NULL UNIQUE
+            )
+            """)
+
     def create_subjects_table(self):
         """
         Create the 'subjects' table in the database to store subject information.
@@ -61,15 +165,20 @@ class CellDataLoader:
         self.cursor.execute("""
         CREATE TABLE samples (
             sample TEXT PRIMARY KEY,
-            sample_type TEXT NOT NULL,
+            sample_type_id INTEGER NOT NULL,
             subject TEXT NOT NULL,
             project_id INTEGER NOT NULL,
             time_from_treatment_start REAL NOT NULL,
-            treatment TEXT NOT NULL,
-            condition TEXT NOT NULL,
-            response TEXT,
+            treatment_id INTEGER NOT NULL,
+            condition_id INTEGER NOT NULL,
+            response_id INTEGER,
+            row_hash TEXT,
+            FOREIGN KEY (sample_type_id) REFERENCES sample_types(sample_type_id),
             FOREIGN KEY (subject) REFERENCES subjects(subject),
-            FOREIGN KEY (project_id) REFERENCES projects(project_id)
+            FOREIGN KEY (project_id) REFERENCES projects(project_id),
+            FOREIGN KEY (treatment_id) REFERENCES treatments(treatment_id),
+            FOREIGN KEY (condition_id) REFERENCES conditions(condition_id),
+            FOREIGN KEY (response_id) REFERENCES responses(response_id)
         )
         """)
 
@@ -86,10 +195,214 @@ class CellDataLoader:
         CREATE TABLE cell_counts (
             cell_id INTEGER PRIMARY KEY AUTOINCREMENT,
             sample TEXT NOT NULL,
-            cell_type TEXT NOT NULL,
+            cell_type_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            FOREIGN KEY (sample) REFERENCES samples(sample),
+            FOREIGN KEY (cell_type_id) REFERENCES cell_types(cell_type_id),
+            UNIQUE(sample, cell_type_id)
+        )
+        """)
+
+    def create_changed_samples_table(self):
+        """
+        Create the 'changed_samples' table in the database to record the samples touched by the last load,
+        so downstream stages can recompute only the affected aggregates.
+        """
+
+        # Drops the table if it already exists
+        self.cursor.execute("DROP TABLE IF EXISTS changed_samples")
+
+        # Create the 'changed_samples' table in the database
+        self.cursor.execute("""
+        CREATE TABLE changed_samples (
+            sample TEXT PRIMARY KEY
+        )
+        """)
+
+    def create_indexes(self, *tables):
+        """
+        Create the secondary indexes of the given tables (all tables with indexes if none are given).
+        """
+
+        for table in tables or INDEXES:
+            for name, columns in INDEXES[table].items():
+                self.cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {columns}")
+
+    def drop_indexes(self, *tables):
+        """
+        Drop the secondary indexes of the given tables (all tables with indexes if none are given),
+        so a bulk load does not have to maintain them row by row.
+        """
+
+        for table in tables or INDEXES:
+            for name in INDEXES[table]:
+                self.cursor.execute(f"DROP INDEX IF EXISTS {name}")
+
+    def full_table_scans(self, query, params=()):
+        """
+        Run EXPLAIN QUERY PLAN on a query and return the steps that read a whole table. Only SEARCH steps
+        look rows up through an index; a SCAN step reads every row, whether from the table or from a
+        (covering) index.
+
+        Returns:
+            A list of the query plan details of the full table scans; empty if every table is searched
+            through an index.
+        """
+
+        self.cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+        details = [detail for _, _, _, detail in self.cursor.fetchall()]
+
+        # Subqueries and CTEs are materialized from their own (indexed) steps, so scanning them is not a table scan
+        derived = {detail.split(" ", 1)[1] for detail in details if detail.startswith(("MATERIALIZE ", "CO-ROUTINE "))}
+        derived.add("CONSTANT ROW")
+
+        return [detail for detail in details
+                if detail.startswith("SCAN ") and detail[len("SCAN "):] not in derived]
+
+    def create_tables(self):
+        """
+        Create all the main tables of the database.
+        """
+
+        self.create_projects_table()
+        self.create_dimension_tables()
+        self.create_subjects_table()
+        self.create_samples_table()
+        self.create_cell_counts_table()
+        self.create_changed_samples_table()
+        self.create_cell_summary_table()
+        self.create_cell_response_table()
+        self.create_cell_response_stats_table()
+        self.create_cell_cube_table()
+        self.mark_changed(*LOADED_TABLES, *DERIVED_TABLES)
+
+    def mark_changed(self, *tables):
+        """
+        Give the given tables a new version in the 'table_versions' table, without committing. Every writer
+        calls this in the transaction that changes a table, so a reader can tell whether a table changed
+        since it last read it, whichever script changed it. Versions are random tokens, so the tables of a
+        rebuilt database file never share a version with the ones they replace.
+        """
+
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version TEXT NOT NULL
+        )
+        """)
+        self.cursor.executemany(
+            "INSERT OR REPLACE INTO table_versions (table_name, version) VALUES (?, lower(hex(randomblob(8))))",
+            [(table,) for table in tables]
+        )
+
+    def table_versions(self, *tables):
+        """
+        Return the current version of each of the given tables, or None for a table that was never marked.
+        """
+
+        try:
+            self.cursor.execute("SELECT table_name, version FROM table_versions")
+        except sqlite3.OperationalError:
+            # A database written before the versions were recorded has no 'table_versions' table
+            return [None] * len(tables)
+        versions = dict(self.cursor.fetchall())
+        return [versions.get(table) for table in tables]
+
+    def create_cell_summary_table(self):
+        """
+        Create the 'cell_summary' table in the database to store the relative frequency of each cell type
+        per sample. It is filled in-database by CellPopulationSummary.
+        """
+
+        # Drops the table if it already exists
+        self.cursor.execute("DROP TABLE IF EXISTS cell_summary")
+
+        # Create the 'cell_summary' table in the database
+        self.cursor.execute("""
+        CREATE TABLE cell_summary (
+            sample TEXT NOT NULL,
+            total_count INTEGER NOT NULL,
+            cell_type_id INTEGER NOT NULL,
             count INTEGER NOT NULL,
+            percentage REAL NOT NULL,
             FOREIGN KEY (sample) REFERENCES samples(sample),
-            UNIQUE(sample, cell_type)
+            FOREIGN KEY (cell_type_id) REFERENCES cell_types(cell_type_id)
+        )
+        """)
+
+    def create_cell_response_table(self):
+        """
+        Create the 'cell_response' table in the database to store the relative frequency of each cell type
+        per subject for melanoma PBMC samples treated with miraclib. It is filled in-database by
+        CellResponseAnalysis.
+        """
+
+        # Drops the table if it already exists
+        self.cursor.execute("DROP TABLE IF EXISTS cell_response")
+
+        # Create the 'cell_response' table in the database
+        self.cursor.execute("""
+        CREATE TABLE cell_response (
+            subject TEXT NOT NULL,
+            response_id INTEGER NOT NULL,
+            cell_type_id INTEGER NOT NULL,
+            total_population_count INTEGER NOT NULL,
+            total_count INTEGER NOT NULL,
+            percentage REAL NOT NULL,
+            FOREIGN KEY (subject) REFERENCES subjects(subject),
+            FOREIGN KEY (response_id) REFERENCES responses(response_id),
+            FOREIGN KEY (cell_type_id) REFERENCES cell_types(cell_type_id)
+        )
+        """)
+
+    def create_cell_response_stats_table(self):
+        """
+        Create the 'cell_response_stats' table in the database to store, for each cell type, the test
+        comparing its frequency between responders and non-responders. It is filled by CellResponseStatistics.
+        """
+
+        # Drops the table if it already exists
+        self.cursor.execute("DROP TABLE IF EXISTS cell_response_stats")
+
+        # Create the 'cell_response_stats' table in the database
+        self.cursor.execute("""
+        CREATE TABLE cell_response_stats (
+            cell_type_id INTEGER PRIMARY KEY,
+            method TEXT NOT NULL,
+            statistic REAL,
+            p_value REAL,
+            effect_size REAL,
+            p_adjusted REAL,
+            responders INTEGER NOT NULL,
+            non_responders INTEGER NOT NULL,
+            FOREIGN KEY (cell_type_id) REFERENCES cell_types(cell_type_id)
+        )
+        """)
+
+    def create_cell_cube_table(self):
+        """
+        Create the 'cell_cube' table in the database to store the cell counts aggregated over every combination
+        of the clinical dimensions and the cell type. Rows with a NULL cell_type_id aggregate all cell types of
+        their combination. It is filled by CellCube.
+        """
+
+        # Drops the table if it already exists
+        self.cursor.execute("DROP TABLE IF EXISTS cell_cube")
+
+        # Create the 'cell_cube' table in the database
+        self.cursor.execute("""
+        CREATE TABLE cell_cube (
+            project_id INTEGER,
+            condition_id INTEGER,
+            treatment_id INTEGER,
+            sample_type_id INTEGER,
+            time_from_treatment_start REAL,
+            response_id INTEGER,
+            sex TEXT,
+            cell_type_id INTEGER,
+            samples INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            total_count INTEGER NOT NULL
         )
         """)
 
@@ -103,10 +416,7 @@ def main():
     loader = CellDataLoader()
 
     # Create all the tables to store in the database
-    loader.create_projects_table()
-    loader.create_subjects_table()
-    loader.create_samples_table()
-    loader.create_cell_counts_table()
+    loader.create_tables()
 
     # Commit the change and close the database connection
     loader.close()
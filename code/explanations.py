@@ -0,0 +1,326 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from google.genai import errors
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+
+# Model used for the clinical justifications
+GEMINI_MODEL = "gemini-2.5-flash"
+
+# Possible predictions and cell count levels, which with the cell types determine every possible prompt
+PREDICTION_LABELS = ["Responder", "Non-Responder"]
+LEVELS = ["low", "medium", "high"]
+
+# API error codes worth retrying: rate limiting and transient server errors
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+def build_prompt(prediction_label, cell_type, level):
+    """
+    Build the hidden prompt asking for a one-sentence clinical justification of a cell population level.
+    """
+
+    return f"""
+    Context: You are analyzing baseline PBMC counts for a melanoma patient treated with Miraclib.
+    The model has predicted this patient's status as: {prediction_label}.
+
+    Current Feature: The patient's {cell_type} count is evaluated as {level}.
+
+    Task: Provide a single-sentence clinical explanation or biological context justifying why
+    having a {level} level of {cell_type} aligns with or characterizes a patient who is a
+    {prediction_label} to this therapy. You MUST include the specific downstream
+    consequence that caused this to happen.
+
+    Constraint: Keep the response strictly to one clear sentence. Do not include conversational filler.
+    """
+
+def all_prompts(cell_types):
+    """
+    Build every distinct prompt: one per cell type, level and prediction label.
+
+    Returns:
+        A dictionary mapping (prediction_label, cell_type, level) to its prompt.
+    """
+
+    return {(label, cell_type, level): build_prompt(label, cell_type, level)
+            for label in PREDICTION_LABELS for cell_type in cell_types for level in LEVELS}
+
+def classify_level(cell_count, lower_bound, higher_bound):
+    """
+    Classify a cell count as 'low', 'medium' or 'high' relative to the cohort's 33rd and 66th percentiles.
+    """
+
+    if cell_count < lower_bound:
+        return "low"
+    if cell_count > higher_bound:
+        return "high"
+    return "medium"
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    The bucket holds up to 'capacity' tokens and refills at 'rate' tokens per second. Every request takes
+    one token, waiting for the next refill when the bucket is empty, so short bursts of up to 'capacity'
+    requests go out at once while the sustained request rate never exceeds 'rate'.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("The rate must be positive and the capacity at least 1.")
+
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a bucket configured by the GEMINI_REQUESTS_PER_MINUTE (default 10) and GEMINI_BURST
+        (default 5) environment variables.
+        """
+
+        per_minute = float(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", 10))
+        burst = int(os.environ.get("GEMINI_BURST", 5))
+        return cls(per_minute / 60, burst)
+
+    def acquire(self):
+        """
+        Take one token, blocking until one is available.
+        """
+
+        while True:
+            with self.lock:
+                # Add the tokens accumulated since the last update, up to the capacity
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                # Time until the next whole token is available
+                wait = (1 - self.tokens) / self.rate
+
+            self.sleep(wait)
+
+class ExplanationCache:
+    """
+    Disk-backed cache of generated justifications, stored in its own SQLite database.
+
+    Entries are keyed by the SHA-256 hash of the model name and prompt. An entry is fresh for 'ttl' seconds
+    after it was generated; expired entries are still kept as a fallback for when the API is unreachable.
+    When the cache holds more than 'max_entries' entries, the least recently used ones are evicted.
+    """
+
+    def __init__(self, db_path="code/explanation_cache.db", ttl=30 * 24 * 3600, max_entries=1000,
+                 clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+
+        # The engine reads and writes from its worker threads, so one connection is shared behind a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS explanations (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            text TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_explanations_last_used ON explanations (last_used)")
+        self.conn.commit()
+
+    @staticmethod
+    def key(model, prompt):
+        """
+        Return the cache key of a prompt sent to a model.
+        """
+
+        return hashlib.sha256(f"{model}\0{prompt}".encode()).hexdigest()
+
+    def get(self, model, prompt, include_expired=False):
+        """
+        Return the cached justification of a prompt, or None if it is missing or expired.
+        """
+
+        key = self.key(model, prompt)
+        now = self.clock()
+        with self.lock:
+            row = self.conn.execute("SELECT text, created_at FROM explanations WHERE key = ?", (key,)).fetchone()
+            if row is None or (not include_expired and row[1] + self.ttl <= now):
+                return None
+
+            # Record the use for the least recently used eviction
+            self.conn.execute("UPDATE explanations SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            return row[0]
+
+    def put(self, model, prompt, text):
+        """
+        Store a generated justification, evicting the least recently used entries beyond 'max_entries'.
+        """
+
+        now = self.clock()
+        with self.lock:
+            self.conn.execute(
+                """
+                INSERT INTO explanations (key, model, prompt, text, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET text = excluded.text, created_at = excluded.created_at,
+                                               last_used = excluded.last_used
+                """,
+                (self.key(model, prompt), model, prompt, text, now, now)
+            )
+            self.conn.execute(
+                """
+                DELETE FROM explanations WHERE key IN (
+                    SELECT key FROM explanations ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,)
+            )
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM explanations").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+class ExplanationEngine:
+    """
+    Generate the clinical justifications concurrently with a single shared Gemini client.
+
+    Every request passes through the token bucket, and requests rejected for rate limiting or transient
+    server errors are retried with exponential backoff and jitter. Any object exposing
+    'models.generate_content(model=..., contents=...)' can be used as the client, e.g. a local fake in tests.
+    With a cache, fresh cached justifications are returned without calling the API, and expired ones are
+    returned when the client is missing or the request fails.
+    """
+
+    def __init__(self, client, rate_limiter=None, model=GEMINI_MODEL, max_workers=5, max_retries=3,
+                 backoff=1.0, sleep=time.sleep, cache=None):
+        self.client = client
+        self.rate_limiter = rate_limiter or TokenBucket.from_env()
+        self.model = model
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self.cache = cache
+
+    def generate(self, prompt):
+        """
+        Call the API for one prompt, retrying rate limiting and transient server errors.
+
+        Returns:
+            The justification text. Raises the last error if the request ultimately failed.
+        """
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                response = self.client.models.generate_content(model=self.model, contents=prompt)
+                return response.text.strip()
+            except errors.APIError as api_err:
+                # Retry rate limiting and transient server errors; give up on anything else
+                if api_err.code not in RETRYABLE_CODES or attempt == self.max_retries:
+                    raise
+
+            # Wait exponentially longer before each retry, with jitter so concurrent retries spread out
+            self.sleep(self.backoff * 2 ** attempt + random.uniform(0, self.backoff))
+
+    def explain(self, prompt):
+        """
+        Obtain the justification for one prompt from the cache or the API.
+
+        Returns:
+            The justification text, or a readable error message if none could be obtained.
+        """
+
+        # Serve fresh justifications from the cache
+        if self.cache is not None:
+            cached = self.cache.get(self.model, prompt)
+            if cached is not None:
+                return cached
+
+        try:
+            if self.client is None:
+                return self.fallback(prompt, "Clinical interpretation unavailable: Gemini SDK client is "
+                                             "uninitialized.")
+            text = self.generate(prompt)
+        except errors.APIError as api_err:
+            return self.fallback(prompt, f"Unable to generate insight due to an API error: {api_err.message}")
+        except Exception as generic_err:
+            return self.fallback(prompt, f"An unexpected error occurred: {str(generic_err)}")
+
+        # Store the new justification for the next requests
+        if self.cache is not None:
+            self.cache.put(self.model, prompt, text)
+        return text
+
+    def fallback(self, prompt, message):
+        """
+        Return an expired cached justification if there is one, otherwise the error message.
+        """
+
+        stale = self.cache.get(self.model, prompt, include_expired=True) if self.cache is not None else None
+        return stale if stale is not None else message
+
+    def explain_all(self, prompts):
+        """
+        Generate the justifications for several prompts concurrently.
+
+        Args:
+            prompts: a dictionary mapping a key (e.g. the cell type) to its prompt.
+
+        Returns:
+            An iterator of (key, justification) pairs in the order the justifications complete.
+        """
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.explain, prompt): key for key, prompt in prompts.items()}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+def main():
+    # Parse the options from the command line
+    parser = argparse.ArgumentParser(description="Warm the explanation cache with every possible prompt.")
+    parser.add_argument("--model-path", default="output/response_model.pkl",
+                        help="response model artifact listing the cell types")
+    args = parser.parse_args()
+
+    from google import genai
+    from response_model import ResponseModelTrainer
+
+    # Build every prompt from the cell types the response model was trained on
+    cell_types = ResponseModelTrainer(model_path=args.model_path).load_or_train()["feature_names"]
+    prompts = all_prompts(cell_types)
+
+    # Generate the justifications that are not cached yet
+    cache = ExplanationCache()
+    client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+    engine = ExplanationEngine(client, cache=cache)
+    missing = {key: prompt for key, prompt in prompts.items() if cache.get(engine.model, prompt) is None}
+    for key, text in engine.explain_all(missing):
+        print(f"{key}: {text}")
+
+    print(f"Cached {len(prompts) - len(missing)} of {len(prompts)} prompts before warming, "
+          f"{sum(cache.get(engine.model, p) is not None for p in prompts.values())} after.")
+    cache.close()
+
+if __name__ == "__main__":
+    main()
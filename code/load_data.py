@@ -1,15 +1,229 @@
-from db import CellDataLoader
+from db import CellDataLoader, DIMENSIONS, LOADED_TABLES
 import pandas as pd
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import glob
+import os
+import resource
+import sys
+import time
+
+# Columns in the CSV file that describe the sample rather than a cell population
+METADATA_COLS = ['sample', 'sample_type', 'subject', 'project', 'age', 'sex', 'treatment', 'condition',
+                 'response', 'time_from_treatment_start']
+
+# Metadata columns holding text; the other columns (age, time_from_treatment_start and the cell counts) are numeric
+TEXT_COLS = ['sample', 'sample_type', 'subject', 'project', 'sex', 'treatment', 'condition', 'response']
+
+# Type of every column of the CSV file, shared by all ingest paths so each batch is read with the same dtypes
+# whatever values it happens to contain. Cell type columns are not known in advance and default to integers.
+CSV_DTYPES = defaultdict(lambda: "int64", {col: str for col in TEXT_COLS},
+                         age="float64", time_from_treatment_start="float64")
+
+# Token hashed in place of a missing value
+NA_TOKEN = "\0NA"
+
+# Columns of the 'samples' table, in table order
+SAMPLE_COLS = ['sample', 'sample_type_id', 'subject', 'project_id', 'time_from_treatment_start', 'treatment_id',
+               'condition_id', 'response_id', 'row_hash']
+
+# Insert statement for the 'samples' table
+SAMPLES_INSERT = f"INSERT INTO samples ({', '.join(SAMPLE_COLS)}) VALUES ({', '.join('?' * len(SAMPLE_COLS))})"
+
+# Insert statement for the 'cell_counts' table
+CELL_COUNTS_INSERT = "INSERT INTO cell_counts (sample, cell_type_id, count) VALUES (?, ?, ?)"
+
+def read_csv(file_name, **kwargs):
+    """
+    Read a CSV file of samples with the column types of CSV_DTYPES. Extra arguments are passed to pd.read_csv.
+    """
+
+    return pd.read_csv(file_name, dtype=CSV_DTYPES, **kwargs)
+
+def canonical_values(df):
+    """
+    Convert every column of the CSV data into a canonical text form: text columns as they are and numeric
+    columns in a fixed number format (72, 72.0 and "72" all become "72"), with NA_TOKEN for missing values.
+    """
+
+    canonical = {}
+    for col in df.columns:
+        if col in TEXT_COLS:
+            canonical[col] = df[col].astype(str).where(df[col].notna(), NA_TOKEN)
+        else:
+            numbers = pd.to_numeric(df[col]).astype(float)
+            canonical[col] = numbers.map("{:.17g}".format).where(numbers.notna(), NA_TOKEN)
+    return pd.DataFrame(canonical, index=df.index)
+
+def compute_row_hashes(df):
+    """
+    Compute a content hash for every row of the CSV data.
+
+    The hash covers the canonical value of every column of the row, so a sample whose metadata or cell
+    counts change in a later file receives a different hash, while the same values read with other dtypes
+    (e.g. an age column that turns into floats because one age is missing) keep the same hash.
+    """
+
+    hashes = pd.util.hash_pandas_object(canonical_values(df), index=False)
+    return hashes.map("{:016x}".format)
+
+def peak_rss():
+    """
+    Return the peak resident set size of the current process in bytes.
+    """
+
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def melt_counts(data):
+    """
+    Transform wide CSV rows into a long DataFrame containing the count of each cell type per sample.
+    """
+
+    # Obtain the preferred cols from the CSV file
+    cell_types = [col for col in data.columns if col not in METADATA_COLS + ['row_hash']]
+
+    # Melt the cell type columns into (sample, cell_type, count) rows
+    return data.melt(id_vars=['sample'], value_vars = cell_types,
+                     var_name = 'cell_type', value_name = 'count'
+    )
+
+def dimension_values(data):
+    """
+    Obtain the distinct values of every dictionary-encoded column of a batch of CSV rows,
+    in order of first appearance.
+
+    Returns:
+        A dictionary mapping each column in DIMENSIONS to a list of its distinct values.
+    """
+
+    values = {column: data[column].dropna().unique().tolist() for column in DIMENSIONS if column != 'cell_type'}
+    values['cell_type'] = [col for col in data.columns if col not in METADATA_COLS + ['row_hash']]
+    return values
+
+def validate_batch(data, source):
+    """
+    Check that a batch of CSV rows can be loaded, raising a ValueError that names the source otherwise.
+    """
+
+    # Every metadata column and at least one cell type column must be present
+    missing = [col for col in METADATA_COLS if col not in data.columns]
+    if missing:
+        raise ValueError(f"{source}: missing columns {missing}")
+    cell_types = [col for col in data.columns if col not in METADATA_COLS]
+    if not cell_types:
+        raise ValueError(f"{source}: no cell type columns")
+
+    # The identifying columns cannot be empty
+    for col in ['sample', 'subject', 'project', 'sample_type', 'treatment', 'condition',
+                'time_from_treatment_start']:
+        if data[col].isna().any():
+            raise ValueError(f"{source}: column '{col}' has missing values")
+
+    # A sample can only appear once per file
+    duplicated = data.loc[data['sample'].duplicated(), 'sample'].unique()
+    if len(duplicated):
+        raise ValueError(f"{source}: duplicate samples {sorted(duplicated)[:10]}")
+
+    # Cell counts must be non-negative whole numbers
+    counts = data[cell_types]
+    if counts.isna().any().any() or (counts < 0).any().any() or (counts % 1 != 0).any().any():
+        raise ValueError(f"{source}: cell counts must be non-negative integers")
+
+def prepare_batch(data):
+    """
+    Split a batch of wide CSV rows into the rows of each table, ready to be inserted.
+
+    Returns:
+        A dictionary with the batch's distinct dimension values and its subjects, samples (with the
+        row hash, not yet encoded) and cell counts DataFrames.
+    """
+
+    return {
+        'dimensions': dimension_values(data),
+        'subjects': data[['subject', 'age', 'sex']].drop_duplicates(subset=['subject']),
+        'samples': data.assign(row_hash=compute_row_hashes(data)),
+        'cell_counts': melt_counts(data)
+    }
+
+def drop_samples(batch, samples):
+    """
+    Remove some samples from a batch produced by 'prepare_batch', recomputing its dimension values and
+    subjects from the remaining rows so the removed rows leave nothing behind.
+    """
+
+    kept = batch['samples'][~batch['samples']['sample'].isin(samples)]
+    cell_counts = batch['cell_counts'][batch['cell_counts']['sample'].isin(kept['sample'])]
+
+    # Only keep the dimension values and subjects of the remaining rows
+    dimensions = dimension_values(kept)
+    dimensions['cell_type'] = cell_counts['cell_type'].unique().tolist()
+    return {
+        'dimensions': dimensions,
+        'subjects': kept[['subject', 'age', 'sex']].drop_duplicates(subset=['subject']),
+        'samples': kept,
+        'cell_counts': cell_counts
+    }
+
+def prepare_file(file_name):
+    """
+    Read, validate and prepare a single CSV file. Runs inside the worker processes of the multi-file ingest.
+    """
+
+    data = read_csv(file_name)
+    validate_batch(data, file_name)
+    return prepare_batch(data)
+
+def expand_input_paths(path):
+    """
+    Expand a directory (all of its CSV files) or a glob pattern into a sorted list of input files.
+    """
+
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "*.csv")))
+    return sorted(glob.glob(path))
+
+def to_records(df):
+    """
+    Convert a DataFrame into a list of row tuples that sqlite3 can bind directly.
+
+    Values are boxed into native Python types and missing values become None (NULL),
+    matching what the row-by-row inserts store.
+    """
+
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
 
 class CellDataInserter:
     """
     Load data into the main database tables for the project.
     """
 
-    def __init__(self, file_name="input/cell_counts.csv", db_path="code/cell_data.db"):
-        # Initialize the database connection and cursor, and load the CSV data
-        self.data = pd.read_csv(file_name)
-        self.loader = CellDataLoader(db_path)
+    def __init__(self, file_name="input/cell_counts.csv", db_path="code/cell_data.db", batch_size=50000,
+                 profile="bulk_load", loader=None):
+        # Initialize the database connection (or reuse the given loader's) and cursor; the CSV data is read
+        # on first use
+        self.file_name = file_name
+        self._data = None
+        self.loader = loader or CellDataLoader(db_path, profile)
+
+        # Number of rows sent to the database per executemany call in bulk mode
+        self.batch_size = batch_size
+
+        # In-memory maps from each dimension value (project, cell type, ...) to its id, built once after
+        # the lookup tables are filled
+        self.dimension_ids = {column: {} for column in DIMENSIONS}
+
+    @property
+    def data(self):
+        """
+        The full CSV file as a DataFrame, read the first time it is needed. The streaming mode never reads it.
+        """
+
+        if self._data is None:
+            self._data = read_csv(self.file_name)
+        return self._data
 
     def insert_projects(self):
         """
@@ -30,9 +244,39 @@ class CellDataInserter:
                 "INSERT INTO projects (project) VALUES (?)", (prj,)
             )
 
-        # Commit the change
+        # Give the table a new version and commit the change
+        self.loader.mark_changed("projects")
         self.loader.conn.commit()
 
+        # Cache the project ids so samples can resolve them without querying the database
+        self.dimension_ids['project'] = self.load_dimension_map("projects", "project", "project_id")
+
+    def insert_categories(self):
+        """
+        Insert the sample types, treatments, conditions, responses and cell types from the CSV file
+        into their lookup tables in the database.
+        """
+
+        for column, values in dimension_values(self.data).items():
+            table, id_col = DIMENSIONS[column]
+
+            # The projects are inserted by insert_projects
+            if table == "projects":
+                continue
+
+            # Delete the lookup table if it already exists
+            self.loader.cursor.execute(f"DELETE FROM {table}")
+            self.loader.cursor.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+
+            # Load each distinct value into the lookup table
+            for value in values:
+                self.loader.cursor.execute(f"INSERT INTO {table} ({column}) VALUES (?)", (value,))
+
+            # Give the lookup table a new version, commit the change and cache the ids
+            self.loader.mark_changed(table)
+            self.loader.conn.commit()
+            self.dimension_ids[column] = self.load_dimension_map(table, column, id_col)
+
     def insert_subjects(self):
         """
         Insert subject information from the CSV file into the 'subjects' table in the database.
@@ -54,7 +298,8 @@ class CellDataInserter:
                 "INSERT INTO subjects (subject, age, sex) VALUES (?, ?, ?)", (row['subject'], row['age'], row['sex'])
             )
 
-        # Commit the change
+        # Give the table a new version and commit the change
+        self.loader.mark_changed("subjects")
         self.loader.conn.commit()
 
     def insert_samples(self):
@@ -66,47 +311,33 @@ class CellDataInserter:
         self.loader.cursor.execute("DELETE FROM samples")
         self.loader.conn.commit()
 
-        # Obtain the preferred cols from the CSV file
-        samples_df = self.data[['sample', 'sample_type', 'subject', 'project', 'time_from_treatment_start',
-                                'treatment', 'condition', 'response']]
+        # Obtain the preferred cols from the CSV file, with the dimension ids resolved in one vectorized join
+        samples_df = self.encode_samples(self.data.assign(row_hash=compute_row_hashes(self.data)))
 
         # Load each row into the 'samples' table
-        for _, row in samples_df.iterrows():
-
-            # Obtain the project id from the 'samples' table
-            self.loader.cursor.execute(
-                "SELECT project_id FROM projects WHERE project = ?", (row['project'],)
-            )
-            project_id = self.loader.cursor.fetchone()
+        for record in to_records(samples_df):
 
             # Load the information into the 'samples' table
             self.loader.cursor.execute(
                 """
                 INSERT INTO samples (
                     sample,
-                    sample_type,
+                    sample_type_id,
                     subject,
                     project_id,
                     time_from_treatment_start,
-                    treatment,
-                    condition,
-                    response
+                    treatment_id,
+                    condition_id,
+                    response_id,
+                    row_hash
                 )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
-                (
-                    row['sample'],
-                    row['sample_type'],
-                    row['subject'],
-                    project_id[0],
-                    row['time_from_treatment_start'],
-                    row['treatment'],
-                    row['condition'],
-                    row['response']
-                )
+                record
             )
 
-        # Commit the change
+        # Give the table a new version and commit the change
+        self.loader.mark_changed("samples")
         self.loader.conn.commit()
 
     def insert_cell_types(self):
@@ -119,39 +350,448 @@ class CellDataInserter:
         self.loader.cursor.execute("DELETE FROM sqlite_sequence WHERE name='cell_counts'")
         self.loader.conn.commit()
 
-        # Obtain the preferred cols from the CSV file
-        cell_types = [col for col in self.data.columns if col not in ['sample', 'sample_type', 'subject', 'project',
-                                                                      'age', 'sex', 'treatment', 'condition',
-                                                                      'response', 'time_from_treatment_start']]
-
         # Transform the data into a DataFrame containing the count of each cell type per sample
-        cell_df = self.data.melt(id_vars=['sample'], value_vars = cell_types,
-                                 var_name = 'cell_type', value_name = 'count'
-        )
+        cell_df = self.encode_cell_counts(self.melt_cell_counts())
 
         # Load each row into the 'cell_counts' table
         for _, row in cell_df.iterrows():
             self.loader.cursor.execute(
-                "INSERT INTO cell_counts (sample, cell_type, count) VALUES (?, ?, ?)",
-                (row['sample'], row['cell_type'], row['count'])
+                "INSERT INTO cell_counts (sample, cell_type_id, count) VALUES (?, ?, ?)",
+                (row['sample'], row['cell_type_id'], row['count'])
             )
 
-        # Commit the change
+        # Give the table a new version and commit the change
+        self.loader.mark_changed("cell_counts")
         self.loader.conn.commit()
 
+    def load_dimension_map(self, table, key_col, id_col):
+        """
+        Build an in-memory map from the key column of a dimension table to its integer id.
+        """
+
+        self.loader.cursor.execute(f"SELECT {key_col}, {id_col} FROM {table}")
+        return dict(self.loader.cursor.fetchall())
+
+    def load_dimension_maps(self):
+        """
+        Rebuild the in-memory maps of every lookup table from the database.
+        """
+
+        for column, (table, id_col) in DIMENSIONS.items():
+            self.dimension_ids[column] = self.load_dimension_map(table, column, id_col)
+
+    def insert_dimension_values(self, values):
+        """
+        Append the dimension values that are not in the lookup tables yet, without committing,
+        and refresh the in-memory maps of the tables that changed.
+
+        Returns:
+            The number of lookup rows inserted.
+        """
+
+        row_count = 0
+        for column, column_values in values.items():
+            table, id_col = DIMENSIONS[column]
+
+            # Only insert the values that do not have an id yet
+            new_values = [value for value in column_values if value not in self.dimension_ids[column]]
+            if new_values:
+                row_count += self.insert_batches(f"INSERT INTO {table} ({column}) VALUES (?)",
+                                                 pd.DataFrame({column: new_values}))
+                self.dimension_ids[column] = self.load_dimension_map(table, column, id_col)
+
+        return row_count
+
+    def encode(self, df, column):
+        """
+        Replace the values of a categorical column with their ids using the cached lookup map,
+        in a single vectorized lookup. Missing values stay missing.
+        """
+
+        ids = df[column].map(self.dimension_ids[column])
+
+        # Every value must have been inserted into its lookup table first
+        unknown = ids.isna() & df[column].notna()
+        if unknown.any():
+            missing = sorted(df.loc[unknown, column].unique())
+            raise ValueError(f"Unknown {column} values: {missing}. Insert the lookup values first.")
+
+        return ids.astype("Int64")
+
+    def encode_samples(self, df):
+        """
+        Encode the categorical columns of the sample rows of a DataFrame.
+
+        Returns:
+            A DataFrame with the columns of the 'samples' table, in table order.
+        """
+
+        ids = {DIMENSIONS[column][1]: self.encode(df, column)
+               for column in ['project', 'sample_type', 'treatment', 'condition', 'response']}
+        return df.assign(**ids)[SAMPLE_COLS]
+
+    def encode_cell_counts(self, df):
+        """
+        Encode the cell types of a long cell counts DataFrame.
+
+        Returns:
+            A DataFrame with the sample, cell_type_id and count columns of the 'cell_counts' table.
+        """
+
+        return df.assign(cell_type_id=self.encode(df, 'cell_type'))[['sample', 'cell_type_id', 'count']]
+
+    def melt_cell_counts(self, data=None):
+        """
+        Transform the CSV data (or the given subset of it) into a long DataFrame containing
+        the count of each cell type per sample.
+        """
+
+        return melt_counts(self.data if data is None else data)
+
+    def insert_batches(self, query, df):
+        """
+        Insert the rows of a DataFrame in batches of 'batch_size' using executemany.
+
+        Returns:
+            The number of rows inserted.
+        """
+
+        # Send each slice of the DataFrame to the database as a single executemany call
+        for start in range(0, len(df), self.batch_size):
+            self.loader.cursor.executemany(query, to_records(df.iloc[start:start + self.batch_size]))
+
+        return len(df)
+
+    def clear_tables(self):
+        """
+        Delete every row from the main tables and reset their autoincrement counters, without committing.
+        The secondary indexes are dropped as well and rebuilt by 'build_indexes' once the load is done.
+        """
+
+        self.loader.drop_indexes("samples", "cell_counts")
+
+        self.loader.cursor.execute("DELETE FROM cell_counts")
+        self.loader.cursor.execute("DELETE FROM samples")
+        self.loader.cursor.execute("DELETE FROM subjects")
+        self.loader.cursor.execute("DELETE FROM changed_samples")
+        self.loader.cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'cell_counts'")
+
+        # Empty the lookup tables and their in-memory maps
+        for column, (table, _) in DIMENSIONS.items():
+            self.loader.cursor.execute(f"DELETE FROM {table}")
+            self.loader.cursor.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+            self.dimension_ids[column] = {}
+
+    def build_indexes(self):
+        """
+        Build the secondary indexes of the 'samples' and 'cell_counts' tables after a bulk load, without committing.
+        """
+
+        self.loader.create_indexes("samples", "cell_counts")
+
+    def bulk_insert(self):
+        """
+        Insert the CSV data into the lookup tables and the 'subjects', 'samples' and 'cell_counts' tables
+        in a single transaction, sending whole column batches with executemany instead of one
+        statement per row. The resulting tables are identical to the row-by-row inserts.
+
+        Returns:
+            The number of rows inserted and the throughput in rows per second.
+        """
+
+        start_time = time.perf_counter()
+        cursor = self.loader.cursor
+
+        try:
+            # Clear all tables and reset the autoincrement counters
+            self.clear_tables()
+
+            # Load the distinct projects, sample types, ... and cell types in order of first appearance
+            row_count = self.insert_dimension_values(dimension_values(self.data))
+
+            # Load the unique subjects
+            subjects_df = self.data[['subject', 'age', 'sex']].drop_duplicates(subset=['subject'])
+            row_count += self.insert_batches("INSERT INTO subjects (subject, age, sex) VALUES (?, ?, ?)",
+                                             subjects_df)
+
+            # Load the samples with their dimension ids resolved from the cached lookup maps
+            samples_df = self.encode_samples(self.data.assign(row_hash=compute_row_hashes(self.data)))
+            row_count += self.insert_batches(SAMPLES_INSERT, samples_df)
+
+            # Load the count of each cell type per sample
+            row_count += self.insert_batches(CELL_COUNTS_INSERT, self.encode_cell_counts(self.melt_cell_counts()))
+
+            # Record that every sample was touched by this load
+            cursor.execute("INSERT INTO changed_samples (sample) SELECT sample FROM samples")
+
+            # Index the loaded tables in one pass
+            self.build_indexes()
+
+            # Give the loaded tables a new version and commit every table at once
+            self.loader.mark_changed(*LOADED_TABLES)
+            self.loader.conn.commit()
+        except Exception:
+            # Leave the database untouched if any batch fails
+            self.loader.conn.rollback()
+            raise
+
+        # Report the ingest throughput
+        elapsed = time.perf_counter() - start_time
+        rows_per_sec = row_count / elapsed if elapsed > 0 else float("inf")
+        print(f"Inserted {row_count} rows in {elapsed:.2f}s ({rows_per_sec:,.0f} rows/sec)")
+
+        return row_count, rows_per_sec
+
+    def incremental_insert(self):
+        """
+        Insert only the samples that are new or changed since the last load, leaving existing rows untouched.
+
+        A sample is considered changed when the content hash of its CSV row differs from the 'row_hash'
+        stored in the 'samples' table. New dimension values are appended, and changed subjects, samples and
+        cell counts are upserted. Like a full load, a subject takes its age and sex from its first row in the file. The changed sample IDs are written to the 'changed_samples' table so
+        downstream stages can recompute only the affected aggregates.
+
+        Returns:
+            A list of the sample IDs that were inserted or updated.
+        """
+
+        start_time = time.perf_counter()
+        cursor = self.loader.cursor
+
+        # Obtain the hash of every sample already stored in the database
+        cursor.execute("SELECT sample, row_hash FROM samples")
+        stored_hashes = dict(cursor.fetchall())
+
+        # Keep only the rows whose hash is missing from or different to the stored one
+        data = self.data.assign(row_hash=compute_row_hashes(self.data))
+        changed = data[data['sample'].map(stored_hashes) != data['row_hash']]
+
+        try:
+            # Append any dimension values that are not in the database yet and refresh the lookup maps
+            self.load_dimension_maps()
+            self.insert_dimension_values(dimension_values(changed))
+
+            # Upsert the subjects of the changed samples from their first row in the file, the row a full
+            # load keeps, so a later sample of a subject does not overwrite its age and sex
+            subjects_df = data.loc[data['subject'].isin(changed['subject']), ['subject', 'age', 'sex']]
+            subjects_df = subjects_df.drop_duplicates(subset=['subject'])
+            self.insert_batches(
+                """
+                INSERT INTO subjects (subject, age, sex) VALUES (?, ?, ?)
+                ON CONFLICT(subject) DO UPDATE SET age = excluded.age, sex = excluded.sex
+                """,
+                subjects_df
+            )
+
+            # Upsert the changed samples
+            updates = ', '.join(f"{col} = excluded.{col}" for col in SAMPLE_COLS[1:])
+            self.insert_batches(f"{SAMPLES_INSERT} ON CONFLICT(sample) DO UPDATE SET {updates}",
+                                self.encode_samples(changed))
+
+            # Upsert the cell counts of the changed samples
+            self.insert_batches(
+                f"{CELL_COUNTS_INSERT} ON CONFLICT(sample, cell_type_id) DO UPDATE SET count = excluded.count",
+                self.encode_cell_counts(self.melt_cell_counts(changed))
+            )
+
+            # Record which samples changed for the downstream stages
+            cursor.execute("DELETE FROM changed_samples")
+            self.insert_batches("INSERT INTO changed_samples (sample) VALUES (?)", changed[['sample']])
+
+            # Give the loaded tables a new version and commit every table at once
+            self.loader.mark_changed(*LOADED_TABLES)
+            self.loader.conn.commit()
+        except Exception:
+            # Leave the database untouched if any batch fails
+            self.loader.conn.rollback()
+            raise
+
+        # Report how many samples were new or changed
+        elapsed = time.perf_counter() - start_time
+        print(f"Upserted {len(changed)} new or changed samples of {len(data)} in {elapsed:.2f}s")
+
+        return changed['sample'].tolist()
+
+    def insert_prepared(self, batch):
+        """
+        Insert a batch produced by 'prepare_batch' without committing. Dimension values and subjects that
+        are already in the database are skipped, keeping their first occurrence.
+
+        Returns:
+            The number of lookup, sample and cell count rows inserted.
+        """
+
+        # Append the dimension values that are not in the lookup maps yet
+        row_count = self.insert_dimension_values(batch['dimensions'])
+
+        # Append the subjects that are not in the database yet
+        self.insert_batches("INSERT OR IGNORE INTO subjects (subject, age, sex) VALUES (?, ?, ?)",
+                            batch['subjects'])
+
+        # Load the samples and the count of each cell type per sample
+        row_count += self.insert_batches(SAMPLES_INSERT, self.encode_samples(batch['samples']))
+        row_count += self.insert_batches(CELL_COUNTS_INSERT, self.encode_cell_counts(batch['cell_counts']))
+
+        # Record that the samples were touched by this load
+        self.insert_batches("INSERT INTO changed_samples (sample) VALUES (?)", batch['samples'][['sample']])
+
+        return row_count
+
+    def stream_insert(self, chunk_size=100000):
+        """
+        Insert the CSV file into the main tables by reading it in chunks of 'chunk_size' rows, so peak
+        memory stays bounded by the chunk size instead of the file size.
+
+        Each chunk is melted and inserted on its own. Dimension values are deduplicated across chunks through
+        the cached lookup maps and subjects through the primary key of the 'subjects' table, keeping the first
+        occurrence like the bulk mode. Cell ids are assigned chunk by chunk, so they are numbered in a
+        different order than the bulk mode, but every table holds the same rows.
+
+        Returns:
+            The number of rows inserted and the peak resident memory of the process in MB.
+        """
+
+        start_time = time.perf_counter()
+        row_count = 0
+
+        try:
+            # Clear all tables and reset the autoincrement counters
+            self.clear_tables()
+
+            # Read and insert the CSV file one chunk at a time
+            with read_csv(self.file_name, chunksize=chunk_size) as reader:
+                for chunk in reader:
+
+                    # Insert the chunk, skipping dimension values and subjects seen in an earlier chunk
+                    row_count += self.insert_prepared(prepare_batch(chunk))
+
+            # Count the subjects once, since duplicates across chunks were ignored by the database
+            self.loader.cursor.execute("SELECT COUNT(*) FROM subjects")
+            row_count += self.loader.cursor.fetchone()[0]
+
+            # Index the loaded tables in one pass
+            self.build_indexes()
+
+            # Give the loaded tables a new version and commit every table at once
+            self.loader.mark_changed(*LOADED_TABLES)
+            self.loader.conn.commit()
+        except Exception:
+            # Leave the database untouched if any chunk fails
+            self.loader.conn.rollback()
+            raise
+
+        # Report the ingest throughput and the peak memory of the process
+        elapsed = time.perf_counter() - start_time
+        peak_rss_mb = peak_rss() / (1024 * 1024)
+        print(f"Streamed {row_count} rows in {elapsed:.2f}s ({row_count / max(elapsed, 1e-9):,.0f} rows/sec), "
+              f"peak RSS {peak_rss_mb:.1f} MB")
+
+        return row_count, peak_rss_mb
+
+    def multi_file_insert(self, file_names, max_workers=None):
+        """
+        Insert several CSV files (e.g. one per clinical site) into the main tables.
+
+        The files are read, validated and prepared in a process pool so parsing scales across cores,
+        while this process is the single writer that inserts the prepared batches in file order and
+        commits them in one transaction. A sample that already appeared in an earlier file is not
+        overwritten; it is skipped and reported instead, and its row adds no subject or dimension value.
+
+        Returns:
+            A list of (sample, first file, duplicate file) tuples for the skipped duplicate samples.
+        """
+
+        start_time = time.perf_counter()
+        row_count = 0
+
+        # Remember which file each sample was first loaded from
+        sample_sources = {}
+        duplicates = []
+
+        try:
+            # Clear all tables and reset the autoincrement counters
+            self.clear_tables()
+
+            # Parse the files in parallel; map yields the prepared batches in file order
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                for file_name, batch in zip(file_names, executor.map(prepare_file, file_names)):
+
+                    # Drop the samples that were already loaded from an earlier file, with their subjects
+                    # and dimension values unless the remaining rows use them too
+                    seen = batch['samples']['sample'].map(sample_sources).notna()
+                    for sample in batch['samples'].loc[seen, 'sample']:
+                        duplicates.append((sample, sample_sources[sample], file_name))
+                    if seen.any():
+                        batch = drop_samples(batch, batch['samples'].loc[seen, 'sample'])
+
+                    # Insert the remaining rows of the file
+                    sample_sources.update(dict.fromkeys(batch['samples']['sample'], file_name))
+                    row_count += self.insert_prepared(batch)
+
+            # Count the subjects once, since duplicates across files were ignored by the database
+            self.loader.cursor.execute("SELECT COUNT(*) FROM subjects")
+            row_count += self.loader.cursor.fetchone()[0]
+
+            # Index the loaded tables in one pass
+            self.build_indexes()
+
+            # Give the loaded tables a new version and commit every file at once
+            self.loader.mark_changed(*LOADED_TABLES)
+            self.loader.conn.commit()
+        except Exception:
+            # Leave the database untouched if any file fails
+            self.loader.conn.rollback()
+            raise
+
+        # Report the ingest throughput and any duplicate samples
+        elapsed = time.perf_counter() - start_time
+        print(f"Inserted {row_count} rows from {len(file_names)} files in {elapsed:.2f}s "
+              f"({row_count / max(elapsed, 1e-9):,.0f} rows/sec)")
+        for sample, first_file, duplicate_file in duplicates:
+            print(f"Duplicate sample {sample} in {duplicate_file} skipped (already loaded from {first_file})")
+
+        return duplicates
+
     def close(self):
         # Close the connection
         self.loader.close()
 
 def main():
+    # Parse the load mode from the command line
+    parser = argparse.ArgumentParser(description="Load the cell count CSV file into the database.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--incremental", action="store_true",
+                      help="only upsert samples that are new or changed since the last load")
+    mode.add_argument("--stream", action="store_true",
+                      help="read the CSV file in chunks to keep memory bounded for very large files")
+    mode.add_argument("--files", metavar="DIR_OR_GLOB",
+                      help="load every CSV file in a directory or matching a glob, parsing them in parallel")
+    parser.add_argument("--chunk-size", type=int, default=100000,
+                        help="number of CSV rows per chunk in streaming mode")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of parsing processes for --files (defaults to the CPU count)")
+    parser.add_argument("--batch-size", type=int, default=50000,
+                        help="number of rows per executemany batch")
+    args = parser.parse_args()
+
     # Create an instance of CellDataInserter
-    inserter = CellDataInserter()
+    inserter = CellDataInserter(batch_size=args.batch_size)
 
-    # Insert the information into all tables in the Database
-    inserter.insert_projects()
-    inserter.insert_subjects()
-    inserter.insert_samples()
-    inserter.insert_cell_types()
+    if args.files:
+        # Insert every matching file, reporting samples duplicated across files
+        file_names = expand_input_paths(args.files)
+        if not file_names:
+            parser.error(f"no CSV files match {args.files}")
+        inserter.multi_file_insert(file_names, args.workers)
+    elif args.incremental:
+        # Insert only the new or changed samples
+        inserter.incremental_insert()
+    elif args.stream:
+        # Insert the CSV file chunk by chunk
+        inserter.stream_insert(args.chunk_size)
+    else:
+        # Insert the information into all tables in the Database in a single bulk transaction
+        inserter.bulk_insert()
 
     # Close the database connection
     inserter.close()
@@ -0,0 +1,150 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Extension of the columnar copy written next to every CSV output
+ARROW_EXTENSION = ".arrow"
+
+def arrow_path(csv_path):
+    """
+    Return the path of the Arrow IPC file that accompanies a CSV output.
+    """
+
+    return os.path.splitext(csv_path)[0] + ARROW_EXTENSION
+
+def to_arrow_table(df):
+    """
+    Convert a DataFrame to an Arrow table whose string columns are dictionary-encoded, so every
+    repeated value (e.g. a sample ID or population name) is stored once and referenced by an integer.
+    """
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            table = table.set_column(i, field.name, pc.dictionary_encode(table.column(i)))
+    return table
+
+def write_output(df, csv_path):
+    """
+    Save an analysis output both as a CSV file and as an uncompressed Arrow IPC file next to it.
+
+    The Arrow file is written to a temporary path and moved into place, so a reader never maps a
+    partially written file.
+    """
+
+    # Save the DataFrame information in a CSV file
+    df.to_csv(csv_path, index=False)
+
+    # Save the same information in the columnar format
+    write_arrow(to_arrow_table(df), csv_path)
+
+def write_arrow(table, csv_path):
+    """
+    Save an Arrow table as the Arrow IPC file of a CSV output, through a temporary path that is moved into place.
+    """
+
+    path = arrow_path(csv_path)
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def patch_output(changed_df, csv_path, key):
+    """
+    Replace the rows of some keys in an output sorted by a key column (e.g. the rows of the changed samples)
+    with new rows sorted the same way, keeping the output sorted without re-sorting it.
+
+    The existing rows are memory-mapped (see read_output_table), the span of each changed key is found by
+    binary search on the sorted key column, and the table is spliced back together from slices of the
+    existing rows and the new rows. Both files are still rewritten in full, since neither a CSV file nor an
+    Arrow IPC file can be updated in place, but the output is not parsed, concatenated and sorted again.
+    """
+
+    table = read_output_table(csv_path)
+    changed = to_arrow_table(changed_df).cast(table.schema)
+
+    # Find the rows of every changed key in the existing and the new rows, which are both sorted by key
+    keys = table.column(key).cast(pa.string()).to_numpy(zero_copy_only=False)
+    changed_keys = changed.column(key).cast(pa.string()).to_numpy(zero_copy_only=False)
+    unique_keys = pd.unique(changed_keys)
+    starts, ends = np.searchsorted(keys, unique_keys, "left"), np.searchsorted(keys, unique_keys, "right")
+    changed_starts = np.searchsorted(changed_keys, unique_keys, "left")
+    changed_ends = np.searchsorted(changed_keys, unique_keys, "right")
+
+    # Splice the kept slices of the existing rows around the new rows of each key
+    pieces, position = [], 0
+    for start, end, changed_start, changed_end in zip(starts, ends, changed_starts, changed_ends):
+        pieces.append(table.slice(position, start - position))
+        pieces.append(changed.slice(changed_start, changed_end - changed_start))
+        position = end
+    pieces.append(table.slice(position))
+
+    # Give the dictionary-encoded columns one dictionary, as an Arrow IPC file cannot replace them mid-file
+    patched = pa.concat_tables(pieces).unify_dictionaries().combine_chunks()
+
+    # Save the patched rows in a CSV file and the columnar format
+    patched.to_pandas().to_csv(csv_path, index=False)
+    write_arrow(patched, csv_path)
+
+def output_source(csv_path):
+    """
+    Return the file an output is read from: its Arrow IPC file when it is present and not older than
+    the CSV file, otherwise the CSV file itself.
+    """
+
+    path = arrow_path(csv_path)
+    if os.path.exists(path) and (not os.path.exists(csv_path) or
+                                 os.path.getmtime(path) >= os.path.getmtime(csv_path)):
+        return path
+    return csv_path
+
+def output_version(csv_path):
+    """
+    Return a cheap version key for an output, made of the path, modification time and size of the file
+    it is read from, so cached copies can be invalidated whenever a stage rewrites the output.
+    """
+
+    path = output_source(csv_path)
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+def read_output_table(csv_path):
+    """
+    Load an analysis output as an Arrow table, memory-mapping its Arrow IPC file when it is present and
+    up to date.
+
+    The columns of the table reference the mapped file rather than a copy of it, so a caller that filters
+    or slices the table and converts only the selected rows to pandas never copies the whole output. Falls
+    back to parsing the CSV file when the Arrow file is missing or older than the CSV file.
+
+    Returns:
+        An Arrow table with the contents of the output, with its string columns dictionary-encoded.
+    """
+
+    path = output_source(csv_path)
+    if path == csv_path:
+        return to_arrow_table(pd.read_csv(csv_path))
+
+    # The mapped buffers of the table stay valid after the file is closed
+    with pa.memory_map(path, "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+def read_output(csv_path):
+    """
+    Load an analysis output as a DataFrame, converting the memory-mapped Arrow table (see read_output_table)
+    when the Arrow IPC file is present and up to date.
+
+    Dictionary-encoded string columns are returned as pandas categoricals. Falls back to parsing the CSV
+    file when the Arrow file is missing or older than the CSV file.
+
+    Returns:
+        A DataFrame with the contents of the output.
+    """
+
+    if output_source(csv_path) != csv_path:
+        return read_output_table(csv_path).to_pandas()
+
+    return pd.read_csv(csv_path)
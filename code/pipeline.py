@@ -0,0 +1,291 @@
+from db import CellDataLoader, apply_profile
+import argparse
+import hashlib
+import os
+import time
+
+# Folder containing the stage scripts, used to fingerprint their code
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Pipeline stages in dependency order. Each stage lists the scripts it runs, the upstream stages whose tables
+# it reads, the database tables it reads, the input files it reads, the output files it writes and the
+# connection profile it runs with.
+STAGES = {
+    "create_tables": {
+        "code": ["db.py"],
+        "after": [],
+        "tables": [],
+        "inputs": [],
+        "outputs": [],
+        "profile": "default"
+    },
+    "load_data": {
+        "code": ["db.py", "load_data.py"],
+        "after": ["create_tables"],
+        "tables": [],
+        "inputs": ["input/cell_counts.csv"],
+        "outputs": [],
+        "profile": "bulk_load"
+    },
+    "cell_population_summary": {
+        "code": ["db.py", "outputs.py", "cell_population_summary.py"],
+        "after": ["load_data"],
+        "tables": ["cell_counts", "cell_types", "changed_samples"],
+        "inputs": [],
+        "outputs": ["output/cell_summary.csv", "output/cell_summary.arrow"],
+        "profile": "read_write"
+    },
+    "cell_response_analysis": {
+        "code": ["db.py", "outputs.py", "cohorts.py", "cell_response_analysis.py"],
+        "after": ["load_data", "cell_population_summary"],
+        "tables": ["subjects", "samples", "cell_summary", "conditions", "treatments",
+                   "sample_types", "responses", "cell_types"],
+        "inputs": [],
+        "outputs": ["output/cell_response.csv", "output/cell_response.arrow"],
+        "profile": "read_write"
+    },
+    "cell_response_stats": {
+        "code": ["db.py", "outputs.py", "cell_response_stats.py"],
+        "after": ["cell_response_analysis"],
+        "tables": ["cell_response", "cell_types"],
+        "inputs": [],
+        "outputs": ["output/cell_response_stats.csv", "output/cell_response_stats.arrow"],
+        "profile": "read_write"
+    },
+    "response_model": {
+        "code": ["outputs.py", "response_model.py"],
+        "after": ["cell_response_analysis"],
+        "tables": [],
+        "inputs": [],
+        "outputs": ["output/response_model.pkl"],
+        "profile": "default"
+    },
+    "cell_subset_analysis": {
+        "code": ["db.py", "outputs.py", "cohorts.py", "cell_subset_analysis.py"],
+        "after": ["load_data"],
+        "tables": ["subjects", "samples", "projects", "conditions", "treatments", "sample_types", "responses"],
+        "inputs": [],
+        "outputs": ["output/cell_project_summary.csv", "output/cell_response_summary.csv",
+                    "output/cell_gender_summary.csv", "output/cell_age_summary.csv",
+                    "output/cell_project_summary.arrow", "output/cell_response_summary.arrow",
+                    "output/cell_gender_summary.arrow", "output/cell_age_summary.arrow"],
+        "profile": "read_write"
+    },
+    "cell_cube": {
+        "code": ["db.py", "cube.py"],
+        "after": ["load_data", "cell_population_summary"],
+        "tables": ["subjects", "samples", "cell_summary"],
+        "inputs": [],
+        "outputs": [],
+        "profile": "read_write"
+    }
+}
+
+def file_hash(path):
+    """
+    Return the SHA-256 hash of a file's contents, or None if the file does not exist.
+    """
+
+    if not os.path.exists(path):
+        return None
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class PipelineRunner:
+    """
+    Run the analysis stages in one process with a single shared database connection.
+
+    Every stage is fingerprinted from its code, its input files, the fingerprints of the upstream stages
+    and the versions of the tables it reads (see CellDataLoader.mark_changed), so a table changed outside
+    the runner (e.g. by load_data.py --incremental or a rebuild.py switch) is noticed. The fingerprint of each
+    successful run is stored in the 'pipeline_state' table, and a stage whose fingerprint is unchanged
+    and whose output files exist is skipped.
+
+    With 'tables_built', the tables were already built by rebuild.py before it switched to a new version,
+    so only the output files are regenerated from them: the stages without outputs are recorded without
+    running and the summary and response stages only write their outputs.
+    """
+
+    def __init__(self, db_path="code/cell_data.db", file_name="input/cell_counts.csv", incremental=False,
+                 tables_built=False):
+        self.file_name = file_name
+        self.incremental = incremental
+        self.tables_built = tables_built
+
+        # Open the connection shared by every stage
+        self.loader = CellDataLoader(db_path)
+        self.loader.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_state (
+            stage TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            finished_at TEXT NOT NULL
+        )
+        """)
+        self.loader.conn.commit()
+
+        # Fingerprints computed during this run, so downstream stages can include them
+        self.fingerprints = {}
+
+        # Stages run during this run
+        self.ran = set()
+
+    def fingerprint(self, name):
+        """
+        Compute the fingerprint of a stage from its code, input files, upstream fingerprints and the versions
+        of the tables it reads.
+        """
+
+        stage = STAGES[name]
+        digest = hashlib.sha256(name.encode())
+        for code_file in stage["code"]:
+            digest.update(str(file_hash(os.path.join(CODE_DIR, code_file))).encode())
+        for input_file in stage["inputs"]:
+            digest.update(str(file_hash(input_file)).encode())
+        for upstream in stage["after"]:
+            digest.update(self.fingerprints[upstream].encode())
+        for version in self.loader.table_versions(*stage["tables"]):
+            digest.update(str(version).encode())
+        return digest.hexdigest()
+
+    def stored_fingerprint(self, name):
+        """
+        Return the fingerprint recorded by the last successful run of a stage, or None.
+        """
+
+        self.loader.cursor.execute("SELECT fingerprint FROM pipeline_state WHERE stage = ?", (name,))
+        row = self.loader.cursor.fetchone()
+        return row[0] if row else None
+
+    def record(self, name):
+        """
+        Store the fingerprint of a stage as the one of its last successful run.
+        """
+
+        self.loader.cursor.execute(
+            "INSERT OR REPLACE INTO pipeline_state (stage, fingerprint, finished_at) "
+            "VALUES (?, ?, datetime('now'))",
+            (name, self.fingerprints[name])
+        )
+        self.loader.conn.commit()
+
+    def run_create_tables(self):
+        self.loader.create_tables()
+        self.loader.conn.commit()
+
+    def run_load_data(self):
+        from load_data import CellDataInserter
+        inserter = CellDataInserter(self.file_name, loader=self.loader)
+        if self.incremental:
+            inserter.incremental_insert()
+        else:
+            inserter.bulk_insert()
+
+    def run_cell_population_summary(self):
+        from cell_population_summary import CellPopulationSummary
+        summarizer = CellPopulationSummary(loader=self.loader)
+        if self.tables_built:
+            summarizer.write_summary()
+            return
+
+        # Only the samples changed by an incremental load in this run need recomputing
+        incremental = self.incremental and "load_data" in self.ran
+        summarizer.compute_summary(incremental=incremental)
+
+    def run_cell_response_analysis(self):
+        from cell_response_analysis import CellResponseAnalysis
+        responder = CellResponseAnalysis(loader=self.loader)
+        if self.tables_built:
+            responder.write_response()
+        else:
+            responder.compute_response()
+
+    def run_cell_response_stats(self):
+        from cell_response_stats import CellResponseStatistics
+        statistician = CellResponseStatistics(loader=self.loader)
+        if self.tables_built:
+            statistician.write_statistics()
+        else:
+            statistician.compute_statistics()
+
+    def run_response_model(self):
+        from response_model import ResponseModelTrainer
+        ResponseModelTrainer().load_or_train()
+
+    def run_cell_subset_analysis(self):
+        from cell_subset_analysis import CellSubsetAnalysis
+        CellSubsetAnalysis(loader=self.loader).compute_all()
+
+    def run_cell_cube(self):
+        from cube import CellCube
+        CellCube(loader=self.loader).build()
+
+    def run(self, force=False):
+        """
+        Run every stage in dependency order, skipping the stages whose inputs have not changed.
+
+        Returns:
+            A dictionary mapping each stage to 'ran', 'skipped' or (with 'tables_built') 'recorded'.
+        """
+
+        start_time = time.perf_counter()
+        results = {}
+
+        for name, stage in STAGES.items():
+            stage_start = time.perf_counter()
+            self.fingerprints[name] = self.fingerprint(name)
+
+            # Skip the stage if nothing it depends on has changed and its outputs are still there
+            outputs_exist = all(os.path.exists(path) for path in stage["outputs"])
+            if not force and outputs_exist and self.stored_fingerprint(name) == self.fingerprints[name]:
+                results[name] = "skipped"
+                print(f"{name}: skipped (unchanged) in {time.perf_counter() - stage_start:.2f}s")
+                continue
+
+            # Tables built before a rebuild's switch are only recorded
+            if self.tables_built and not stage["outputs"]:
+                self.record(name)
+                results[name] = "recorded"
+                print(f"{name}: recorded (built by the rebuild)")
+                continue
+
+            # Tune the shared connection for the stage and run it
+            apply_profile(self.loader.conn, stage["profile"])
+            getattr(self, f"run_{name}")()
+
+            # Record the fingerprint of the successful run
+            self.record(name)
+
+            self.ran.add(name)
+            results[name] = "ran"
+            print(f"{name}: ran in {time.perf_counter() - stage_start:.2f}s")
+
+        print(f"Pipeline finished in {time.perf_counter() - start_time:.2f}s")
+        return results
+
+    def close(self):
+        # Commit the change and close the shared connection
+        self.loader.close()
+
+def main():
+    # Parse the options from the command line
+    parser = argparse.ArgumentParser(description="Run all analysis stages, skipping the ones that are up to date.")
+    parser.add_argument("--force", action="store_true", help="rerun every stage even if its inputs are unchanged")
+    parser.add_argument("--incremental", action="store_true",
+                        help="load only new or changed samples and update their cell summary rows")
+    args = parser.parse_args()
+
+    # Create an instance of PipelineRunner
+    runner = PipelineRunner(incremental=args.incremental)
+
+    # Run the stages that are out of date
+    runner.run(force=args.force)
+
+    # Close the shared database connection
+    runner.close()
+
+if __name__ == "__main__":
+    main()
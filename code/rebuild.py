@@ -0,0 +1,219 @@
+from db import CellDataLoader
+from load_data import CellDataInserter
+from cell_population_summary import CellPopulationSummary
+from cell_response_analysis import CellResponseAnalysis
+from cell_response_stats import CellResponseStatistics
+from cube import CellCube
+from pipeline import PipelineRunner
+import argparse
+import glob
+import os
+import time
+
+class DatabaseRebuilder:
+    """
+    Rebuild the database without ever exposing readers to empty or half-loaded tables.
+
+    The database path is a symbolic link to a versioned database file. A rebuild creates the tables,
+    loads the data, builds the indexes and computes every derived table ('cell_summary', 'cell_response',
+    'cell_response_stats' and 'cell_cube') in a new version file next to it, and only then atomically repoints the link. Connections that are already open keep
+    reading the version they opened, new connections see the new version, and the previous version is
+    kept so the switch can be rolled back.
+
+    Nothing is written to the output folder until the switch: the pipeline then only regenerates the
+    output files from the tables of the new version, so a failed build leaves the published outputs alone and all of them describe
+    the same version.
+    """
+
+    def __init__(self, file_name="input/cell_counts.csv", db_path="code/cell_data.db", keep=2):
+        self.file_name = file_name
+        self.db_path = db_path
+
+        # Number of version files kept on disk, including the live one
+        self.keep = keep
+
+        # Version files are named after the database path, e.g. code/cell_data.v<timestamp>.db
+        root, ext = os.path.splitext(db_path)
+        self.version_pattern = f"{root}.v*{ext}"
+        self.version_template = f"{root}.v{{}}{ext}"
+
+    def versions(self):
+        """
+        Return the paths of the version files on disk, oldest first.
+        """
+
+        return sorted(glob.glob(self.version_pattern))
+
+    def current_version(self):
+        """
+        Return the path of the version file the database path points to, or None if it is not a link.
+        """
+
+        if not os.path.islink(self.db_path):
+            return None
+        return os.path.join(os.path.dirname(self.db_path), os.readlink(self.db_path))
+
+    def switch(self, version_path):
+        """
+        Atomically point the database path at the given version file.
+        """
+
+        # Create the new link next to the old one and rename it over the database path in a single step
+        link_path = f"{self.db_path}.link"
+        if os.path.lexists(link_path):
+            os.remove(link_path)
+        os.symlink(os.path.basename(version_path), link_path)
+        os.replace(link_path, self.db_path)
+
+    def rebuild(self):
+        """
+        Build the full database into a new version file and switch the database path to it on success.
+
+        Returns:
+            The path of the new version file.
+        """
+
+        start_time = time.perf_counter()
+        legacy_path = self.version_template.format(time.time_ns())
+        version_path = self.version_template.format(time.time_ns())
+
+        try:
+            # Create the tables and load the data into the new version
+            loader = CellDataLoader(version_path)
+            loader.create_tables()
+            loader.close()
+
+            inserter = CellDataInserter(self.file_name, version_path)
+            inserter.bulk_insert()
+            inserter.close()
+
+            # Compute the derived tables in the new version, leaving the outputs to the pipeline
+            summarizer = CellPopulationSummary(version_path)
+            summarizer.build_summary()
+            summarizer.loader.close()
+
+            responder = CellResponseAnalysis(version_path)
+            responder.build_response()
+            responder.loader.close()
+
+            statistician = CellResponseStatistics(version_path)
+            statistician.build_statistics()
+            statistician.loader.close()
+
+            # Aggregate the 'cell_cube' table from the new data
+            cube = CellCube(version_path)
+            cube.build()
+            cube.loader.close()
+
+            # Only switch to a version that passes SQLite's consistency check
+            loader = CellDataLoader(version_path)
+            loader.cursor.execute("PRAGMA quick_check")
+            result = loader.cursor.fetchone()[0]
+            loader.close()
+            if result != "ok":
+                raise RuntimeError(f"Rebuilt database failed its consistency check: {result}")
+        except Exception:
+            # Discard the partial version; the live database and the outputs are untouched
+            self.remove(version_path)
+            raise
+
+        # A database that is still a plain file is kept as a version through a hard link so it can be rolled
+        # back to, without moving the file that open connections are using
+        previous = self.current_version()
+        if os.path.isfile(self.db_path) and not os.path.islink(self.db_path):
+            loader = CellDataLoader(self.db_path)
+            loader.cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            loader.close()
+            os.link(self.db_path, legacy_path)
+            previous = legacy_path
+
+        # Atomically switch to the new version and remove the versions that are no longer kept, keeping the
+        # one that was live until now so the switch can be rolled back
+        self.switch(version_path)
+        self.prune(previous)
+
+        # The journal files of the replaced plain file are named after the database path, so nothing
+        # would ever clean them up: its data is in the hard linked version since the checkpoint
+        for path in (f"{self.db_path}-wal", f"{self.db_path}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+        self.write_outputs()
+
+        elapsed = time.perf_counter() - start_time
+        print(f"Rebuilt {self.db_path} -> {os.path.basename(version_path)} in {elapsed:.2f}s")
+
+        return version_path
+
+    def rollback(self):
+        """
+        Switch the database path back to the version before the live one, remove the rolled back
+        versions, so the next rebuild keeps the version that is now live, and regenerate the outputs from it.
+
+        Returns:
+            The path of the version that is now live.
+        """
+
+        current = self.current_version()
+        older = [path for path in self.versions() if current is None or path < current]
+        if not older:
+            raise RuntimeError(f"No previous version of {self.db_path} to roll back to.")
+
+        self.switch(older[-1])
+        for version_path in self.versions():
+            if version_path > older[-1]:
+                self.remove(version_path)
+
+        self.write_outputs()
+        print(f"Rolled back {self.db_path} -> {os.path.basename(older[-1])}")
+
+        return older[-1]
+
+    def write_outputs(self):
+        """
+        Regenerate every output file from the tables of the live version.
+        """
+
+        runner = PipelineRunner(self.db_path, self.file_name, tables_built=True)
+        runner.run(force=True)
+        runner.close()
+
+    def prune(self, previous=None):
+        """
+        Remove the version files beyond the number to keep. The live version and the previous version (the
+        one live before the last switch) are always kept, and any other slots go to the newest versions.
+        """
+
+        kept = [path for path in (self.current_version(), previous) if path is not None]
+        others = [path for path in self.versions() if path not in kept]
+        for version_path in others[:max(len(others) - max(self.keep - len(kept), 0), 0)]:
+            self.remove(version_path)
+
+    @staticmethod
+    def remove(version_path):
+        """
+        Remove a version file and its journal files.
+        """
+
+        # Readers that still have an old version open keep their file handle until they close it
+        for path in glob.glob(f"{version_path}*"):
+            os.remove(path)
+
+def main():
+    # Parse the action from the command line
+    parser = argparse.ArgumentParser(description="Rebuild the database in a shadow file and swap it in atomically.")
+    parser.add_argument("--rollback", action="store_true", help="switch back to the previous database version")
+    args = parser.parse_args()
+
+    # Create an instance of DatabaseRebuilder
+    rebuilder = DatabaseRebuilder()
+
+    if args.rollback:
+        # Switch back to the previous version
+        rebuilder.rollback()
+    else:
+        # Rebuild the database and switch to it
+        rebuilder.rebuild()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+from outputs import read_output
+import hashlib
+import os
+import pickle
+import pandas as pd
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import accuracy_score
+from xgboost import DMatrix, XGBClassifier
+
+# Conservative, regularized XGBoost parameters tailored for noisy clinical datasets
+MODEL_PARAMS = {
+    "n_estimators": 300,   # Give the model plenty of iterations to learn subtle patterns
+    "learning_rate": 0.02, # Use a small step size to prevent overshooting the global minimum
+    "max_depth": 1,        # Constrain trees to decision stumps to severely penalize feature interaction noise
+    "reg_lambda": 4.0,     # Apply heavy L2 regularization to smooth out volatile biomarker variances
+    "subsample": 0.8,      # Train on a random 80% subset of patient profiles per tree to boost variance generalization
+    "random_state": 42     # Enforce deterministic results for reproducible metrics
+}
+
+def build_features(cell_response_df):
+    """
+    Transform the per-subject cell response output from a long format to a wide format for modeling.
+
+    Returns:
+        A DataFrame with the 'subject' column, one count column per cell population and a final 0/1
+        'response_yes' target column.
+    """
+
+    # Group the data by patient, turning unique cell types into feature columns
+    features_df = cell_response_df.pivot(
+        index=['subject', 'response'],  # Keep these as tracking/label rows (one row per subject)
+        columns='population',           # Pivot unique cell types into individual column headers (features)
+        values='total_population_count' # Populate the matrix cells with their respective count values
+    ).reset_index()                     # Flatten the multi-index so 'subject' and 'response' become standard columns
+
+    # Remove the lingering 'population' name from the columns axis metadata
+    features_df.columns.name = None
+
+    # One-hot encode the response column (located at index 1); drop_first=True keeps a single binary
+    # column, which is appended to the far right
+    features_df = pd.get_dummies(features_df, columns=[features_df.columns[1]], drop_first=True)
+
+    # Cast the one-hot encoded boolean column to integer (0/1)
+    return features_df.assign(**{features_df.columns[-1]: features_df.iloc[:, -1].astype(int)})
+
+def training_fingerprint(features_df):
+    """
+    Compute the SHA-256 fingerprint of the training data and model parameters, used to decide whether
+    a saved model is still valid.
+    """
+
+    digest = hashlib.sha256(repr(sorted(MODEL_PARAMS.items())).encode())
+    digest.update(repr([str(col) for col in features_df.columns]).encode())
+    digest.update(pd.util.hash_pandas_object(features_df.astype(str), index=False).values.tobytes())
+    return digest.hexdigest()
+
+def feature_contributions(artifact, values):
+    """
+    Compute the contribution of every cell population to the model's prediction for one patient, using
+    XGBoost's exact per-tree contributions (pred_contribs) in log-odds of being a responder.
+
+    Args:
+        artifact: a model artifact created by ResponseModelTrainer.train.
+        values: a dictionary mapping each cell population to the patient's count.
+
+    Returns:
+        A tuple (contributions_df, base_value). contributions_df has the columns 'population', 'count' and
+        'contribution', ranked by the absolute contribution; positive values push the prediction towards
+        a response. The contributions plus base_value equal the model's log-odds output.
+    """
+
+    input_df = pd.DataFrame([values], columns=artifact["feature_names"])
+    contributions = artifact["model"].get_booster().predict(DMatrix(input_df), pred_contribs=True)[0]
+
+    contributions_df = pd.DataFrame({
+        "population": artifact["feature_names"],
+        "count": input_df.iloc[0].to_numpy(),
+        "contribution": contributions[:-1]
+    })
+    order = contributions_df["contribution"].abs().sort_values(ascending=False, kind="stable").index
+    return contributions_df.loc[order].reset_index(drop=True), float(contributions[-1])
+
+class ResponseModelTrainer:
+    """
+    Train the XGBoost classifier predicting the response of melanoma patients to miraclib from their
+    cell population counts, and persist it as an artifact keyed by a fingerprint of the training data.
+    """
+
+    def __init__(self, response_file_path="output/cell_response.csv", model_path="output/response_model.pkl"):
+        self.response_file_path = response_file_path
+        self.model_path = model_path
+
+    def features(self):
+        """
+        Read the cell response output and build the feature table.
+        """
+
+        return build_features(read_output(self.response_file_path))
+
+    def train(self, features_df=None):
+        """
+        Train the classifier on a stratified 70/30 train/test split.
+
+        Returns:
+            A dictionary artifact containing:
+            - fingerprint: fingerprint of the training data and model parameters
+            - model: the fitted XGBClassifier
+            - feature_names: the cell population columns in the order the model expects
+            - train_accuracy / test_accuracy: accuracy on the training and test subjects
+            - lower_thresholds / higher_thresholds: 33rd and 66th percentile of each cell population
+        """
+
+        if features_df is None:
+            features_df = self.features()
+
+        # Separate the cell population features (X) from the binary response target (y)
+        X = features_df.iloc[:, 1:-1]
+        y = features_df.iloc[:, -1]
+
+        # Partition the data into a 70/30 train/test split that preserves the class balance
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=42, stratify=y)
+
+        # Fit the model to the training cohort
+        model = XGBClassifier(**MODEL_PARAMS)
+        model.fit(X_train, y_train)
+
+        # Calculate the 33rd and 66th percentile of each cell population to stratify patient inputs
+        lower_thresholds = {col: features_df[col].quantile(0.33).item() for col in X.columns}
+        higher_thresholds = {col: features_df[col].quantile(0.66).item() for col in X.columns}
+
+        return {
+            "fingerprint": training_fingerprint(features_df),
+            "model": model,
+            "feature_names": list(X.columns),
+            "train_accuracy": accuracy_score(y_train, model.predict(X_train)),
+            "test_accuracy": accuracy_score(y_test, model.predict(X_test)),
+            "lower_thresholds": lower_thresholds,
+            "higher_thresholds": higher_thresholds
+        }
+
+    def save(self, artifact):
+        """
+        Save an artifact to the model path, writing a temporary file first so readers never load a
+        partially written model.
+        """
+
+        tmp_path = self.model_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(artifact, f)
+        os.replace(tmp_path, self.model_path)
+
+    def load(self):
+        """
+        Load the saved artifact, or return None if it is missing or cannot be read.
+        """
+
+        try:
+            with open(self.model_path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, AttributeError, ImportError, EOFError):
+            return None
+
+    def load_or_train(self):
+        """
+        Return the saved artifact if it was trained on the current data, otherwise train and save a new one.
+        """
+
+        features_df = self.features()
+        artifact = self.load()
+        if artifact is not None and artifact.get("fingerprint") == training_fingerprint(features_df):
+            return artifact
+
+        artifact = self.train(features_df)
+        self.save(artifact)
+        return artifact
+
+def main():
+    # Create an instance of ResponseModelTrainer
+    trainer = ResponseModelTrainer()
+
+    # Train the model if the data changed since the saved model was trained
+    artifact = trainer.load_or_train()
+
+    # Print the metrics and thresholds for validation
+    print(f"Training Accuracy: {artifact['train_accuracy']:.4f}")
+    print(f"Test Accuracy: {artifact['test_accuracy']:.4f}")
+    print("33rd Percentile:", artifact["lower_thresholds"])
+    print("66th Percentile:", artifact["higher_thresholds"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+def average_ranks(values):
+    """
+    Rank the values of every row of a matrix at once, giving ties the average of their ranks (like
+    scipy.stats.rankdata) and leaving missing values as NaN.
+
+    Sorting each row once and locating the runs of equal values keeps the whole computation in NumPy,
+    which is much faster than ranking row by row.
+    """
+
+    n_columns = values.shape[1]
+    positions = np.broadcast_to(np.arange(n_columns), values.shape)
+
+    # Sort every row; missing values sort to the end
+    order = np.argsort(values, axis=1)
+    sorted_values = np.take_along_axis(values, order, axis=1)
+
+    # Mark where each run of equal values starts and ends
+    starts = np.ones(values.shape, dtype=bool)
+    starts[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    ends = np.ones(values.shape, dtype=bool)
+    ends[:, :-1] = starts[:, 1:]
+
+    # Every value gets the average of the first and last position of its run
+    first = np.maximum.accumulate(np.where(starts, positions, 0), axis=1)
+    last = np.minimum.accumulate(np.where(ends, positions, n_columns)[:, ::-1], axis=1)[:, ::-1]
+
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, (first + last) / 2 + 1, axis=1)
+    ranks[np.isnan(values)] = np.nan
+    return ranks
+
+def rank_sum_matrix(values, in_group):
+    """
+    Run the Wilcoxon rank-sum test on every row of a matrix at once.
+
+    Each row holds one feature (e.g. a cell population) measured on the columns (e.g. subjects). Missing
+    measurements are NaN and left out of their row's test. The statistic is the same normal approximation
+    without tie correction as scipy.stats.ranksums.
+
+    Args:
+        values: a 2-D array of shape (features, columns).
+        in_group: a boolean array marking the columns of the first group, either one per column or one
+            per cell of 'values'. The other non-missing columns form the second group.
+
+    Returns:
+        A DataFrame with one row per feature and the columns:
+        - statistic: z score of the first group's rank sum
+        - p_value: two-sided p-value
+        - effect_size: rank-biserial correlation, positive when the first group tends to be higher
+        - n_first / n_second: number of measurements in each group
+        Rows with an empty group have NaN statistics.
+    """
+
+    values = np.asarray(values, dtype=float)
+    in_group = np.broadcast_to(np.asarray(in_group, dtype=bool), values.shape)
+
+    # Rank every row at once, averaging the ranks of ties and skipping missing values
+    present = ~np.isnan(values)
+    ranks = average_ranks(values)
+
+    # Sum the ranks of the first group and count both groups in each row
+    first = present & in_group
+    n_first = first.sum(axis=1)
+    n_second = (present & ~in_group).sum(axis=1)
+    rank_sum = np.where(first, ranks, 0).sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Compare the rank sum with its expected value under the null hypothesis
+        n_total = n_first + n_second
+        expected = n_first * (n_total + 1) / 2
+        z = (rank_sum - expected) / np.sqrt(n_first * n_second * (n_total + 1) / 12)
+        p_value = 2 * norm.sf(np.abs(z))
+
+        # Rank-biserial correlation from the Mann-Whitney U statistic of the first group
+        u_first = rank_sum - n_first * (n_first + 1) / 2
+        effect_size = 2 * u_first / (n_first * n_second) - 1
+
+    return pd.DataFrame({
+        "statistic": z,
+        "p_value": p_value,
+        "effect_size": effect_size,
+        "n_first": n_first,
+        "n_second": n_second
+    })
+
+def benjamini_hochberg(p_values):
+    """
+    Adjust p-values for the false discovery rate with the Benjamini-Hochberg procedure.
+
+    Missing p-values stay missing and are not counted as tests.
+
+    Returns:
+        An array of adjusted p-values in the same order as the input.
+    """
+
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full(p_values.shape, np.nan)
+    tested = np.flatnonzero(~np.isnan(p_values))
+    if len(tested) == 0:
+        return adjusted
+
+    # Scale the sorted p-values by the number of tests over their rank, then enforce monotonicity
+    # from the largest p-value down
+    order = tested[np.argsort(p_values[tested], kind="stable")]
+    scaled = p_values[order] * len(order) / np.arange(1, len(order) + 1)
+    adjusted[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1.0)
+    return adjusted
+
+def compare_groups(long_df, feature="population", unit="subject", split="response", value="percentage",
+                   first="yes", second="no", aggfunc=None):
+    """
+    Compare two cohort groups on every feature of a long frame in one vectorized pass.
+
+    The frame must hold at most one row per (feature, unit, group), e.g. the per-subject frequencies of
+    'cell_response'. It is pivoted into a features x (unit, group) matrix, so a unit that belongs to both
+    groups (e.g. a subject with mixed responses) contributes one column to each. Any column of the frame can
+    define the split, e.g. 'response' (yes vs. no) or 'sex' (M vs. F).
+
+    A frame with several rows per unit (e.g. per-sample frequencies compared by subject) needs an 'aggfunc'
+    (e.g. "mean") that reduces them to one value per unit; without it a ValueError is raised rather than
+    treating the rows as independent observations.
+
+    Returns:
+        A DataFrame indexed by feature with the columns of rank_sum_matrix and 'p_adjusted', the
+        Benjamini-Hochberg adjusted p-value across all features.
+    """
+
+    # Keep the rows of the two groups and arrange them as a features x (unit, group) matrix
+    rows = long_df[long_df[split].isin([first, second])]
+    if aggfunc is not None:
+        matrix = rows.pivot_table(index=feature, columns=[unit, split], values=value, aggfunc=aggfunc,
+                                  observed=True)
+    else:
+        duplicated = rows.duplicated([feature, unit, split])
+        if duplicated.any():
+            example = tuple(rows.loc[duplicated, [feature, unit, split]].iloc[0])
+            raise ValueError(f"{duplicated.sum()} rows repeat a ({feature}, {unit}, {split}) combination, "
+                             f"e.g. {example}; pass an aggfunc to reduce them to one value per {unit}.")
+        matrix = rows.set_index([feature, unit, split])[value].unstack([unit, split])
+
+    # Test every feature at once and adjust for the number of features tested
+    in_first = matrix.columns.get_level_values(split) == first
+    results = rank_sum_matrix(matrix.to_numpy(), in_first)
+    results.index = matrix.index
+    results["p_adjusted"] = benjamini_hochberg(results["p_value"].to_numpy())
+    return results
@@ -0,0 +1,269 @@
+from db import CellDataLoader
+import numpy as np
+import pandas as pd
+
+# Query reading one page of 'cell_summary' in (sample, population) order. The keyset condition and the
+# filters are filled in by CellSummaryQueries.page; the sample index (or the population index when filtering
+# by population) yields the rows in sample order, so only the few populations of each sample are sorted and
+# the scan stops after 'limit' rows.
+PAGE_QUERY = """
+    SELECT
+        cs.sample,
+        cs.total_count,
+        ct.cell_type AS population,
+        cs.count,
+        cs.percentage
+    FROM cell_summary AS cs
+    JOIN cell_types AS ct ON ct.cell_type_id = cs.cell_type_id
+    WHERE {conditions}
+    ORDER BY cs.sample {direction}, ct.cell_type {direction}
+    LIMIT :limit
+"""
+
+# Keyset conditions of the rows after, from (inclusive) and before a (sample, population) key
+KEYSET_CONDITIONS = {
+    "after": "cs.sample >= :key_sample AND (cs.sample > :key_sample OR ct.cell_type > :key_population)",
+    "start": "cs.sample >= :key_sample AND (cs.sample > :key_sample OR ct.cell_type >= :key_population)",
+    "before": "cs.sample <= :key_sample AND (cs.sample < :key_sample OR ct.cell_type < :key_population)"
+}
+
+# Filter conditions on the sample and the population
+FILTER_CONDITIONS = {
+    "sample": "cs.sample = :sample",
+    "population": "cs.cell_type_id = (SELECT cell_type_id FROM cell_types WHERE cell_type = :population)"
+}
+
+# Query reading the (sample, population) key of every row of 'cell_summary' from the sample index, used to build
+# the filter index
+KEYS_QUERY = """
+    SELECT
+        sample,
+        cell_type_id
+    FROM cell_summary
+    ORDER BY sample, cell_type_id
+"""
+
+class SummaryFilterIndex:
+    """
+    Compact index of the (sample, population) keys of the 'cell_summary' table, built once per data version.
+
+    Rows are numbered by their position in (sample, population) order, the order of the dashboard table. The
+    index keeps the sorted sample list, the position where each sample's rows start and the population of
+    every row, so the selector options, row counts and the rows matching a filter are found in time
+    proportional to the result instead of the table.
+    """
+
+    def __init__(self, samples, starts, population_codes, populations):
+        # Sorted sample IDs (a NumPy string array) and the position of each sample's first row (plus the total
+        # row count at the end)
+        self.samples = samples
+        self.starts = starts
+
+        # Alphabetically sorted population names and the index of each row's population in that list
+        self.populations = populations
+        self.population_codes = population_codes
+        self.codes = {population: code for code, population in enumerate(populations)}
+
+        # Positions of the rows of each population, in table order
+        self.population_positions = {
+            population: np.flatnonzero(population_codes == code) for code, population in enumerate(populations)
+        }
+
+    @classmethod
+    def build(cls, queries):
+        """
+        Build the index from the keys of every row, read in one pass over the sample index.
+        """
+
+        keys_df = pd.read_sql_query(KEYS_QUERY, queries.loader.conn)
+        populations = queries.populations()
+        sample_keys = keys_df["sample"].to_numpy()
+
+        # Locate where each sample's rows start
+        boundaries = np.ones(len(sample_keys), dtype=bool)
+        boundaries[1:] = sample_keys[1:] != sample_keys[:-1]
+        first_rows = np.flatnonzero(boundaries)
+        starts = np.append(first_rows, len(sample_keys))
+
+        # Number the populations alphabetically and sort the rows of each sample by population name
+        id_to_code = dict(zip(queries.population_ids(populations), range(len(populations))))
+        codes = keys_df["cell_type_id"].map(id_to_code).to_numpy(dtype=np.int16)
+        sample_numbers = np.repeat(np.arange(len(first_rows)), np.diff(starts))
+        codes = codes[np.lexsort((codes, sample_numbers))]
+
+        return cls(sample_keys[first_rows].astype(str), starts, codes, populations)
+
+    def search(self, prefix, limit=20):
+        """
+        Find the samples starting with a prefix by binary search in the sorted sample list.
+
+        Returns:
+            A tuple (matches, total): the first 'limit' matching samples in sorted order, and the number of
+            samples matching the prefix.
+        """
+
+        # Every sample starting with the prefix sorts between the prefix and the prefix followed by the largest
+        # character
+        first = np.searchsorted(self.samples, prefix, side="left")
+        last = np.searchsorted(self.samples, prefix + chr(0x10FFFF), side="left")
+        return self.samples[first:min(last, first + limit)].tolist(), int(last - first)
+
+    def positions(self, sample=None, population=None):
+        """
+        Return the positions of the rows matching the selected sample and population (None for all), in
+        table order.
+        """
+
+        if sample is None:
+            if population is None:
+                return np.arange(self.starts[-1])
+            return self.population_positions.get(population, np.empty(0, dtype=np.int64))
+
+        # Find the sample's rows by binary search
+        number = np.searchsorted(self.samples, sample)
+        if number == len(self.samples) or self.samples[number] != sample:
+            return np.empty(0, dtype=np.int64)
+        rows = np.arange(self.starts[number], self.starts[number + 1])
+        if population is None:
+            return rows
+        return rows[self.population_codes[rows] == self.codes.get(population, -1)]
+
+    def count(self, sample=None, population=None):
+        """
+        Return the number of rows matching the selected sample and population (None for all).
+        """
+
+        if sample is None and population is None:
+            return int(self.starts[-1])
+        return len(self.positions(sample, population))
+
+    def key(self, position):
+        """
+        Return the (sample, population) key of the row at a position.
+        """
+
+        number = np.searchsorted(self.starts, position, side="right") - 1
+        return str(self.samples[number]), self.populations[self.population_codes[position]]
+
+    def page_start(self, page_number, sample=None, population=None, page_size=10):
+        """
+        Return the key of the first row of a page of the filtered rows, or None if the page is empty.
+        """
+
+        if sample is None and population is None:
+            position = page_number * page_size
+            return self.key(position) if position < self.starts[-1] else None
+
+        positions = self.positions(sample, population)
+        if page_number * page_size >= len(positions):
+            return None
+        return self.key(positions[page_number * page_size])
+
+class CellSummaryQueries:
+    """
+    Query the 'cell_summary' table one page at a time with keyset pagination, so the dashboard never
+    holds the full table.
+
+    Pages are ordered by (sample, population) and addressed by the key of a neighbouring row instead of an
+    offset: the next page starts after the last row shown and the previous page ends before the first one.
+    Every page is read through an index of 'cell_summary', touching only the rows it returns.
+    """
+
+    def __init__(self, db_path="code/cell_data.db", profile="read_mostly", loader=None):
+        # Use the given loader or open a new read-only connection
+        self.loader = loader or CellDataLoader(db_path, profile)
+
+    @staticmethod
+    def filters(sample=None, population=None):
+        """
+        Return the filter conditions and parameters of the selected sample and population (None for all).
+        """
+
+        params = {"sample": sample, "population": population}
+        conditions = [FILTER_CONDITIONS[name] for name, value in params.items() if value is not None]
+        return conditions, {name: value for name, value in params.items() if value is not None}
+
+    def version(self):
+        """
+        Return the version of the 'cell_summary' table (see CellDataLoader.mark_changed), which changes
+        whenever the table is rewritten.
+        """
+
+        return self.loader.table_versions("cell_summary")[0]
+
+    def populations(self):
+        """
+        Return the names of all cell populations in alphabetical order.
+        """
+
+        self.loader.cursor.execute("SELECT cell_type FROM cell_types ORDER BY cell_type")
+        return [population for (population,) in self.loader.cursor.fetchall()]
+
+    def population_ids(self, populations):
+        """
+        Return the cell_type_id of each of the given population names.
+        """
+
+        self.loader.cursor.execute("SELECT cell_type, cell_type_id FROM cell_types")
+        ids = dict(self.loader.cursor.fetchall())
+        return [ids[population] for population in populations]
+
+    def filter_index(self):
+        """
+        Build the SummaryFilterIndex of the table.
+        """
+
+        return SummaryFilterIndex.build(self)
+
+    def page_query(self, sample=None, population=None, after=None, start=None, before=None, limit=10):
+        """
+        Build the query reading one page; see 'page' for the arguments.
+
+        Returns:
+            A tuple (query, params, descending), where 'descending' tells whether the query reads the page
+            backwards.
+        """
+
+        conditions, params = self.filters(sample, population)
+        params["limit"] = limit
+
+        # Add the keyset condition of the neighbouring row, if any
+        keys = {"after": after, "start": start, "before": before}
+        given = [name for name, key in keys.items() if key is not None]
+        if len(given) > 1:
+            raise ValueError("Give at most one of 'after', 'start' and 'before'.")
+        if given:
+            conditions.append(KEYSET_CONDITIONS[given[0]])
+            params["key_sample"], params["key_population"] = keys[given[0]]
+
+        # The previous page is read backwards from its end
+        descending = given == ["before"]
+        query = PAGE_QUERY.format(conditions=" AND ".join(conditions) or "1",
+                                  direction="DESC" if descending else "ASC")
+        return query, params, descending
+
+    def page(self, sample=None, population=None, after=None, start=None, before=None, limit=10):
+        """
+        Read one page of rows matching the selected sample and population (None for all).
+
+        Args:
+            after: (sample, population) key of the last row of the previous page, to read the next page.
+            start: (sample, population) key of the first row of the page, to read the same page again.
+            before: (sample, population) key of the first row of the following page, to read the previous page.
+            With no key, the first page is read.
+
+        Returns:
+            A DataFrame with the columns sample, total_count, population, count and percentage, holding at
+            most 'limit' rows in (sample, population) order.
+        """
+
+        query, params, descending = self.page_query(sample, population, after, start, before, limit)
+        page_df = pd.read_sql_query(query, self.loader.conn, params=params)
+
+        # Put a page read backwards back in order
+        if descending:
+            page_df = page_df.iloc[::-1].reset_index(drop=True)
+        return page_df
+
+    def close(self):
+        self.loader.close()
@@ -16,6 +16,43 @@ echo ""
 # Run analysis for Part IV
 echo "Running analysis to verify cell subsets (Part IV)..."
 python3 testing/test_cell_subset_analysis.py
+echo ""
+
+# Run tests for the precomputed response statistics
+echo "Running tests to verify the response statistics of every cell population..."
+python3 testing/test_cell_response_stats.py
+
+# Run tests for the cohort query engine
+echo "Running tests to verify the batch cohort queries..."
+python3 testing/test_cohorts.py
+
+# Run tests for the aggregate cube
+echo "Running tests to verify the cube slices and roll-ups..."
+python3 testing/test_cube.py
+
+# Run tests for the paginated cell population table
+echo "Running tests to verify the keyset-paginated cell population queries..."
+python3 testing/test_summary_queries.py
+
+# Run tests for the batch statistics engine
+echo "Running tests to verify the vectorized rank-sum and FDR engine..."
+python3 testing/test_stats_engine.py
+
+# Run tests for the database indexes
+echo "Running tests to verify that the analysis queries use indexes..."
+python3 testing/test_query_plans.py
+
+# Run tests for the saved response model
+echo "Running tests to verify the saved response model..."
+python3 testing/test_response_model.py
+
+# Run tests for the explanation engine against a local fake client
+echo "Running tests to verify the concurrent explanation engine..."
+python3 testing/test_explanations.py
+
+# Run tests for the versioned database rebuilds in a scratch folder
+echo "Running tests to verify the rebuild outputs and rollback..."
+python3 testing/test_rebuild.py
 
 # Final message
 echo ""
@@ -0,0 +1,40 @@
+import pandas as pd
+from scipy.stats import ranksums
+from statsmodels.stats.multitest import multipletests
+
+# Read the per-subject frequencies and the precomputed statistics
+response_df = pd.read_csv("output/cell_response.csv")
+stats_df = pd.read_csv("output/cell_response_stats.csv")
+
+# Iterate over the populations
+for population, cell_df in response_df.groupby("population"):
+    # Obtain the precomputed row of the population
+    my_row = stats_df[stats_df["population"] == population]
+
+    # If the row is empty print a notification
+    if my_row.empty:
+        print(f"No statistics for {population}.")
+        continue
+
+    # Every subject in this dataset has a single response, so the rank-sum test applies
+    yes = cell_df[cell_df["response"] == "yes"]["percentage"]
+    no = cell_df[cell_df["response"] == "no"]["percentage"]
+    real_stat, real_p_value = ranksums(yes, no)
+
+    # Compare the test statistic and p-value with the precomputed ones
+    row = my_row.iloc[0]
+    if row["method"] == "ranksums" and abs(row["statistic"] - real_stat) < 1e-9 and \
+            abs(row["p_value"] - real_p_value) < 1e-12 and -1 <= row["effect_size"] <= 1 and \
+            row["responders"] == len(yes) and row["non_responders"] == len(no):
+        print(f"{population} passed the response statistics test!")
+    else:
+        print(f"{population} FAILED the response statistics test: {row.to_dict()} vs. p-value {real_p_value}")
+
+# The adjusted p-values should match statsmodels' Benjamini-Hochberg correction across populations
+expected = multipletests(stats_df["p_value"], method="fdr_bh")[1]
+if ((stats_df["p_adjusted"] - expected).abs() < 1e-12).all():
+    print("adjusted p-values passed the response statistics test!")
+else:
+    print("adjusted p-values FAILED the response statistics test")
+
+print()
@@ -5,6 +5,7 @@ input_df = pd.read_csv("input/cell_counts.csv")
 project_output_df = pd.read_csv("output/cell_project_summary.csv")
 response_output_df = pd.read_csv("output/cell_response_summary.csv")
 gender_output_df = pd.read_csv("output/cell_gender_summary.csv")
+age_output_df = pd.read_csv("output/cell_age_summary.csv")
 
 # Filter the input dataframe with the criteria
 filtered_df = input_df[
@@ -67,3 +68,26 @@ for gender, count in gender_counts.items():
         print(f"{gender} passed the cell subset test for gender!")
 
 print()
+
+# ------------------ Age bands ------------------
+# Get the subject counts for each age band in the filtered DataFrame
+age_bands = pd.cut(filtered_df['age'], bins=[0, 50, 60, 70, 80, float('inf')], right=False,
+                   labels=["<50", "50-59", "60-69", "70-79", "80+"])
+age_counts = age_bands.value_counts()
+
+# Iterate through each age band and count
+for age_band, count in age_counts.items():
+    # Obtain the row from my result
+    my_row = age_output_df[age_output_df['age_band'] == age_band]
+    if my_row.empty:
+        # Empty bands are left out of my result
+        if count == 0:
+            print(f"{age_band} passed the cell subset test for age bands!")
+        continue
+    # Get my subject count
+    my_count = my_row['subject_count'].tolist()[0]
+    # Compare my count to the actual count
+    if count == my_count:
+        print(f"{age_band} passed the cell subset test for age bands!")
+
+print()
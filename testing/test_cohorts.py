@@ -0,0 +1,55 @@
+import sys
+import pandas as pd
+
+# Import the cohort engine from the code folder
+sys.path.insert(0, "code")
+from db import CellDataLoader
+from cohorts import BASELINE_COHORT, Cohort, CohortQueryEngine
+
+# Read the input file
+input_df = pd.read_csv("input/cell_counts.csv")
+
+# Open the database built by run_all.sh
+loader = CellDataLoader("code/cell_data.db", profile="read_mostly")
+engine = CohortQueryEngine(loader)
+
+# Store cohorts beyond the default one: other conditions, treatments, timepoints and several values at once
+cohorts = [
+    BASELINE_COHORT,
+    Cohort("carcinoma_phauximab", condition="carcinoma", treatment="phauximab"),
+    Cohort("melanoma_day_7_14", condition="melanoma", time_from_treatment_start=[7, 14], sample_type="PBMC"),
+    Cohort("healthy_females", condition="healthy", sex="F")
+]
+
+# Iterate over the groups
+for group in ["project", "response", "sex"]:
+    # Count the samples of every cohort in one query
+    batch_df = engine.count_by(group, cohorts).set_index(group)
+
+    # Every cohort's counts should match the same filters applied to the input file
+    failed = []
+    for cohort in cohorts:
+        matches = pd.Series(True, index=input_df.index)
+        for column, values in cohort.filters.items():
+            matches &= input_df[column].isin(values)
+        expected = input_df[matches][group].value_counts()
+        counts = batch_df[cohort.name]
+        if not counts[counts > 0].sort_index().equals(expected.sort_index().rename(cohort.name).rename_axis(group)):
+            failed.append(cohort.name)
+
+    if not failed:
+        print(f"batch counts by {group} passed the cohort test!")
+    else:
+        print(f"batch counts by {group} FAILED the cohort test: {failed}")
+
+# Cohorts with the same filtered columns should share one compiled statement, with only the parameters changing
+first_query, first_params = engine.count_query("sex", [Cohort("a", condition="melanoma", treatment="miraclib")])
+second_query, second_params = engine.count_query("sex", [Cohort("b", condition="carcinoma", treatment="none")])
+if first_query is second_query and first_params != second_params:
+    print("compiled statement reuse passed the cohort test!")
+else:
+    print("compiled statement reuse FAILED the cohort test")
+
+loader.close()
+
+print()
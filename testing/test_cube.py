@@ -0,0 +1,70 @@
+import sys
+import pandas as pd
+
+# Import the cube from the code folder
+sys.path.insert(0, "code")
+from cohorts import BASELINE_COHORT, RESPONSE_COHORT, Cohort
+from cube import CellCube
+
+# Read the input and output CSV files
+input_df = pd.read_csv("input/cell_counts.csv")
+project_output_df = pd.read_csv("output/cell_project_summary.csv")
+gender_output_df = pd.read_csv("output/cell_gender_summary.csv")
+response_output_df = pd.read_csv("output/cell_response.csv")
+populations = ["b_cell", "cd8_t_cell", "cd4_t_cell", "nk_cell", "monocyte"]
+
+# Open the cube built by run_all.sh
+cube = CellCube(profile="read_mostly")
+
+# Rolling the baseline cohort up to projects and sexes should reproduce the subset outputs
+projects_df = cube.query(["project"], BASELINE_COHORT)
+sexes_df = cube.query(["sex"], BASELINE_COHORT)
+if projects_df["samples"].tolist() == project_output_df["sample_count"].tolist() and \
+        sexes_df["samples"].tolist() == gender_output_df["subject_count"].tolist():
+    print("baseline roll-ups passed the cube test!")
+else:
+    print("baseline roll-ups FAILED the cube test")
+
+# Comparing responders and non-responders by population should reproduce the summed cell response counts
+compared_df = cube.compare([RESPONSE_COHORT.where("yes", response="yes"), RESPONSE_COHORT.where("no", response="no")])
+expected = response_output_df.groupby(["response", "population"])["total_population_count"].sum()
+actual = compared_df.set_index(["cohort", "population"])["count"]
+if actual.sort_index().tolist() == expected.sort_index().tolist():
+    print("response comparison passed the cube test!")
+else:
+    print("response comparison FAILED the cube test")
+
+# Any slice should match the same aggregation of the input file, e.g. carcinoma samples on days 7 and 14
+cohort = Cohort("carcinoma_later", condition="carcinoma", time_from_treatment_start=[7, 14])
+slice_df = cube.query(["treatment", "population"], cohort, populations=["b_cell", "monocyte"])
+rows = input_df[(input_df["condition"] == "carcinoma") & input_df["time_from_treatment_start"].isin([7, 14])]
+long_df = rows.melt(id_vars=["treatment"], value_vars=["b_cell", "monocyte"], var_name="population")
+expected = long_df.groupby(["treatment", "population"])["value"].sum()
+totals = rows.assign(total=rows[populations].sum(axis=1)).groupby("treatment")["total"].sum()
+if slice_df.set_index(["treatment", "population"])["count"].equals(expected.rename("count")) and \
+        (slice_df.groupby("treatment")["total_count"].first() == totals).all():
+    print("arbitrary slice passed the cube test!")
+else:
+    print("arbitrary slice FAILED the cube test")
+
+# Filtering several populations without grouping them should count each sample and its cells once
+combined_df = cube.query(["treatment"], cohort, populations=["b_cell", "monocyte"]).set_index("treatment")
+expected_df = rows.assign(count=rows[["b_cell", "monocyte"]].sum(axis=1), total=rows[populations].sum(axis=1)) \
+    .groupby("treatment").agg(samples=("sample", "size"), count=("count", "sum"), total_count=("total", "sum"))
+expected_df["percentage"] = (100 * expected_df["count"] / expected_df["total_count"]).round(2)
+if combined_df[["samples", "count", "total_count"]].equals(expected_df[["samples", "count", "total_count"]]) and \
+        (combined_df["percentage"] - expected_df["percentage"]).abs().max() < 0.01:
+    print("combined populations passed the cube test!")
+else:
+    print("combined populations FAILED the cube test")
+
+# The grand total should count every sample and cell once
+total_df = cube.query()
+if total_df["samples"].iloc[0] == len(input_df) and total_df["count"].iloc[0] == input_df[populations].sum().sum():
+    print("grand total passed the cube test!")
+else:
+    print("grand total FAILED the cube test")
+
+cube.loader.close()
+
+print()
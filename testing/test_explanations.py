@@ -0,0 +1,139 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+from google.genai import errors
+
+# Import the explanation engine from the code folder
+sys.path.insert(0, "code")
+from explanations import ExplanationCache, ExplanationEngine, TokenBucket, all_prompts
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModels:
+    """
+    Local stand-in for client.models that answers after a delay, optionally failing first.
+    """
+
+    def __init__(self, delay=0.0, failures=()):
+        self.delay = delay
+        self.failures = list(failures)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def generate_content(self, model, contents):
+        with self.lock:
+            self.calls += 1
+            failure = self.failures.pop(0) if self.failures else None
+        if failure is not None:
+            raise errors.APIError(failure, {"error": {"message": f"fake error {failure}"}})
+        time.sleep(self.delay)
+        return FakeResponse(f" insight for: {contents} ")
+
+class FakeClient:
+    def __init__(self, **kwargs):
+        self.models = FakeModels(**kwargs)
+
+# Store one prompt per cell type
+prompts = {cell_type: cell_type for cell_type in ["b_cell", "cd8_t_cell", "cd4_t_cell", "nk_cell", "monocyte"]}
+
+# The five prompts should run concurrently on the one client instead of one after another
+client = FakeClient(delay=0.3)
+engine = ExplanationEngine(client, rate_limiter=TokenBucket(rate=100, capacity=5))
+start_time = time.perf_counter()
+results = dict(engine.explain_all(prompts))
+elapsed = time.perf_counter() - start_time
+if elapsed < 1.0 and client.models.calls == 5 and results["nk_cell"] == "insight for: nk_cell":
+    print("concurrent requests passed the explanation test!")
+else:
+    print(f"concurrent requests FAILED the explanation test: {elapsed:.2f}s, {client.models.calls} calls")
+
+# A bucket of 2 tokens refilling at 10 per second should space 6 requests over at least 0.4 seconds
+client = FakeClient()
+engine = ExplanationEngine(client, rate_limiter=TokenBucket(rate=10, capacity=2))
+start_time = time.perf_counter()
+list(engine.explain_all({i: str(i) for i in range(6)}))
+elapsed = time.perf_counter() - start_time
+if elapsed >= 0.38:
+    print("rate limiter passed the explanation test!")
+else:
+    print(f"rate limiter FAILED the explanation test: 6 requests took only {elapsed:.2f}s")
+
+# Rate limiting errors should be retried with backoff until the request succeeds
+client = FakeClient(failures=[429, 503])
+waits = []
+engine = ExplanationEngine(client, rate_limiter=TokenBucket(rate=100, capacity=5), backoff=0.01,
+                           sleep=waits.append)
+text = engine.explain("b_cell")
+if text == "insight for: b_cell" and client.models.calls == 3 and waits[0] >= 0.01 and waits[1] >= 0.02:
+    print("retry with backoff passed the explanation test!")
+else:
+    print(f"retry with backoff FAILED the explanation test: {text}, {client.models.calls} calls")
+
+# Other API errors should not be retried
+client = FakeClient(failures=[400])
+engine = ExplanationEngine(client, rate_limiter=TokenBucket(rate=100, capacity=5), sleep=lambda s: None)
+text = engine.explain("b_cell")
+if client.models.calls == 1 and text.startswith("Unable to generate insight due to an API error"):
+    print("non-retryable errors passed the explanation test!")
+else:
+    print(f"non-retryable errors FAILED the explanation test: {text}, {client.models.calls} calls")
+
+# There should be one prompt per prediction label, cell type and level
+if len(set(all_prompts(list(prompts)).values())) == 30:
+    print("distinct prompts passed the explanation test!")
+else:
+    print("distinct prompts FAILED the explanation test")
+
+# Use a fake clock and a temporary cache file
+now = [1000.0]
+cache_path = os.path.join(tempfile.mkdtemp(), "explanation_cache.db")
+cache = ExplanationCache(cache_path, ttl=60, max_entries=3, clock=lambda: now[0])
+
+# A cached prompt should be served without calling the client again
+client = FakeClient()
+engine = ExplanationEngine(client, rate_limiter=TokenBucket(rate=100, capacity=5), cache=cache)
+first = engine.explain("b_cell")
+second = engine.explain("b_cell")
+if first == second == "insight for: b_cell" and client.models.calls == 1:
+    print("cache hit passed the explanation test!")
+else:
+    print(f"cache hit FAILED the explanation test: {client.models.calls} calls")
+
+# An expired entry should be generated again
+now[0] += 61
+engine.explain("b_cell")
+if client.models.calls == 2:
+    print("cache expiry passed the explanation test!")
+else:
+    print(f"cache expiry FAILED the explanation test: {client.models.calls} calls")
+
+# When the API fails, an expired entry should still be shown instead of the error
+now[0] += 61
+failing_engine = ExplanationEngine(FakeClient(failures=[400]), rate_limiter=TokenBucket(rate=100, capacity=5),
+                                   cache=cache)
+offline_engine = ExplanationEngine(None, cache=cache)
+if failing_engine.explain("b_cell") == "insight for: b_cell" and offline_engine.explain("b_cell") == "insight for: b_cell":
+    print("stale fallback passed the explanation test!")
+else:
+    print("stale fallback FAILED the explanation test")
+
+# Beyond 3 entries, the least recently used ones should be evicted (b_cell, then cd4_t_cell)
+for cell_type in ["cd8_t_cell", "cd4_t_cell", "nk_cell"]:
+    now[0] += 1
+    engine.explain(cell_type)
+now[0] += 1
+engine.explain("cd8_t_cell")
+now[0] += 1
+engine.explain("monocyte")
+cached = {p for p in prompts if cache.get(engine.model, p, include_expired=True) is not None}
+if cached == {"cd8_t_cell", "nk_cell", "monocyte"}:
+    print("cache eviction passed the explanation test!")
+else:
+    print(f"cache eviction FAILED the explanation test: {sorted(cached)} are cached")
+cache.close()
+
+print()
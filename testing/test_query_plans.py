@@ -0,0 +1,71 @@
+import sys
+
+# Import the analysis queries from the code folder
+sys.path.insert(0, "code")
+from db import CellDataLoader
+from cell_population_summary import SUMMARY_QUERY, CHANGED_SUMMARY_QUERY
+from cohorts import BASELINE_COHORT, RESPONSE_COHORT, CohortQueryEngine
+from cube import CUBE_QUERY, CellCube
+from summary_queries import KEYS_QUERY, CellSummaryQueries
+
+# Open the database built by run_all.sh
+loader = CellDataLoader("code/cell_data.db", profile="read_mostly")
+
+# Compile the queries of the default cohorts
+engine = CohortQueryEngine(loader)
+
+# Queries that aggregate or list a whole table on purpose, with the full scans each one is expected to make.
+# Every other query must search every table through an index.
+FULL_AGGREGATES = {
+    "cell population summary": ["SCAN c USING COVERING INDEX idx_cell_counts_sample_type_count"],
+    "cell summary keys": ["SCAN cell_summary USING COVERING INDEX idx_cell_summary_sample_cell_type"],
+    "cell cube": ["SCAN c", "SCAN cell_summary USING COVERING INDEX idx_cell_summary_sample_cell_type"],
+    "cell cube slice": ["SCAN cc"],
+    "first page with sample=None, population=None": ["SCAN cs USING COVERING INDEX idx_cell_summary_sample_cell_type"]
+}
+
+# Store the shipped queries and their parameters with a name for each
+queries = {
+    "cell population summary": (SUMMARY_QUERY, ()),
+    "changed cell population summary": (CHANGED_SUMMARY_QUERY, ()),
+    "cell response analysis": engine.response_query(RESPONSE_COHORT),
+    "baseline cohort samples": engine.materialize_query(BASELINE_COHORT, "baseline_samples"),
+    "samples per project": engine.count_query("project", [BASELINE_COHORT]),
+    "subjects by response": engine.count_query("response", [BASELINE_COHORT.where(response=("yes", "no"))]),
+    "subjects by gender": engine.count_query("sex", [BASELINE_COHORT]),
+    "cell summary keys": (KEYS_QUERY, ()),
+    "cell cube": (CUBE_QUERY, ()),
+    "cell cube slice": CellCube.query_sql(("population",), RESPONSE_COHORT)
+}
+
+# Iterate over the queries
+for name, (query, params) in queries.items():
+    # Obtain the steps of the query plan that scan a whole table
+    scans = loader.full_table_scans(query, params)
+
+    # Every table should be searched through an index, apart from the expected scans of the full aggregates
+    if scans == FULL_AGGREGATES.get(name, []):
+        print(f"{name} passed the query plan test!")
+    else:
+        print(f"{name} FAILED the query plan test: {scans}")
+
+# Build the dashboard's page queries for every filter and keyset direction
+summary_queries = CellSummaryQueries(loader=loader)
+key = ("sample01369", "cd8_t_cell")
+for sample, population in [(None, None), ("sample01369", None), (None, "monocyte"), ("sample01369", "nk_cell")]:
+    for direction in ["first", "after", "before"]:
+        position = {} if direction == "first" else {direction: key}
+        query, params, _ = summary_queries.page_query(sample, population, **position)
+
+        # Every page should be read through an index of 'cell_summary' without sorting the whole table; only the
+        # unfiltered first page reads the sample index from its start
+        plan = loader.full_table_scans(query, params)
+        loader.cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+        sorts = [detail for _, _, _, detail in loader.cursor.fetchall() if detail == "USE TEMP B-TREE FOR ORDER BY"]
+        name = f"{direction} page with sample={sample}, population={population}"
+        if plan == FULL_AGGREGATES.get(name, []) and not sorts:
+            print(f"{name} passed the query plan test!")
+        else:
+            print(f"{name} FAILED the query plan test: {plan + sorts}")
+
+print()
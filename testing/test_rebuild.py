@@ -0,0 +1,75 @@
+import os
+import shutil
+import sys
+import tempfile
+import pandas as pd
+
+# Import the rebuilder from the code folder
+sys.path.insert(0, os.path.abspath("code"))
+from cell_population_summary import SUMMARY_OUTPUT_QUERY
+from cell_response_analysis import RESPONSE_OUTPUT_QUERY
+from db import CellDataLoader
+from rebuild import DatabaseRebuilder
+
+# Rebuild in a scratch copy of the project folders, so the database and outputs of run_all.sh are untouched
+with open("input/cell_counts.csv") as f:
+    lines = f.read().splitlines()
+model_path = os.path.abspath("output/response_model.pkl")
+work_dir = tempfile.mkdtemp()
+os.chdir(work_dir)
+for folder in ["input", "output", "code"]:
+    os.makedirs(folder)
+if os.path.exists(model_path):
+    shutil.copy(model_path, "output/response_model.pkl")
+
+def write_input(rows):
+    """
+    Write the header and the given rows of the input file to the scratch input file.
+    """
+
+    with open("input/cell_counts.csv", "w") as f:
+        f.write("\n".join([lines[0]] + rows) + "\n")
+
+def outputs_match(name):
+    """
+    Check that the summary and response outputs are the tables of the live database version.
+    """
+
+    loader = CellDataLoader(profile="read_mostly")
+    matched = True
+    for query, output_path in [(SUMMARY_OUTPUT_QUERY, "output/cell_summary.csv"),
+                               (RESPONSE_OUTPUT_QUERY, "output/cell_response.csv")]:
+        with open(output_path) as f:
+            matched = matched and f.read() == pd.read_sql_query(query, loader.conn).to_csv(index=False)
+    loader.close()
+
+    if matched:
+        print(f"{name} passed the rebuild test!")
+    else:
+        print(f"{name} FAILED the rebuild test")
+
+rebuilder = DatabaseRebuilder()
+
+# Rebuild from the whole input file, then from its first half, checking the outputs after each switch
+write_input(lines[1:])
+first_version = rebuilder.rebuild()
+outputs_match("outputs of the full rebuild")
+with open("output/cell_summary.csv") as f:
+    full_summary = f.read()
+
+write_input(lines[1:len(lines) // 2])
+rebuilder.rebuild()
+outputs_match("outputs of the partial rebuild")
+
+# Rolling back should restore the first version and regenerate the outputs from it
+restored_version = rebuilder.rollback()
+outputs_match("outputs of the rollback")
+with open("output/cell_summary.csv") as f:
+    if restored_version == first_version and f.read() == full_summary:
+        print("restored version passed the rebuild test!")
+    else:
+        print("restored version FAILED the rebuild test")
+
+# Remove the scratch folders
+os.chdir("/")
+shutil.rmtree(work_dir)
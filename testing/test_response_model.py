@@ -0,0 +1,49 @@
+import math
+import os
+import sys
+import pandas as pd
+
+# Import the model trainer from the code folder
+sys.path.insert(0, "code")
+from response_model import ResponseModelTrainer, build_features, feature_contributions, training_fingerprint
+
+# Load the model artifact saved by run_all.sh
+trainer = ResponseModelTrainer()
+artifact = trainer.load()
+
+# The saved model should have been trained on the current cell response output
+features_df = build_features(pd.read_csv("output/cell_response.csv"))
+if artifact is not None and artifact["fingerprint"] == training_fingerprint(features_df):
+    print("saved model fingerprint passed the response model test!")
+else:
+    print("saved model fingerprint FAILED the response model test")
+
+# Loading again with unchanged data should reuse the saved file instead of retraining
+modified_time = os.path.getmtime(trainer.model_path)
+reused = trainer.load_or_train()
+if os.path.getmtime(trainer.model_path) == modified_time and reused["fingerprint"] == artifact["fingerprint"]:
+    print("unchanged data passed the response model test!")
+else:
+    print("unchanged data FAILED the response model test: the model was retrained")
+
+# The saved model should predict exactly like a model trained from scratch on the same data
+fresh = trainer.train(features_df)
+X = features_df[artifact["feature_names"]]
+if (artifact["model"].predict_proba(X) == fresh["model"].predict_proba(X)).all() and \
+        artifact["test_accuracy"] == fresh["test_accuracy"]:
+    print("saved predictions passed the response model test!")
+else:
+    print("saved predictions FAILED the response model test")
+
+# The local contributions of a patient plus the base value should add up to the model's log-odds
+patient = X.iloc[0].to_dict()
+contributions_df, base_value = feature_contributions(artifact, patient)
+probability = artifact["model"].predict_proba(X.iloc[[0]])[0][1]
+log_odds = math.log(probability / (1 - probability))
+ranked = contributions_df["contribution"].abs().is_monotonic_decreasing
+if abs(contributions_df["contribution"].sum() + base_value - log_odds) < 1e-4 and ranked:
+    print("feature contributions passed the response model test!")
+else:
+    print("feature contributions FAILED the response model test")
+
+print()
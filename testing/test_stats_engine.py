@@ -0,0 +1,68 @@
+import sys
+import numpy as np
+import pandas as pd
+from scipy.stats import mannwhitneyu, ranksums
+from statsmodels.stats.multitest import multipletests
+
+# Import the batch testing engine from the code folder
+sys.path.insert(0, "code")
+from stats_engine import benjamini_hochberg, compare_groups, rank_sum_matrix
+
+# Build a random matrix of 50 populations x 120 subjects with ties and missing values
+rng = np.random.default_rng(42)
+values = rng.integers(0, 40, size=(50, 120)).astype(float)
+values[rng.random(values.shape) < 0.1] = np.nan
+in_group = rng.random(120) < 0.4
+
+# Every row should match scipy's rank-sum test and rank-biserial correlation on that row alone
+results = rank_sum_matrix(values, in_group)
+matches = True
+for i, row in enumerate(values):
+    first = row[in_group & ~np.isnan(row)]
+    second = row[~in_group & ~np.isnan(row)]
+    stat, p_value = ranksums(first, second)
+    effect_size = 2 * mannwhitneyu(first, second).statistic / (len(first) * len(second)) - 1
+    matches &= bool(np.isclose(results["statistic"][i], stat) and np.isclose(results["p_value"][i], p_value) and
+                    np.isclose(results["effect_size"][i], effect_size))
+if matches:
+    print("rank-sum matrix passed the statistics engine test!")
+else:
+    print("rank-sum matrix FAILED the statistics engine test")
+
+# The adjusted p-values should match statsmodels' Benjamini-Hochberg correction, keeping missing values
+p_values = np.append(results["p_value"].to_numpy(), np.nan)
+adjusted = benjamini_hochberg(p_values)
+expected = multipletests(p_values[:-1], method="fdr_bh")[1]
+if np.allclose(adjusted[:-1], expected) and np.isnan(adjusted[-1]):
+    print("Benjamini-Hochberg passed the statistics engine test!")
+else:
+    print("Benjamini-Hochberg FAILED the statistics engine test")
+
+# Any column can split the cohort, e.g. sex instead of response
+long_df = pd.read_csv("output/cell_response.csv")
+sexes = {subject: "M" if i % 2 else "F" for i, subject in enumerate(long_df["subject"].unique())}
+long_df["sex"] = long_df["subject"].map(sexes)
+by_sex = compare_groups(long_df, split="sex", first="M", second="F")
+cell_df = long_df[long_df["population"] == "b_cell"]
+stat, p_value = ranksums(cell_df[cell_df["sex"] == "M"]["percentage"], cell_df[cell_df["sex"] == "F"]["percentage"])
+if len(by_sex) == 5 and np.isclose(by_sex.loc["b_cell", "statistic"], stat) and \
+        np.isclose(by_sex.loc["b_cell", "p_value"], p_value):
+    print("cohort split passed the statistics engine test!")
+else:
+    print("cohort split FAILED the statistics engine test")
+
+# A frame with several rows per subject should be rejected unless they are aggregated explicitly
+repeated_df = pd.concat([long_df, long_df.assign(percentage=long_df["percentage"] + 1)], ignore_index=True)
+try:
+    compare_groups(repeated_df, split="sex", first="M", second="F")
+    rejected = False
+except ValueError:
+    rejected = True
+by_mean = compare_groups(repeated_df, split="sex", first="M", second="F", aggfunc="mean")
+expected = compare_groups(long_df.assign(percentage=long_df["percentage"] + 0.5), split="sex", first="M", second="F")
+if rejected and np.allclose(by_mean["p_value"], expected["p_value"]):
+    print("repeated units passed the statistics engine test!")
+else:
+    print("repeated units FAILED the statistics engine test")
+
+print()
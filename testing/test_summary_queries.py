@@ -0,0 +1,95 @@
+import sys
+import pandas as pd
+
+# Import the paginated queries from the code folder
+sys.path.insert(0, "code")
+from summary_queries import CellSummaryQueries
+
+# Read the cell population summary output written by run_all.sh
+output_df = pd.read_csv("output/cell_summary.csv")
+
+# Open the database built by run_all.sh
+queries = CellSummaryQueries()
+
+# Store the filters to page through, as (sample, population) with None for all
+filters = [(None, None), ("sample01369", None), (None, "monocyte"), ("sample01369", "nk_cell")]
+
+# Iterate over the filters
+for sample, population in filters:
+    # Obtain the rows of the output file matching the filter
+    expected_df = output_df
+    if sample is not None:
+        expected_df = expected_df[expected_df["sample"] == sample]
+    if population is not None:
+        expected_df = expected_df[expected_df["population"] == population]
+    expected_df = expected_df.reset_index(drop=True)
+
+    # Page forward through the filtered rows, each page starting after the last row of the previous one
+    pages = [queries.page(sample, population, limit=1000)]
+    while len(pages[-1]) == 1000:
+        last = tuple(pages[-1].iloc[-1][["sample", "population"]])
+        pages.append(queries.page(sample, population, after=last, limit=1000))
+    paged_df = pd.concat(pages, ignore_index=True)
+
+    # The pages together should be the filtered output, in the same order
+    name = f"sample={sample}, population={population}"
+    if paged_df.equals(expected_df):
+        print(f"forward pages with {name} passed the summary query test!")
+    else:
+        print(f"forward pages with {name} FAILED the summary query test")
+
+# Going back from the second page should return the first page, and reading a page from its
+# first row should return the same page
+first = queries.page(limit=10)
+second = queries.page(after=tuple(first.iloc[-1][["sample", "population"]]), limit=10)
+back = queries.page(before=tuple(second.iloc[0][["sample", "population"]]), limit=10)
+again = queries.page(start=tuple(second.iloc[0][["sample", "population"]]), limit=10)
+if back.equals(first) and again.equals(second) and second.equals(output_df.iloc[10:20].reset_index(drop=True)):
+    print("previous and current pages passed the summary query test!")
+else:
+    print("previous and current pages FAILED the summary query test")
+
+# The filter index should list every row of the output in order, and find the rows and pages of each filter
+filter_index = queries.filter_index()
+keys = [filter_index.key(position) for position in range(filter_index.count())]
+if keys == list(output_df[["sample", "population"]].itertuples(index=False, name=None)) and \
+        filter_index.samples.tolist() == sorted(output_df["sample"].unique()):
+    print("filter index keys passed the summary query test!")
+else:
+    print("filter index keys FAILED the summary query test")
+
+for sample, population in filters:
+    # Obtain the positions of the output rows matching the filter
+    matches = pd.Series(True, index=output_df.index)
+    if sample is not None:
+        matches &= output_df["sample"] == sample
+    if population is not None:
+        matches &= output_df["population"] == population
+    expected = matches[matches].index.to_numpy()
+
+    # The third page read from its start key should be the third page of the filtered output
+    start = filter_index.page_start(2, sample, population, page_size=3)
+    page_df = queries.page(sample, population, start=start, limit=3) if start else output_df.iloc[[]]
+    expected_page_df = output_df.iloc[expected[6:9]].reset_index(drop=True)
+
+    name = f"sample={sample}, population={population}"
+    if (filter_index.positions(sample, population) == expected).all() and \
+            filter_index.count(sample, population) == len(expected) and \
+            page_df.reset_index(drop=True).equals(expected_page_df):
+        print(f"filter index with {name} passed the summary query test!")
+    else:
+        print(f"filter index with {name} FAILED the summary query test")
+
+# The prefix search should return the first matching samples in order and count all of them
+all_samples = sorted(output_df["sample"].unique())
+for prefix in ["", "sample0136", "sample10", "nope"]:
+    expected = [sample for sample in all_samples if sample.startswith(prefix)]
+    matches, total = filter_index.search(prefix, limit=20)
+    if matches == expected[:20] and total == len(expected):
+        print(f"sample search for '{prefix}' passed the summary query test!")
+    else:
+        print(f"sample search for '{prefix}' FAILED the summary query test")
+
+queries.close()
+
+print()